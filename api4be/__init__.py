@@ -18,14 +18,22 @@ import logging, os
 from flask_cors import CORS
 
 import api4be.config
+from api4be.components.admission import admission
 from api4be.components.cache import cache
 from api4be.components.repositories.ifc_file_repository import IfcFileRepository
-from flask import Flask, render_template
+from flask import Flask, render_template, jsonify
 
 from api4be.components.routes import bim
 from api4be.components.routes import gim
+from api4be.components.utils.geometry_pool import GeometryPoolBusy
+from api4be.components.utils.routes_utils import InvalidQueryParameter
+from api4be.prefork import prepare_fork
 
-def create_app(serving_path=os.path.join(os.path.dirname(__file__), "data"), collections=None):
+def create_app(serving_path=os.path.join(os.path.dirname(__file__), "data"), collections=None, prefork=config.PREFORK):
+    """
+    Creates the app serving the collections. With prefork the app is created once in the master of a
+    pre-fork server (e.g. gunicorn --preload), the workers share the read-only models and the cached responses.
+    """
 
     app = Flask(__name__)
     CORS(app)
@@ -33,12 +41,36 @@ def create_app(serving_path=os.path.join(os.path.dirname(__file__), "data"), col
     logging.basicConfig(format='[%(levelname)s] %(asctime)s %(funcName)s: %(message)s', datefmt='%Y-%m-%dT%H:%M:%S%z',
                         level=logging.DEBUG)
     app.url_map.strict_slashes = False
+    shared_cache = prefork and app.config['CACHE_TYPE'] == 'SimpleCache'
+    if shared_cache:
+        # the responses cached by a worker are shared with the other workers, in files expiring after a while
+        app.config['CACHE_TYPE'] = 'FileSystemCache'
+        if not app.config['CACHE_DEFAULT_TIMEOUT']:
+            app.config['CACHE_DEFAULT_TIMEOUT'] = app.config['PREFORK_CACHE_TIMEOUT']
 
     ifc_file_repository = IfcFileRepository.init_ifc_file_repository(serving_path, collections=collections)
 
     app.register_blueprint(bim, url_prefix=config.API_PATH)
     app.register_blueprint(gim, url_prefix=config.API_PATH)
     cache.init_app(app)
+    if shared_cache:
+        # the files survive restarts, responses of the previous models are dropped
+        with app.app_context():
+            cache.clear()
+    admission.init_app(app)
+
+    # changes of a worker would be invisible to the others, so the models are read-only
+    ifc_file_repository.read_only = prefork
+    if prefork:
+        prepare_fork()
+
+    @app.errorhandler(GeometryPoolBusy)
+    def geometry_pool_busy(e):
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+    @app.errorhandler(InvalidQueryParameter)
+    def invalid_query_parameter(e):
+        return jsonify({'error': str(e)}), 400
 
     @app.route('/')
     def landing_page():
@@ -0,0 +1,254 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException, ClientDisconnected
+
+from api4be import config
+from api4be.components.admission import admission
+
+# catalogue and metadata routes, cheap and never waiting for a project lock, so they run on the event loop
+LOOP_ENDPOINTS = {'bim.get_bim', 'bim.get_collections', 'bim.get_collection', 'bim.get_collection_models',
+                  'gim.get_gim', 'gim.get_collections', 'gim.get_collection', 'landing_page', 'admission'}
+
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+class AsgiApp:
+    """
+    ASGI application serving a Flask app. The catalogue and metadata routes run on the event loop, the other
+    routes (serializers, tessellation) are admitted on the event loop (see AdmissionController) and then offloaded
+    to a pool of threads. Request and response bodies are
+    transferred by the event loop, so idle and slow connections do not hold a thread. Request bodies of the
+    offloaded routes are received while the route reads them and are never held in memory as a whole.
+    """
+
+    def __init__(self, app, workers=config.ASGI_WORKERS):
+        self.app = app
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.__lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.__http(scope, receive, send)
+
+    async def __lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        environ = _get_environ(scope)
+        endpoint = self.__get_endpoint(environ)
+        if endpoint in LOOP_ENDPOINTS:
+            # one at a time, never waiting for admission, the (small) body is read first
+            body = await _read_body(receive)
+            environ['CONTENT_LENGTH'] = str(len(body))
+            environ['wsgi.input'] = io.BytesIO(body)
+            environ['api4be.event_loop'] = True
+            response = self.__dispatch(environ)
+        else:
+            environ['wsgi.input'] = io.BufferedReader(AsgiInput(receive, loop))
+            try:
+                if endpoint is not None and admission.classes:
+                    # queued requests wait here, not in a thread of the pool
+                    await admission.admit_async(environ, endpoint)
+                response = await loop.run_in_executor(self.executor, self.__dispatch, environ)
+            finally:
+                # the slot of a request that never reached the admission of the app
+                endpoint_class = environ.pop('api4be.admitted', None)
+                if endpoint_class is not None:
+                    endpoint_class.release()
+
+        app_iter, status, headers = response.get_wsgi_response(environ)
+        await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+        if response.direct_passthrough and isinstance(app_iter, FileWrapper):
+            await self.__send_file(app_iter, send)
+        elif response.is_sequence:
+            await _send_sequence(app_iter, send)
+        else:
+            await _send_stream(app_iter, send)
+
+    def __get_endpoint(self, environ):
+        try:
+            return self.app.url_map.bind_to_environ(environ).match()[0]
+        except HTTPException:
+            return None
+
+    def __dispatch(self, environ):
+        """Runs the request in the Flask app like Flask.wsgi_app, but returns the response object"""
+
+        ctx = self.app.request_context(environ)
+        error = None
+        try:
+            ctx.push()
+            return self.app.full_dispatch_request()
+        except Exception as e:
+            error = e
+            return self.app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+
+    async def __send_file(self, file_wrapper, send):
+        # chunks are read by any thread of the pool, between reads the connection holds no thread
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, file_wrapper.file.read, FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            file_wrapper.close()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+def create_asgi_app(**kwargs):
+    """Creates the app (see create_app) served by an ASGI server"""
+
+    from api4be import create_app
+    return AsgiApp(create_app(**kwargs))
+
+
+class FileWrapper:
+    """wsgi.file_wrapper passing files of send_file to the event loop"""
+
+    def __init__(self, file, buffer_size=8192):
+        self.file = file
+        self.buffer_size = buffer_size
+
+    def __iter__(self):
+        return iter(lambda: self.file.read(self.buffer_size), b'')
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+
+class AsgiInput(io.RawIOBase):
+    """wsgi.input receiving the http.request messages on the event loop while a thread of the pool reads it"""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.body = memoryview(b'')
+        self.more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.body and self.more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            self.body = memoryview(message.get('body', b''))
+            self.more_body = message.get('more_body', False)
+        size = min(len(buffer), len(self.body))
+        buffer[:size] = self.body[:size]
+        self.body = self.body[size:]
+        return size
+
+
+async def _read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def _send_sequence(app_iter, send):
+    # the body is already in memory
+    try:
+        for chunk in app_iter:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _send_stream(app_iter, send):
+    # generated bodies may hold a project lock of the generating thread, so a thread of its own produces them
+    loop = asyncio.get_running_loop()
+    iterator = iter(app_iter)
+    with ThreadPoolExecutor(1, thread_name_prefix='asgi-stream') as stream:
+        try:
+            while True:
+                chunk = await loop.run_in_executor(stream, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(app_iter, 'close'):
+                await loop.run_in_executor(stream, app_iter.close)
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+def _get_environ(scope):
+    """Returns the WSGI environ of an ASGI http scope, the caller sets wsgi.input"""
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        # the input ends with the last http.request message, so bodies without Content-Length are read too
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileWrapper,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+            continue
+        key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
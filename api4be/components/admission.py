@@ -0,0 +1,257 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import asyncio
+import collections
+import threading
+import time
+
+from flask import g, jsonify, request
+from werkzeug.wrappers import Request
+
+from api4be import config
+
+# endpoints answered from indexes and caches
+CHEAP_ENDPOINTS = {'landing_page', 'admission', 'bim.get_bim', 'bim.get_collections', 'bim.get_collection',
+                   'bim.get_collection_models', 'bim.get_job', 'bim.get_ifc_project_spatialtree',
+                   'bim.get_ifc_project_georef', 'bim.get_ifc_project_groundplan', 'bim.get_ifc_element_psets',
+                   'bim.get_ifc_element_pset', 'bim.ifc_project_upload', 'gim.get_gim', 'gim.get_collections',
+                   'gim.get_collection'}
+
+
+def classify_request(endpoint, args, headers):
+    """
+    Returns the class (cheap, standard or expensive) of the cost of a request to endpoint
+    """
+    if endpoint in CHEAP_ENDPOINTS:
+        return 'cheap'
+    if 'respond-async' in headers.get('Prefer', ''):
+        # computed by the deferred jobs, the request only submits the job
+        return 'standard'
+    if endpoint in ['bim.get_ifc_project_geometry', 'bim.get_ifc_element_geometry'] and \
+            args.get('composed', '').lower() == 'true':
+        return 'expensive'
+    if endpoint == 'bim.get_ifc_project' and args.get('format') in ['ifcjson', 'ifc']:
+        return 'expensive'
+    if endpoint == 'gim.get_project' and ('type' in args or 'storey' in args or any('.' in key for key in args)):
+        return 'expensive'
+    return 'standard'
+
+
+class EndpointClass:
+    """
+    Concurrency limit of an endpoint class, requests exceeding it wait in a bounded queue
+    """
+
+    def __init__(self, name, limit, queue_size):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.condition = threading.Condition()
+        # futures of the requests queued on an event loop (see acquire_async), served before the waiting threads
+        self.waiters = collections.deque()
+
+    def acquire(self, timeout):
+        """
+        Returns True when the request is admitted, False when the queue is full or the request waited timeout seconds
+        """
+        with self.condition:
+            if self.running >= self.limit:
+                if self.queued >= self.queue_size:
+                    self.rejected += 1
+                    return False
+                self.queued += 1
+                deadline = time.monotonic() + timeout
+                try:
+                    while self.running >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            return False
+                        self.condition.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.running += 1
+            self.admitted += 1
+            return True
+
+    async def acquire_async(self, timeout):
+        """
+        Like acquire, but a queued request waits on the event loop instead of blocking a thread
+        """
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            if self.running < self.limit:
+                self.running += 1
+                self.admitted += 1
+                return True
+            if self.queued >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.queued += 1
+            waiter = (loop, loop.create_future())
+            self.waiters.append(waiter)
+        try:
+            await asyncio.wait([waiter[1]], timeout=timeout)
+        except BaseException:
+            if not self.__dequeue(waiter):
+                self.release()
+            raise
+        return not self.__dequeue(waiter)
+
+    def __dequeue(self, waiter):
+        """Returns True when the waiter timed out in the queue, a waiter removed by release got its slot"""
+        with self.condition:
+            if waiter not in self.waiters:
+                return False
+            self.waiters.remove(waiter)
+            self.queued -= 1
+            self.rejected += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            if self.waiters:
+                # the slot is handed over, running stays the same
+                loop, future = self.waiters.popleft()
+                self.queued -= 1
+                self.admitted += 1
+                loop.call_soon_threadsafe(_resolve, future)
+            else:
+                self.running -= 1
+                self.condition.notify()
+
+    def get_metrics(self):
+        with self.condition:
+            return {'limit': self.limit, 'queue_size': self.queue_size, 'running': self.running,
+                    'queued': self.queued, 'admitted': self.admitted, 'rejected': self.rejected}
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class AdmittedBody:
+    """
+    Generated body of an admitted request, releasing the slot of its class when it is exhausted or closed
+    """
+
+    def __init__(self, iterable, endpoint_class):
+        self.iterator = iter(iterable)
+        self.endpoint_class = endpoint_class
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.endpoint_class is not None:
+            self.endpoint_class.release()
+            self.endpoint_class = None
+        if hasattr(self.iterator, 'close'):
+            self.iterator.close()
+
+
+class AdmissionController:
+    """
+    Admits requests by the class of their cost (see classify_request), each class with its own concurrency limit and
+    queue, so a burst of expensive requests does not starve the cheap ones. Requests not admitted are rejected with
+    503 and Retry-After, the metrics of the classes are served at <API_PATH>/admission.
+    """
+
+    def __init__(self, app=None):
+        self.classes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.classes = {
+            'cheap': EndpointClass('cheap', config.ADMISSION_CHEAP_LIMIT, config.ADMISSION_CHEAP_QUEUE),
+            'standard': EndpointClass('standard', config.ADMISSION_STANDARD_LIMIT, config.ADMISSION_STANDARD_QUEUE),
+            'expensive': EndpointClass('expensive', config.ADMISSION_EXPENSIVE_LIMIT,
+                                       config.ADMISSION_EXPENSIVE_QUEUE),
+        }
+        app.before_request(self.__admit)
+        app.after_request(self.__release_on_close)
+        app.teardown_request(self.__release)
+        app.add_url_rule(config.API_PATH + '/admission', 'admission', self.__get_metrics)
+
+    def get_metrics(self):
+        return {name: endpoint_class.get_metrics() for name, endpoint_class in self.classes.items()}
+
+    async def admit_async(self, environ, endpoint):
+        """
+        Admits a request on the event loop before it is offloaded to a thread (see AsgiApp), so queued requests do
+        not hold the threads of the pool. The admitted class is passed to the request in environ, or the rejected
+        one to answer with 503.
+        """
+        wsgi_request = Request(environ)
+        endpoint_class = self.classes[classify_request(endpoint, wsgi_request.args, wsgi_request.headers)]
+        if await endpoint_class.acquire_async(config.ADMISSION_QUEUE_TIMEOUT):
+            environ['api4be.admitted'] = endpoint_class
+        else:
+            environ['api4be.rejected'] = endpoint_class
+
+    def __admit(self):
+        if request.endpoint is None or request.environ.get('api4be.event_loop'):
+            return None
+        endpoint_class = request.environ.pop('api4be.rejected', None)
+        if endpoint_class is not None:
+            return self.__reject(endpoint_class)
+        endpoint_class = request.environ.pop('api4be.admitted', None)
+        if endpoint_class is None:
+            endpoint_class = self.classes[classify_request(request.endpoint, request.args, request.headers)]
+            if not endpoint_class.acquire(config.ADMISSION_QUEUE_TIMEOUT):
+                return self.__reject(endpoint_class)
+        g.admitted = endpoint_class
+        return None
+
+    def __reject(self, endpoint_class):
+        return jsonify({'error': 'Too many ' + endpoint_class.name + ' requests, try again later'}), 503, \
+            {'Retry-After': str(config.ADMISSION_RETRY_AFTER)}
+
+    def __release_on_close(self, response):
+        endpoint_class = g.pop('admitted', None)
+        if endpoint_class is None:
+            return response
+        if response.is_streamed and not response.direct_passthrough:
+            # the slot is kept while the body is generated
+            response.response = AdmittedBody(response.response, endpoint_class)
+        else:
+            endpoint_class.release()
+        return response
+
+    def __release(self, error=None):
+        # the request failed before a response was created
+        endpoint_class = g.pop('admitted', None)
+        if endpoint_class is not None:
+            endpoint_class.release()
+
+    def __get_metrics(self):
+        return jsonify(self.get_metrics())
+
+
+admission = AdmissionController()
@@ -0,0 +1,193 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import json
+import os
+import re
+import threading
+
+import ifcopenshell
+
+# marker in the FILE_DESCRIPTION of a compacted IFC file holding the last change sequence it contains
+SEQUENCE_MARKER = 'ChangeLog [{}]'
+SEQUENCE_PATTERN = re.compile(r'^ChangeLog \[(\d+)\]$')
+
+
+class IfcChangeLog:
+    """
+    Durable, append-only log of the entity changes committed to a model since its IFC file was last compacted.
+    Each line is a record of one commit with the state of the created and modified entities and the step ids of
+    the deleted entities. A compacted IFC file stores the sequence of the last record it contains in its header,
+    so a log is replayed from the first record after it.
+    """
+
+    def __init__(self, log_path):
+        self.path = log_path
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.pending = 0
+        # the IFC file misses changes which are not logged
+        self.stale = False
+        for record in self.read_records():
+            self.sequence = record['seq']
+            self.pending += 1
+
+    def read_records(self):
+        """
+        Returns the complete records of the log, an incomplete record of an interrupted commit is cut off
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        valid_size = 0
+        with open(self.path, 'rb') as log_file:
+            for line in log_file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                valid_size += len(line)
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as log_file:
+                log_file.truncate(valid_size)
+        return records
+
+    def append(self, model, changes):
+        """
+        Appends the changes recorded by the change tracker as a record and syncs it to disk
+        """
+        record = {'created': [], 'modified': [], 'deleted': []}
+        for entity_id, change in sorted(changes.changes.items()):
+            if change == 'deleted':
+                record['deleted'].append(entity_id)
+                continue
+            try:
+                entity = model.by_id(entity_id)
+            except RuntimeError:
+                # created or modified and removed without recording it
+                continue
+            record[change].append({'id': entity_id, 'type': entity.is_a(),
+                                   'attributes': [self._encode(value) for value in entity]})
+
+        with self.lock:
+            record['seq'] = self.sequence + 1
+            with open(self.path, 'a') as log_file:
+                log_file.write(json.dumps(record) + '\n')
+                log_file.flush()
+                os.fsync(log_file.fileno())
+            self.sequence = record['seq']
+            self.pending += 1
+        return self.sequence
+
+    def replay(self, model):
+        """
+        Applies the records which are not contained in the (compacted) model and returns their number
+        """
+        compacted = get_compacted_sequence(model)
+        replayed = 0
+        for record in self.read_records():
+            if record['seq'] <= compacted:
+                continue
+            self._apply(model, record)
+            replayed += 1
+        self.sequence = max(self.sequence, compacted)
+        return replayed
+
+    def mark_stale(self):
+        self.stale = True
+
+    def is_compacted(self, ifc_path):
+        return self.pending == 0 and not self.stale and os.path.exists(ifc_path)
+
+    def compact(self, model, ifc_path):
+        """
+        Writes the model with all logged changes atomically to the IFC file (through a temporary file) and
+        truncates the log, nothing is written if the IFC file is up to date
+        """
+        with self.lock:
+            if self.is_compacted(ifc_path):
+                return
+            set_compacted_sequence(model, self.sequence)
+            tmp_path = ifc_path + '.tmp'
+            model.write(tmp_path)
+            with open(tmp_path, 'rb') as tmp_file:
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, ifc_path)
+            # a crash before the truncation is harmless, the records are skipped by the sequence in the header
+            if os.path.exists(self.path):
+                open(self.path, 'w').close()
+            self.pending = 0
+            self.stale = False
+
+    def remove(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.pending = 0
+
+    def _apply(self, model, record):
+        # entities are created first, so created and modified entities can reference each other
+        for entry in record['created']:
+            try:
+                model.by_id(entry['id'])
+            except RuntimeError:
+                model.create_entity(entry['type'], id=entry['id'])
+        for entry in record['created'] + record['modified']:
+            entity = model.by_id(entry['id'])
+            for position, value in enumerate(entry['attributes']):
+                entity[position] = self._decode(model, value)
+        for entity_id in record['deleted']:
+            try:
+                model.remove(model.by_id(entity_id))
+            except RuntimeError:
+                pass
+
+    def _encode(self, value):
+        if isinstance(value, ifcopenshell.entity_instance):
+            if value.id() > 0:
+                return {'ref': value.id()}
+            # defined types (IfcLabel, IfcReal, ...) are values without step id
+            return {'type': value.is_a(), 'value': self._encode(value.wrappedValue)}
+        elif isinstance(value, (tuple, list)):
+            return [self._encode(item) for item in value]
+        return value
+
+    def _decode(self, model, value):
+        if isinstance(value, dict):
+            if 'ref' in value:
+                return model.by_id(value['ref'])
+            return model.create_entity(value['type'], self._decode(model, value['value']))
+        elif isinstance(value, list):
+            return [self._decode(model, item) for item in value]
+        return value
+
+
+def get_compacted_sequence(model):
+    """
+    Returns the sequence of the last change log record contained in the model (0 if none)
+    """
+    for description in model.header.file_description.description:
+        match = SEQUENCE_PATTERN.match(description)
+        if match:
+            return int(match.group(1))
+    return 0
+
+
+def set_compacted_sequence(model, sequence):
+    descriptions = [description for description in model.header.file_description.description
+                    if not SEQUENCE_PATTERN.match(description)]
+    model.header.file_description.description = tuple(descriptions + [SEQUENCE_MARKER.format(sequence)])
@@ -0,0 +1,106 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+# entity types whose changes affect the footprints of the model
+GEOMETRY_TYPES = ['IfcProduct', 'IfcProductRepresentation', 'IfcRepresentation', 'IfcRepresentationItem',
+                  'IfcObjectPlacement']
+
+
+class IfcChangeTracker:
+    """
+    Records the entities created, modified and deleted since the last commit of a model. The entities
+    referenced by a change are captured when it is recorded, so entities must be recorded before they are
+    modified or removed (and after they are created).
+    """
+
+    def __init__(self, ifc_model):
+        self.ifc_model = ifc_model
+        self.reset()
+
+    def reset(self):
+        # step id -> created, modified or deleted
+        self.changes = {}
+        # step ids of objects whose children (decomposition, containment) changed
+        self.structure = set()
+        # step ids of objects whose properties, materials or types changed
+        self.objects = set()
+        self.geometry = False
+
+    def has_changes(self):
+        return len(self.changes) > 0
+
+    def record(self, entity, change='modified'):
+        """
+        Records a change ('created', 'modified' or 'deleted') of the entity
+        """
+        if self.changes.get(entity.id()) == 'created':
+            # entities created and changed (or deleted) since the last commit stay new (or are forgotten)
+            if change == 'deleted':
+                del self.changes[entity.id()]
+        else:
+            self.changes[entity.id()] = change
+        self._capture(entity)
+
+    def record_created(self, entities):
+        for entity in entities:
+            self.record(entity, 'created')
+
+    def get_affected(self):
+        """
+        Returns the step ids of the objects with changed children, the step ids of the objects with changed
+        properties and if the geometry changed. The current state of created and modified entities is included.
+        """
+        for entity_id, change in self.changes.items():
+            if change != 'deleted':
+                self._capture(self.ifc_model.by_id(entity_id))
+        return self.structure, self.objects, self.geometry
+
+    def _capture(self, entity):
+        if entity.is_a('IfcRelContainedInSpatialStructure'):
+            self.structure.add(entity.RelatingStructure.id())
+        elif entity.is_a('IfcRelDecomposes') and hasattr(entity, 'RelatingObject'):
+            self.structure.add(entity.RelatingObject.id())
+        elif entity.is_a('IfcRelDefines') or entity.is_a('IfcRelAssociates'):
+            self.objects.update(element.id() for element in getattr(entity, 'RelatedObjects', None) or ())
+            if entity.is_a('IfcRelDefinesByType'):
+                self.objects.add(entity.RelatingType.id())
+        elif entity.is_a('IfcPropertySetDefinition') or entity.is_a('IfcProperty'):
+            self.objects.update(self._get_objects_of_property(entity))
+        elif entity.is_a('IfcObjectDefinition'):
+            self.objects.add(entity.id())
+            for rel in getattr(entity, 'Decomposes', None) or ():
+                self.structure.add(rel.RelatingObject.id())
+            for rel in getattr(entity, 'ContainedInStructure', None) or ():
+                self.structure.add(rel.RelatingStructure.id())
+
+        if any(entity.is_a(geometry_type) for geometry_type in GEOMETRY_TYPES):
+            self.geometry = True
+
+    def _get_objects_of_property(self, entity):
+        """
+        Returns the step ids of the objects and types using the property (set)
+        """
+        objects = set()
+        stack = [entity]
+        while stack:
+            for inverse in self.ifc_model.get_inverse(stack.pop()):
+                if inverse.is_a('IfcRelDefinesByProperties'):
+                    related = inverse.RelatedObjects
+                    objects.update(element.id() for element in (related if isinstance(related, tuple) else [related]))
+                elif inverse.is_a('IfcTypeObject'):
+                    objects.add(inverse.id())
+                elif inverse.is_a('IfcPropertySetDefinition') or inverse.is_a('IfcProperty'):
+                    stack.append(inverse)
+        return objects
@@ -0,0 +1,105 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+
+# size of the blocks read from request streams and staging files
+BLOCK_SIZE = 1024 * 1024
+
+
+class ChunkedUpload:
+    """
+    Resumable upload of a file in chunks. The chunks are appended to a staging file, the state of the upload
+    is stored next to it, so an upload can be resumed after a restart.
+    """
+
+    def __init__(self, staging_path, collection_name, project_name, size, sha256, upload_id=None):
+        self.id = upload_id if upload_id is not None else uuid.uuid4().hex
+        self.staging_path = staging_path
+        self.collection_name = collection_name
+        self.project_name = project_name
+        self.size = size
+        self.sha256 = sha256.lower()
+        self.part_path = os.path.join(staging_path, self.id + '.part')
+        self.meta_path = os.path.join(staging_path, self.id + '.json')
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_valid_id(upload_id):
+        return re.fullmatch('[0-9a-f]{32}', upload_id) is not None
+
+    @staticmethod
+    def load(staging_path, upload_id):
+        """
+        Loads the upload from its stored state, returns None if it does not exist
+        """
+        meta_path = os.path.join(staging_path, upload_id + '.json')
+        if not ChunkedUpload.is_valid_id(upload_id) or not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        return ChunkedUpload(staging_path, meta['collection'], meta['project'], meta['size'], meta['sha256'],
+                             upload_id=upload_id)
+
+    def save(self):
+        os.makedirs(self.staging_path, exist_ok=True)
+        with open(self.meta_path, 'w') as f:
+            json.dump({'collection': self.collection_name, 'project': self.project_name, 'size': self.size,
+                       'sha256': self.sha256}, f)
+        if not os.path.exists(self.part_path):
+            open(self.part_path, 'wb').close()
+
+    def get_offset(self):
+        return os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+
+    def is_complete(self):
+        return self.get_offset() == self.size
+
+    def append(self, stream):
+        """
+        Appends the stream block by block to the staging file, raises ValueError (and discards the chunk)
+        if the upload would exceed its size
+        """
+        offset = self.get_offset()
+        with open(self.part_path, 'ab') as f:
+            while True:
+                block = stream.read(BLOCK_SIZE)
+                if not block:
+                    break
+                if f.tell() + len(block) > self.size:
+                    f.truncate(offset)
+                    raise ValueError('Chunk exceeds the upload size of ' + str(self.size) + ' bytes')
+                f.write(block)
+        return self.get_offset()
+
+    def verify(self):
+        """
+        Returns True if the SHA-256 checksum of the staging file matches the announced checksum
+        """
+        checksum = hashlib.sha256()
+        with open(self.part_path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                checksum.update(block)
+        return checksum.hexdigest() == self.sha256
+
+    def remove(self, keep_file=False):
+        for path in [self.meta_path] + ([] if keep_file else [self.part_path]):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,50 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+from datetime import datetime, timezone
+
+
+class DeferredJob:
+    """
+    State of a long-running request computed in the background. The job of a request is identified by
+    its url and the version of the project, a finished job keeps the result of the request.
+    """
+
+    def __init__(self, job_id, url):
+        self.id = job_id
+        self.url = url
+        # pending, running, done or failed
+        self.status = 'pending'
+        self.error = None
+        self.result = None
+        self.created = datetime.now(timezone.utc)
+        self.updated = self.created
+
+    def start(self):
+        self.status = 'running'
+        self.updated = datetime.now(timezone.utc)
+
+    def finish(self, result):
+        self.status = 'done'
+        self.result = result
+        self.updated = datetime.now(timezone.utc)
+
+    def fail(self, error):
+        self.status = 'failed'
+        self.error = str(error)
+        self.updated = datetime.now(timezone.utc)
+
+    def is_finished(self):
+        return self.status in ['done', 'failed']
@@ -0,0 +1,71 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import uuid
+from datetime import datetime, timezone
+
+
+class IngestJob:
+    """
+    State of the asynchronous ingestion of an uploaded model. The stages are started in the given order,
+    the project is published by the last stage.
+    """
+
+    def __init__(self, collection_name, project_name, stages):
+        self.id = uuid.uuid4().hex
+        self.collection_name = collection_name
+        self.project_name = project_name
+        # pending, running, done or failed
+        self.status = 'pending'
+        # stage name -> pending, running, done or failed (in order of execution)
+        self.stages = {stage: 'pending' for stage in stages}
+        self.current_stage = None
+        self.error = None
+        self.created = datetime.now(timezone.utc)
+        self.updated = self.created
+
+    def start_stage(self, stage):
+        """
+        Marks the current stage as done and the given stage as running
+        """
+        if self.current_stage is not None:
+            self.stages[self.current_stage] = 'done'
+        self.current_stage = stage
+        self.stages[stage] = 'running'
+        self.status = 'running'
+        self.updated = datetime.now(timezone.utc)
+
+    def finish(self):
+        if self.current_stage is not None:
+            self.stages[self.current_stage] = 'done'
+        self.current_stage = None
+        self.status = 'done'
+        self.updated = datetime.now(timezone.utc)
+
+    def fail(self, error):
+        if self.current_stage is not None:
+            self.stages[self.current_stage] = 'failed'
+        self.status = 'failed'
+        self.error = str(error)
+        self.updated = datetime.now(timezone.utc)
+
+    def is_finished(self):
+        return self.status in ['done', 'failed']
+
+    def get_progress(self):
+        """
+        Returns the share of finished stages (0.0 - 1.0)
+        """
+        return sum(1 for state in self.stages.values() if state == 'done') / len(self.stages)
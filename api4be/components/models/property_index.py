@@ -0,0 +1,119 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import sys
+
+import ifcopenshell.util.element
+
+from api4be.components.utils.property_utils import get_material_as_dict
+
+
+class IfcPropertyIndex:
+    """
+    Index of the property sets and materials of all objects of a model (element -> pset -> property -> value).
+    Names and string values are interned and identical property sets are shared between elements.
+    The returned property dicts are shared and must not be modified.
+    """
+
+    def __init__(self, ifc_model):
+        self.ifc_model = ifc_model
+        # incremented on every change, dependent indexes compare it to detect changes
+        self.version = 0
+        # callables notified with the step ids of invalidated elements (None when the index is reloaded)
+        self.listeners = []
+        self.reload_index()
+
+    def reload_index(self):
+        # step id -> ((pset name, properties), ...)
+        self.psets = {}
+        # step id -> step ids of the materials
+        self.element_materials = {}
+        # step id of a material -> material as dict
+        self.materials = {}
+        # hash of a property set -> shared property sets
+        self.pset_pool = {}
+        self.version += 1
+
+        for element in self.ifc_model.by_type('IfcObjectDefinition'):
+            self._index_psets(element)
+            self._index_materials(element)
+        for listener in self.listeners:
+            listener(None)
+
+    def _intern(self, value):
+        if isinstance(value, str):
+            return sys.intern(value)
+        elif isinstance(value, dict):
+            return {self._intern(k): self._intern(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [self._intern(v) for v in value]
+        elif isinstance(value, tuple):
+            return tuple(self._intern(v) for v in value)
+        return value
+
+    def _share(self, properties):
+        """
+        Returns the shared instance of the property set with equal content
+        """
+        key = hash(repr(properties))
+        candidates = self.pset_pool.setdefault(key, [])
+        for candidate in candidates:
+            if candidate == properties:
+                return candidate
+        candidates.append(properties)
+        return properties
+
+    def _index_psets(self, element):
+        psets = ifcopenshell.util.element.get_psets(element)
+        self.psets[element.id()] = tuple(
+            (sys.intern(name), self._share(self._intern(properties))) for name, properties in psets.items())
+
+    def _index_materials(self, element):
+        materials = ifcopenshell.util.element.get_materials(element)
+        for material in materials:
+            if material.id() not in self.materials:
+                self.materials[material.id()] = self._intern(get_material_as_dict(material))
+        self.element_materials[element.id()] = tuple(material.id() for material in materials)
+
+    def invalidate(self, element):
+        """
+        Removes the indexed properties and materials of the element (and of the occurrences of a type),
+        they are indexed again on next access
+        """
+        self.version += 1
+        elements = [element]
+        if element.is_a('IfcTypeObject'):
+            elements.extend(ifcopenshell.util.element.get_types(element))
+        for current in elements:
+            self.psets.pop(current.id(), None)
+            for material_id in self.element_materials.pop(current.id(), ()):
+                self.materials.pop(material_id, None)
+        for listener in self.listeners:
+            listener([current.id() for current in elements])
+
+    ####################################
+    # Getter for psets and materials
+    ####################################
+
+    def get_psets(self, element):
+        if element.id() not in self.psets:
+            self._index_psets(element)
+        return {name: properties for name, properties in self.psets[element.id()]}
+
+    def get_materials(self, element):
+        if element.id() not in self.element_materials or \
+                any(material_id not in self.materials for material_id in self.element_materials[element.id()]):
+            self._index_materials(element)
+        return [self.materials[material_id] for material_id in self.element_materials[element.id()]]
@@ -0,0 +1,202 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import threading
+from array import array
+
+import ifcopenshell.ifcopenshell_wrapper
+
+from api4be.components.utils.guid_utils import get_guids
+
+
+def normalize_property_value(value):
+    """
+    Normalizes a property value to the string used as key in the property columns
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (int, float)):
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+
+def normalize_query_value(value):
+    """
+    Returns the possible column keys of a value given as string in a query
+    """
+    keys = {value}
+    if value.lower() in ['true', 'false']:
+        keys.add(value.lower())
+    try:
+        keys.add(normalize_property_value(float(value)))
+    except ValueError:
+        pass
+    return keys
+
+
+class IfcQueryIndex:
+    """
+    Columnar indexes of the objects of a model to filter by IFC class (including subtypes), storey
+    and property values. Columns are built on first use, class and storey columns are dropped when the relationship
+    index changes and property columns are updated with the elements invalidated in the property index.
+    Columns are built by the readers of the model, the lock serializes the builds, which are published as a whole.
+    """
+
+    def __init__(self, ifc_model, index, property_index):
+        self.ifc_model = ifc_model
+        self.index = index
+        self.property_index = property_index
+        self.schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name(ifc_model.schema)
+        self.lock = threading.Lock()
+        self.index_version = None
+        # (pset name, property name) -> normalized value -> step ids
+        self.properties = {}
+        self.property_index.listeners.append(self._update_property_columns)
+        self._check_versions()
+
+    def _check_versions(self):
+        if self.index_version == self.index.version:
+            return
+        with self.lock:
+            index_version = self.index.version
+            if self.index_version == index_version:
+                return
+            # class name -> step ids of the objects of exactly this class
+            classes = {}
+            for element in self.ifc_model.by_type('IfcObjectDefinition'):
+                classes.setdefault(element.is_a(), array('l')).append(element.id())
+            if self.index_version is not None:
+                self.properties = self._remove_deleted_objects(classes)
+            self.classes = classes
+            # step id of storey -> step ids of all objects below the storey
+            self.storeys = {}
+            self.index_version = index_version
+
+    def _remove_deleted_objects(self, classes):
+        """
+        Returns the property columns without the objects no longer in the model
+        """
+        object_ids = set()
+        for ids in classes.values():
+            object_ids.update(ids)
+        properties = {}
+        for key, column in self.properties.items():
+            properties[key] = {value: ids & object_ids for value, ids in column.items() if ids & object_ids}
+        return properties
+
+    def _update_property_columns(self, element_ids):
+        """
+        Updates the property columns with the current properties of the elements, all columns are dropped
+        when element_ids is None (reloaded property index)
+        """
+        with self.lock:
+            if element_ids is None:
+                self.properties = {}
+                return
+            element_ids = set(element_ids)
+            properties = {}
+            for (pset_name, property_name), column in self.properties.items():
+                column = {value: ids - element_ids for value, ids in column.items() if ids - element_ids}
+                for element_id in element_ids:
+                    self._add_to_property_column(column, self.ifc_model.by_id(element_id), pset_name, property_name)
+                properties[(pset_name, property_name)] = column
+            self.properties = properties
+
+    def _add_to_property_column(self, column, element, pset_name, property_name):
+        pset = self.property_index.get_psets(element).get(pset_name)
+        if pset is not None and property_name in pset:
+            column.setdefault(normalize_property_value(pset[property_name]), set()).add(element.id())
+
+    def is_ifc_type(self, ifc_type):
+        """
+        Returns True if ifc_type is an entity of the schema of the model
+        """
+        try:
+            return self.schema.declaration_by_name(ifc_type).as_entity() is not None
+        except RuntimeError:
+            return False
+
+    def _get_class_ids(self, ifc_type):
+        declarations = [self.schema.declaration_by_name(ifc_type)]
+        ids = set()
+        while declarations:
+            declaration = declarations.pop()
+            ids.update(self.classes.get(declaration.name(), ()))
+            declarations.extend(declaration.subtypes())
+        return ids
+
+    def _get_storey_ids(self, storey):
+        storey_ids = set()
+        for ifc_storey in self.ifc_model.by_type('IfcBuildingStorey'):
+            if storey in [ifc_storey.Name, ifc_storey.GlobalId, get_guids(ifc_storey.GlobalId)['json_guid']]:
+                elements = self.storeys.get(ifc_storey.id())
+                if elements is None:
+                    with self.lock:
+                        elements = self.storeys.get(ifc_storey.id())
+                        if elements is None:
+                            elements = set()
+                            stack = [ifc_storey]
+                            while stack:
+                                children = self.index.get_children(stack.pop())
+                                elements.update(child.id() for child in children)
+                                stack.extend(children)
+                            self.storeys[ifc_storey.id()] = elements
+                storey_ids.update(elements)
+        return storey_ids
+
+    def _get_property_column(self, pset_name, property_name):
+        key = (pset_name, property_name)
+        column = self.properties.get(key)
+        if column is None:
+            with self.lock:
+                column = self.properties.get(key)
+                if column is None:
+                    column = {}
+                    for element in self.ifc_model.by_type('IfcObjectDefinition'):
+                        self._add_to_property_column(column, element, pset_name, property_name)
+                    self.properties[key] = column
+        return column
+
+    def query(self, ifc_type=None, storey=None, properties=None):
+        """
+        Returns the step ids (ascending) of all objects matching all given filters
+
+        Parameters:
+        ifc_type (str): IFC class, subtypes are included
+        storey (str): name or guid of an IfcBuildingStorey
+        properties (list): (pset name, property name, value) predicates
+        """
+        self._check_versions()
+        result = None
+        if ifc_type is not None:
+            result = self._get_class_ids(ifc_type)
+        if storey is not None:
+            storey_ids = self._get_storey_ids(storey)
+            result = storey_ids if result is None else result & storey_ids
+        for pset_name, property_name, value in properties or []:
+            column = self._get_property_column(pset_name, property_name)
+            property_ids = set()
+            for key in normalize_query_value(value):
+                property_ids.update(column.get(key, ()))
+            result = property_ids if result is None else result & property_ids
+        if result is None:
+            result = set()
+            for ids in self.classes.values():
+                result.update(ids)
+        return sorted(result)
+
+    def query_elements(self, ifc_type=None, storey=None, properties=None):
+        return [self.ifc_model.by_id(element_id) for element_id in self.query(ifc_type, storey, properties)]
@@ -0,0 +1,186 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import threading
+
+from api4be.components.utils.guid_utils import get_guids
+
+
+class IfcRelationshipIndex:
+    """
+    Adjacency index of the decomposition (IsDecomposedBy) and containment (ContainsElements) relationships
+    of a model. All entities are referenced by their step id. Objects not below an IfcProject are indexed on
+    first use while the model is read by several threads, the lock serializes these additions.
+    """
+
+    def __init__(self, ifc_model):
+        self.ifc_model = ifc_model
+        self.lock = threading.Lock()
+        # incremented on every reload, dependent indexes compare it to detect changes
+        self.version = 0
+        self.reload_index()
+
+    def reload_index(self):
+        """
+        (Re)builds the adjacency of all objects below the IfcProject(s) and their geometry elements
+        """
+        # step id -> step id of the parent object
+        self.parents = {}
+        # step id -> step ids of the contained elements (ContainsElements)
+        self.contained = {}
+        # step id -> step ids of the decomposing objects (IsDecomposedBy)
+        self.decomposed = {}
+        # step ids of objects without a Representation attribute (e.g. IfcProject)
+        self.without_representation = set()
+
+        # Geometry elements of all nodes are stored in one flat list, each node references
+        # a contiguous slice [start, end) of this list
+        self.geometry_elements = []
+        self.geometry_ranges = {}
+        self.stale_geometry_elements = 0
+
+        self.guids = {}
+        self.version += 1
+
+        for ifc_project in self.ifc_model.by_type('IfcProject'):
+            self._index_object(ifc_project)
+            self._collect_geometry_elements(ifc_project.id())
+
+    def _index_object(self, ifc_object):
+        """
+        Adds the object and all objects below it to the adjacency (objects already indexed are skipped)
+        """
+        stack = [ifc_object]
+        while stack:
+            current = stack.pop()
+            current_id = current.id()
+            if current_id in self.contained:
+                continue
+
+            contained = []
+            if hasattr(current, 'ContainsElements'):
+                for rel in current.ContainsElements:
+                    contained.extend(rel.RelatedElements)
+            decomposed = []
+            if hasattr(current, 'IsDecomposedBy'):
+                for rel in current.IsDecomposedBy:
+                    decomposed.extend(rel.RelatedObjects)
+            if not hasattr(current, 'Representation'):
+                self.without_representation.add(current_id)
+
+            # contained marks the object as indexed, so it is set last
+            self.decomposed[current_id] = [element.id() for element in decomposed]
+            self.contained[current_id] = [element.id() for element in contained]
+            for child in contained + decomposed:
+                self.parents[child.id()] = current_id
+            stack.extend(reversed(contained + decomposed))
+
+    def _collect_geometry_elements(self, entity_id):
+        """
+        Appends the geometry elements below the entity to the flat list and stores its slice
+        """
+        if entity_id in self.geometry_ranges:
+            start, end = self.geometry_ranges[entity_id]
+            self.geometry_elements.extend(self.geometry_elements[start:end])
+            return
+
+        start = len(self.geometry_elements)
+        for child_id in self.contained[entity_id]:
+            if len(self.decomposed[child_id]) > 0:
+                self._collect_geometry_elements(child_id)
+            else:
+                self.geometry_elements.append(child_id)
+        for child_id in self.decomposed[entity_id]:
+            if child_id not in self.without_representation and (
+                    len(self.decomposed[child_id]) > 0 or len(self.contained[child_id]) > 0):
+                self._collect_geometry_elements(child_id)
+            else:
+                self.geometry_elements.append(child_id)
+        self.geometry_ranges[entity_id] = (start, len(self.geometry_elements))
+
+    def update_objects(self, entity_ids):
+        """
+        Re-indexes the children of the given objects after their decomposition or containment changed.
+        The geometry elements of the objects and their ancestors are collected again on next access.
+        """
+        self.version += 1
+        for entity_id in entity_ids:
+            for child_id in self.contained.pop(entity_id, []) + self.decomposed.pop(entity_id, []):
+                if self.parents.get(child_id) == entity_id:
+                    del self.parents[child_id]
+            self.without_representation.discard(entity_id)
+            try:
+                entity = self.ifc_model.by_id(entity_id)
+            except RuntimeError:
+                # the object has been removed
+                continue
+            self._index_object(entity)
+
+        stale = set()
+        for entity_id in entity_ids:
+            while entity_id is not None and entity_id not in stale:
+                stale.add(entity_id)
+                entity_id = self.parents.get(entity_id)
+        for entity_id in stale:
+            start, end = self.geometry_ranges.pop(entity_id, (0, 0))
+            self.stale_geometry_elements += end - start
+
+        # the slices of stale ranges stay unused in the flat list, it is rebuilt when they are the majority
+        if self.stale_geometry_elements > len(self.geometry_elements) // 2:
+            self.geometry_elements = []
+            self.geometry_ranges = {}
+            self.stale_geometry_elements = 0
+
+    def _get_geometry_range(self, entity):
+        entity_id = entity.id()
+        if entity_id not in self.geometry_ranges:
+            # objects which are not below an IfcProject are indexed on first use
+            with self.lock:
+                if entity_id not in self.geometry_ranges:
+                    self._index_object(entity)
+                    self._collect_geometry_elements(entity_id)
+        return self.geometry_ranges[entity_id]
+
+    ####################################
+    # Getter for relationships
+    ####################################
+
+    def get_parent(self, entity):
+        parent_id = self.parents.get(entity.id())
+        if parent_id is not None:
+            return self.ifc_model.by_id(parent_id)
+
+    def get_children_ids(self, entity):
+        entity_id = entity.id()
+        if entity_id not in self.contained:
+            with self.lock:
+                self._index_object(entity)
+        return self.contained[entity_id] + self.decomposed[entity_id]
+
+    def get_children(self, entity):
+        return [self.ifc_model.by_id(child_id) for child_id in self.get_children_ids(entity)]
+
+    def get_geometry_elements(self, entity):
+        start, end = self._get_geometry_range(entity)
+        return [self.ifc_model.by_id(element_id) for element_id in self.geometry_elements[start:end]]
+
+    def get_geometry_elements_ids(self, entity):
+        start, end = self._get_geometry_range(entity)
+        return [self.get_guids(element_id) for element_id in self.geometry_elements[start:end]]
+
+    def get_guids(self, entity_id):
+        if entity_id not in self.guids:
+            self.guids[entity_id] = get_guids(self.ifc_model.by_id(entity_id).GlobalId)
+        return self.guids[entity_id]
@@ -13,48 +13,99 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
 
+from array import array
+
+from api4be.components.models.relationship_index import IfcRelationshipIndex
+from api4be.components.utils.guid_utils import ifc_2_json_guid
+
+
 class IfcSpatialTree:
+    """
+    Array backed spatial tree of a model. Nodes are stored in breadth-first order, so the children
+    of a node are the contiguous node range [first_child, first_child + child_count).
+    Node 0 is the file (root) node.
+    """
 
-    def __init__(self, name, ifc_model):
+    __slots__ = ('name', 'ifc_model', 'index', 'names', 'types', 'global_ids', 'json_guids', 'parents',
+                 'first_child', 'child_count', 'nodes')
+
+    def __init__(self, name, ifc_model, index=None):
+        self.name = name
         self.ifc_model = ifc_model
-        self.root = SpatialTreeNode(name, 'File', name)
+        self.index = index if index is not None else IfcRelationshipIndex(ifc_model)
         self.reload_tree()
 
-    def add_object_in_tree(self, ifc_object, parent_item):
-        tree_item = SpatialTreeNode(ifc_object.Name, ifc_object.is_a(), ifc_object.GlobalId)
-        parent_item.add_child(tree_item)
-        if hasattr(ifc_object, 'ContainsElements'):
-            for rel in ifc_object.ContainsElements:
-                for element in rel.RelatedElements:
-                    self.add_object_in_tree(element, tree_item)
-        if hasattr(ifc_object, 'IsDecomposedBy'):
-            for rel in ifc_object.IsDecomposedBy:
-                for related_object in rel.RelatedObjects:
-                    self.add_object_in_tree(related_object, tree_item)
-
     def reload_tree(self):
-        self.root.children = []
-        for item in self.ifc_model.by_type('IfcProject'):
-            self.add_object_in_tree(item, self.root)
+        names = [self.name]
+        types = ['File']
+        global_ids = [self.name]
+        json_guids = [self.name]
+        parents = array('l', [-1])
+        first_child = array('l')
+        child_count = array('l')
+        nodes = {}
 
-    def as_dict(self):
-        return self.root.as_dict()
+        objects = [None]
+        node = 0
+        while node < len(objects):
+            if objects[node] is None:
+                children = self.ifc_model.by_type('IfcProject')
+            else:
+                children = self.index.get_children(objects[node])
 
+            first_child.append(len(objects))
+            child_count.append(len(children))
+            for child in children:
+                if child.GlobalId not in nodes:
+                    nodes[child.GlobalId] = len(objects)
+                objects.append(child)
+                names.append(child.Name)
+                types.append(child.is_a())
+                global_ids.append(child.GlobalId)
+                json_guids.append(ifc_2_json_guid(child.GlobalId))
+                parents.append(node)
+            # release the entity as soon as its children are known
+            objects[node] = None
+            node += 1
 
-class SpatialTreeNode:
-    def __init__(self, name, type, globalId):
-        self.name = name
-        self.type = type
-        self.globalId = globalId
-        self.children = []
+        self.names = names
+        self.types = types
+        self.global_ids = global_ids
+        self.json_guids = json_guids
+        self.parents = parents
+        self.first_child = first_child
+        self.child_count = child_count
+        self.nodes = nodes
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_node(self, global_id):
+        """
+        Returns the (first) node of the element with the ifc guid
+        """
+        return self.nodes[global_id]
+
+    def has_node(self, global_id):
+        return global_id in self.nodes
+
+    def get_children(self, node, offset=0, limit=None):
+        start = self.first_child[node] + offset
+        end = self.first_child[node] + self.child_count[node]
+        if limit is not None:
+            end = min(end, start + limit)
+        return range(start, max(start, end))
 
-    def add_child(self, child):
-        self.children.append(child)
+    def get_child_count(self, node):
+        return self.child_count[node]
 
-    def as_dict(self):
+    def as_dict(self, node=0, depth=None):
+        children = []
+        if depth is None or depth > 0:
+            children = [self.as_dict(child, None if depth is None else depth - 1) for child in self.get_children(node)]
         return {
-            'name': self.name,
-            'type': self.type,
-            'globalId': self.globalId,
-            'data': [child.as_dict() for child in self.children if isinstance(child, SpatialTreeNode)]
+            'name': self.names[node],
+            'type': self.types[node],
+            'globalId': self.global_ids[node],
+            'data': children
         }
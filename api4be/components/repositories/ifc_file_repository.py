@@ -15,19 +15,33 @@
 
 import json
 import os
+import re
 import shutil
+import tempfile
 import logging
+import threading
 
 import ifcopenshell
 
-from api4be.components.serializer import bim_deserializer, gim_serializer
+from api4be.components.cache import cache
+from api4be.components.serializer import bim_deserializer, bim_serializer, gim_serializer
+from api4be.components.models.change_log import IfcChangeLog
+from api4be.components.models.change_tracker import IfcChangeTracker
+from api4be.components.utils import geometry_pool, geom_utils
 from api4be.components.utils.georef_utils import check_georef_options
+from api4be.components.models.property_index import IfcPropertyIndex
+from api4be.components.models.query_index import IfcQueryIndex
+from api4be.components.models.relationship_index import IfcRelationshipIndex
 from api4be.components.models.spatial_tree import IfcSpatialTree
 from api4be.components.utils.guid_utils import get_guids
+from api4be.components.utils.lock_utils import ReadWriteLock
 from api4be import config
 
 ifc_file_repository = None
 
+# names of created collections and projects are single path segments
+NAME_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
 logger = logging.getLogger()
 
 
@@ -35,6 +49,10 @@ class IfcFileRepository(object):
     collections = {}
     serving_path = None
     tmp_path = None
+    # scheduled compactions of change logs by (collection, project)
+    compaction_timers = {}
+    # models are shared with the workers of a pre-fork server and must not be changed
+    read_only = False
 
     def __new__(cls):
         """
@@ -54,7 +72,8 @@ class IfcFileRepository(object):
         ifc_file_repository.serving_path = serving_path
         ifc_file_repository.tmp_path = 'tmp'
         for collection_folder in os.listdir(serving_path):
-            if os.path.isdir(os.path.join(serving_path, collection_folder)) and (collections is None or collection_folder in collections):
+            if os.path.isdir(os.path.join(serving_path, collection_folder)) and not collection_folder.startswith('.') and \
+                    (collections is None or collection_folder in collections):
                 for project_file in os.listdir(os.path.join(serving_path, collection_folder)):
                     if os.path.isfile(os.path.join(serving_path, collection_folder, project_file)) and project_file.endswith('.ifc'):
                         ifc_file_repository.__insert_model(os.path.join(serving_path, collection_folder), project_file, collection_folder)
@@ -69,17 +88,41 @@ class IfcFileRepository(object):
         ifc_model = ifcopenshell.open(str(os.path.join(collection_path, project_file)))
         self.insert_ifc_model(project_file.split('.')[0], ifc_model, collection_path, collection_name)
 
-    def insert_ifc_model(self, project_name, model, collection_path, collection_name):
+    def insert_ifc_model(self, project_name, model, collection_path, collection_name, progress=None):
         """
-        Insert a new models into the collection into the service (into the collection dict)
+        Insert a new models into the collection into the service (into the collection dict),
+        progress is called with the name of each stage when it starts
         """
+        if progress is None:
+            progress = lambda stage: None
 
         ####################################
-        # Compute the spatial tree of the models
+        # Replay changes committed after the IFC file was compacted
         ####################################
 
+        change_log = IfcChangeLog(os.path.join(collection_path, project_name + '.log'))
+        replayed = change_log.replay(model)
+        if replayed > 0:
+            logger.info('Replayed ' + str(replayed) + ' logged commits of \"' + project_name + '\"')
+
+        # the geometry pool opens the IFC file while it is equal to the model
         ifc_path = os.path.join(collection_path, project_name + '.ifc')
-        tree = IfcSpatialTree(project_name, model)
+        geometry_pool.register_model(model, lambda: ifc_path if change_log.is_compacted(ifc_path) else None)
+
+        ####################################
+        # Compute the relationship index and spatial tree of the models
+        ####################################
+
+        progress('index')
+        index = IfcRelationshipIndex(model)
+        tree = IfcSpatialTree(project_name, model, index)
+
+        ####################################
+        # Index property sets, materials and query columns
+        ####################################
+
+        property_index = IfcPropertyIndex(model)
+        query_index = IfcQueryIndex(model, index, property_index)
 
         ####################################
         # Load IfcProject
@@ -94,13 +137,15 @@ class IfcFileRepository(object):
         ####################################
 
         # get georeferenced parameters
+        progress('georef')
         geojson = None
         georef_params = check_georef_options(model)
 
         # generate geojson if not exists
+        progress('footprint')
         geojson_path = os.path.join(collection_path, project_name + '.json')
         if not os.path.exists(geojson_path):
-            geojson = gim_serializer.geojson_geometry_of_composed_element(model, ifc_project, gtype=config.DEFAULT_FOOTPRINT_TYPE, georef=georef_params)
+            geojson = gim_serializer.geojson_geometry_of_composed_element(model, ifc_project, gtype=config.DEFAULT_FOOTPRINT_TYPE, georef=georef_params, index=index)
 
             with open(geojson_path, 'w') as fp:
                 json.dump(geojson, fp)
@@ -115,6 +160,15 @@ class IfcFileRepository(object):
             'model': model,
             'ifc_project_guid': ifc_project_ids,
             'tree': tree,
+            'index': index,
+            'property_index': property_index,
+            'query_index': query_index,
+            'changes': IfcChangeTracker(model),
+            'log': change_log,
+            # readers share the project, commits and deletion are exclusive
+            'lock': ReadWriteLock(),
+            # incremented by each commit
+            'version': 0,
             'path': ifc_path,
             'geojson_geometry': geojson,
             'georef': georef_params
@@ -124,9 +178,12 @@ class IfcFileRepository(object):
         # Add models to collection
         ####################################
 
+        progress('publish')
         if collection_name not in self.collections:
             self.collections[collection_name] = {}
         self.collections[collection_name][project_name] = model_object
+        if change_log.pending > 0:
+            self.__schedule_compaction(project_name, collection_name)
 
     ####################################
     # Getter for projects and collections
@@ -146,10 +203,6 @@ class IfcFileRepository(object):
         if collection_name in self.collections:
             return self.collections[collection_name][project_name]['model']
 
-    def get_ifc_model_from_file(self, collection_name, project_name):
-        if collection_name in self.collections:
-            return ifcopenshell.open(self.collections[collection_name][project_name]['path'])
-
     def get_ifc_project_id(self, collection_name, project_name):
         return self.collections[collection_name][project_name]['ifc_project_guid']
 
@@ -157,8 +210,29 @@ class IfcFileRepository(object):
         if collection_name in self.collections:
             return self.collections[collection_name][project_name]['tree']
 
+    def get_relationship_index(self, collection_name, project_name):
+        if collection_name in self.collections:
+            return self.collections[collection_name][project_name]['index']
+
+    def get_property_index(self, collection_name, project_name):
+        if collection_name in self.collections:
+            return self.collections[collection_name][project_name]['property_index']
+
+    def get_query_index(self, collection_name, project_name):
+        if collection_name in self.collections:
+            return self.collections[collection_name][project_name]['query_index']
+
+    def get_change_tracker(self, collection_name, project_name):
+        if collection_name in self.collections:
+            return self.collections[collection_name][project_name]['changes']
+
+    def get_project_lock(self, collection_name, project_name):
+        if project_name in self.collections.get(collection_name, {}):
+            return self.collections[collection_name][project_name]['lock']
+
     def get_ifc_filepath(self, collection_name, project_name):
         if collection_name in self.collections:
+            self.wait_for_file(collection_name, project_name)
             return self.collections[collection_name][project_name]['path']
 
     def get_geojson_geometry(self, collection_name, project_name):
@@ -170,10 +244,79 @@ class IfcFileRepository(object):
             return self.collections[collection_name][project_name]['georef']
 
     def commit_model(self, project_name, collection_name='default', reload_tree=False):
+        """
+        Appends the changes recorded since the last commit to the change log and updates the indexes, tree,
+        footprint and cached responses affected by them. Without recorded changes the commit is a no-op, unless
+        reload_tree rebuilds all and rewrites the IFC file as a whole.
+        """
         if collection_name in self.collections:
-            self.collections[collection_name][project_name]['model'].write(self.collections[collection_name][project_name]['path'])
-            if reload_tree:
-                self.collections[collection_name][project_name]['tree'].reload_tree()
+            project = self.collections[collection_name][project_name]
+            with project['lock'].write():
+                model = project['model']
+                changes = project['changes']
+                logged = changes.has_changes()
+                if not logged and not reload_tree:
+                    return
+                project['version'] += 1
+
+                if logged:
+                    project['log'].append(model, changes)
+
+                if reload_tree:
+                    project['index'].reload_index()
+                    project['tree'].reload_tree()
+                    project['property_index'].reload_index()
+                    structure, geometry = True, True
+                else:
+                    structure_ids, object_ids, geometry = changes.get_affected()
+                    structure = len(structure_ids) > 0
+                    if structure:
+                        project['index'].update_objects(structure_ids)
+                        project['tree'].reload_tree()
+                    for object_id in object_ids:
+                        try:
+                            project['property_index'].invalidate(model.by_id(object_id))
+                        except RuntimeError:
+                            # the object has been removed
+                            pass
+
+                if geometry:
+                    geom_utils.reset_tessellation_budgets(model)
+                if structure or geometry:
+                    self.__update_footprint(project_name, project)
+                self.__invalidate_cached_responses(structure or geometry)
+                changes.reset()
+                if logged:
+                    self.__schedule_compaction(project_name, collection_name)
+                else:
+                    project['log'].mark_stale()
+                    self.write_model_in_background(project_name, collection_name)
+
+    def __update_footprint(self, project_name, project):
+        ifc_project = project['model'].by_type('IfcProject')[0]
+        geojson = gim_serializer.geojson_geometry_of_composed_element(project['model'], ifc_project,
+                                                                      gtype=config.DEFAULT_FOOTPRINT_TYPE,
+                                                                      georef=project['georef'], index=project['index'])
+        with open(os.path.join(os.path.dirname(project['path']), project_name + '.json'), 'w') as fp:
+            json.dump(geojson, fp)
+        project['geojson_geometry'] = geojson
+
+    def __invalidate_cached_responses(self, structure=True):
+        """
+        Removes the cached responses depending on properties (and on the structure and geometry)
+        """
+        functions = [bim_serializer.serialize_psets, bim_serializer.serialize_pset, bim_serializer.serialize_materials,
+                     bim_serializer.serialize_ifc_element_info, bim_serializer.serialize_ifc_elements_query,
+                     bim_serializer.ifc_element_2_ifcjson, bim_serializer.ifc_element_subgraph_2_ifcjson,
+                     gim_serializer.serialize_ifcelement_by_guid_as_geojson,
+                     gim_serializer.serialize_ifcelement_as_geojson, gim_serializer.serialize_ifcelements_as_geojson]
+        if structure:
+            functions += [bim_serializer.serialize_geometry, bim_serializer.serialize_project_tree,
+                          bim_serializer.serialize_project_info, bim_serializer.serialize_projects_info,
+                          gim_serializer.serialize_project_as_geojson,
+                          gim_serializer.serialize_collection_projects_as_geojson]
+        for function in functions:
+            cache.delete_memoized(function)
 
     def print_models(self):
         """
@@ -186,6 +329,15 @@ class IfcFileRepository(object):
     # Modify collections and projects
     ####################################
 
+    def check_names(self, collection_name, project_name):
+        """
+        Raises ValueError unless the names of a new project consist of letters, digits, '_' and '-' only
+        (no separators, '..' or hidden names such as '.uploads')
+        """
+        for name in [collection_name, project_name]:
+            if not isinstance(name, str) or NAME_PATTERN.fullmatch(name) is None:
+                raise ValueError('Invalid name ' + repr(name) + ', only letters, digits, _ and - are allowed')
+
     def create_collection(self, collection_name):
         collection_path = os.path.join(self.serving_path, collection_name)
         if not os.path.exists(collection_path):
@@ -194,29 +346,131 @@ class IfcFileRepository(object):
 
     def delete_collection(self, collection_name):
         collection_path = os.path.join(self.serving_path, collection_name)
+        for project_name, project in self.collections.get(collection_name, {}).items():
+            # waits for running commits and compactions, later compactions find the project removed
+            with project['lock'].write():
+                timer = self.compaction_timers.pop((collection_name, project_name), None)
+                if timer is not None:
+                    timer.cancel()
+        self.collections.pop(collection_name, None)
         shutil.rmtree(collection_path)
-        del self.collections[collection_name]
 
-    def create_project_from_ifcjson(self, ifc_json_input, project_name, collection_name='default'):
-        tmp_model_path = os.path.join(self.tmp_path, project_name + '.json')
-        with open(tmp_model_path, 'w') as f:
-            json.dump(ifc_json_input, f)
+    def create_project_from_ifcjson(self, ifc_json_input, project_name, collection_name='default', progress=None):
+        """
+        Builds the model directly from the ifcJSON (parsed data or stream) and inserts it from memory,
+        the IFC file is written in the background
+        """
+        self.check_names(collection_name, project_name)
+        if progress is not None:
+            progress('parse')
+        model = bim_deserializer.ifcjson_2_model(ifc_json_input)
+        collection_path = os.path.join(self.serving_path, collection_name)
+        os.makedirs(collection_path, exist_ok=True)
+        self.insert_ifc_model(project_name, model, collection_path, collection_name, progress=progress)
+        self.write_model_in_background(project_name, collection_name)
 
-        model = bim_deserializer.ifcjson_2_model(tmp_model_path)
-        output_path = str(os.path.join(self.serving_path, collection_name, project_name + '.ifc'))
-        model.write(output_path)
-        ifc_model = ifcopenshell.open(output_path)
-        os.remove(tmp_model_path)
-        self.insert_ifc_model(project_name, ifc_model, os.path.join(self.serving_path, collection_name), collection_name)
+    def create_project_from_ifcbytes(self, ifc_bytes, project_name, collection_name='default', progress=None):
+        """
+        Stages the IFC bytes in a file of the collection and inserts its model (see create_project_from_ifcfile)
+        """
+        self.check_names(collection_name, project_name)
+        collection_path = os.path.join(self.serving_path, collection_name)
+        os.makedirs(collection_path, exist_ok=True)
+        fd, staged_path = tempfile.mkstemp(suffix='.part', dir=collection_path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(ifc_bytes)
+        self.create_project_from_ifcfile(staged_path, project_name, collection_name, progress=progress)
 
-    def create_project_from_ifcbytes(self, ifc_bytes, project_name, collection_name='default'):
+    def write_model_in_background(self, project_name, collection_name='default'):
+        """
+        Compacts the model into its IFC file in a background thread, the file is replaced atomically and
+        the change log is truncated
+        """
+        timer = self.compaction_timers.pop((collection_name, project_name), None)
+        if timer is not None:
+            timer.cancel()
+        if project_name not in self.collections.get(collection_name, {}):
+            return
+        model_object = self.collections[collection_name][project_name]
+        writer = threading.Thread(target=self.__write_model, args=(collection_name, project_name, model_object),
+                                  daemon=True)
+        writer.start()
+
+    def __write_model(self, collection_name, project_name, model_object):
+        # the model is read while it is written, commits wait for the compaction
+        with model_object['lock'].read():
+            if self.collections.get(collection_name, {}).get(project_name) is not model_object:
+                # the project has been deleted meanwhile
+                return
+            try:
+                model_object['log'].compact(model_object['model'], model_object['path'])
+            except Exception as e:
+                logger.error('Unable to write ' + model_object['path'] + ': ' + str(e))
+
+    def __schedule_compaction(self, project_name, collection_name):
+        """
+        Compacts the change log when it is full, otherwise after the compaction interval
+        """
+        if self.collections[collection_name][project_name]['log'].pending >= config.CHANGE_LOG_COMPACTION_SIZE:
+            self.write_model_in_background(project_name, collection_name)
+        elif (collection_name, project_name) not in self.compaction_timers:
+            timer = threading.Timer(config.CHANGE_LOG_COMPACTION_INTERVAL, self.write_model_in_background,
+                                    args=(project_name, collection_name))
+            timer.daemon = True
+            self.compaction_timers[(collection_name, project_name)] = timer
+            timer.start()
+
+    def flush_models(self):
+        """
+        Compacts the pending changes of all projects in the calling thread and cancels scheduled compactions
+        """
+        for collection_name, projects in self.collections.items():
+            for project_name in projects:
+                timer = self.compaction_timers.pop((collection_name, project_name), None)
+                if timer is not None:
+                    timer.cancel()
+                self.wait_for_file(collection_name, project_name)
+
+    def wait_for_file(self, collection_name, project_name):
+        """
+        Returns when the IFC file of the project contains all committed changes, pending changes are compacted
+        in the calling thread (a background write would deadlock with a reader waiting for it)
+        """
+        model_object = self.collections[collection_name][project_name]
+        if not model_object['log'].is_compacted(model_object['path']):
+            self.__write_model(collection_name, project_name, model_object)
+
+    def create_project_from_ifcfile(self, file_path, project_name, collection_name='default', progress=None):
+        """
+        Moves the (staged) IFC file into the collection and inserts its model. The file is moved only once it
+        is parsed, a file failing to be parsed or inserted is removed.
+        """
+        self.check_names(collection_name, project_name)
+        if progress is not None:
+            progress('write')
+        os.makedirs(os.path.join(self.serving_path, collection_name), exist_ok=True)
         ifc_model_path = os.path.join(self.serving_path, collection_name, project_name + '.ifc')
-        with open(ifc_model_path, 'wb') as f:
-            f.write(ifc_bytes)
-        ifc_model = ifcopenshell.open(ifc_model_path)
-        self.insert_ifc_model(project_name, ifc_model, os.path.join(self.serving_path, collection_name), collection_name)
+        try:
+            if progress is not None:
+                progress('parse')
+            ifc_model = ifcopenshell.open(file_path)
+            os.replace(file_path, ifc_model_path)
+            self.insert_ifc_model(project_name, ifc_model, os.path.join(self.serving_path, collection_name),
+                                  collection_name, progress=progress)
+        except Exception:
+            for path in [file_path, ifc_model_path]:
+                if os.path.exists(path) and project_name not in self.collections.get(collection_name, {}):
+                    os.remove(path)
+            raise
 
     def delete_project(self, project_name, collection_name='default'):
-        # os.remove(self.collections[collection][name]['svg'])
-        os.remove(self.collections[collection_name][project_name]['path'])
-        del self.collections[collection_name][project_name]
+        project = self.collections[collection_name][project_name]
+        with project['lock'].write():
+            timer = self.compaction_timers.pop((collection_name, project_name), None)
+            if timer is not None:
+                timer.cancel()
+            # os.remove(self.collections[collection][name]['svg'])
+            if os.path.exists(project['path']):
+                os.remove(project['path'])
+            project['log'].remove()
+            del self.collections[collection_name][project_name]
@@ -15,18 +15,24 @@
 
 import logging
 
-import ifcopenshell
-from flask import request, send_file, jsonify, render_template
+from flask import request, send_file, jsonify, render_template, redirect
 from furl import furl
 
+from api4be import config
 from api4be.components.routes import bim
-from api4be.components.serializer import bim_serializer
+from api4be.components.serializer import bim_serializer, bim_deserializer
 from api4be.components.service.bim_model_service import BimModelService
-from api4be.components.utils.routes_utils import get_bim_request_query_parameters
+from api4be.components.service.deferred_service import DeferredService
+from api4be.components.service.ingest_service import IngestService
+from api4be.components.service.upload_service import UploadService
+from api4be.components.utils.routes_utils import get_bim_request_query_parameters, get_deferred_response
 from api4be.components.utils.georef_utils import georef_params_to_4978, georef_params_to_4326
 from api4be.components.utils.guid_utils import get_guids
 
 bim_model_service = BimModelService()
+deferred_service = DeferredService()
+ingest_service = IngestService()
+upload_service = UploadService()
 logger = logging.getLogger()
 
 
@@ -80,12 +86,17 @@ def get_collection_models(collection_name):
 
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>')
+@bim_model_service.reads_project
 def get_ifc_project(collection_name, project_name):
     params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name)
     if params['FORMAT'] == 'ifcjson':
-        # for ifcjson lib we need to use a copy of the models
-        return bim_serializer.model_2_ifcjson(bim_model_service.get_ifc_model_of_project_copy(collection_name, project_name),
-                                              params)
+        # the file is only opened by the export processes, getting its path compacts pending changes into it
+        ifc_path = None
+        if config.IFCJSON_EXPORT_PROCESSES > 1:
+            ifc_path = bim_model_service.get_ifc_filepath(collection_name, project_name)
+        return bim_serializer.model_2_ifcjson_stream(
+            bim_model_service.get_ifc_model_of_project(collection_name, project_name), params, ifc_path=ifc_path,
+            reading=bim_model_service.reading_project(collection_name, project_name))
     elif params['FORMAT'] == 'text/html':
         f = furl(request.url).remove(['format'])
         return get_generic_json_html(project_name, ['Content', 'Georeferencing', 'Spatial Tree'],
@@ -93,11 +104,11 @@ def get_ifc_project(collection_name, project_name):
                                      formats=[('JSON', 'json'), ('IFCJSON', 'ifcjson')])
 
     elif params['FORMAT'] == 'ifc':
-        path = bim_model_service.get_ifc_filepath(project_name, collection_name)
+        path = bim_model_service.get_ifc_filepath(collection_name, project_name)
         with open(path, 'r') as f:
             return f.read()
     elif params['FORMAT'] == 'ifc_file':
-        path = bim_model_service.get_ifc_filepath(project_name, collection_name)
+        path = bim_model_service.get_ifc_filepath(collection_name, project_name)
         return send_file(path)
     else:
         params['BIM_IFCPROJECT_URL'] = params['BIM_PROJECT_URL'] + '/ifcitems/' + \
@@ -108,7 +119,114 @@ def get_ifc_project(collection_name, project_name):
         return jsonify(project_info)
 
 
+@bim.route('/bim/collections/<collection_name>/projects/<project_name>', methods=['POST'])
+def create_ifc_project(collection_name, project_name):
+    if bim_model_service.is_read_only():
+        return read_only_error()
+
+    # the body is streamed to disk and the model is ingested in the background, the project is published when
+    # the job is done
+    try:
+        if request.mimetype == 'application/json':
+            job = ingest_service.submit_ifcjson(collection_name, project_name, request.stream)
+        else:
+            job = ingest_service.submit_ifcstream(collection_name, project_name, request.stream)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if job is None:
+        return jsonify({'error': 'Project ' + project_name + ' already exists'}), 409
+
+    params = get_bim_request_query_parameters(request)
+    job_info = bim_serializer.serialize_ingest_job(job, params)
+    return jsonify(job_info), 202, {'Location': job_info['job@bim.navigationLink']}
+
+
+@bim.route('/bim/collections/<collection_name>/projects/<project_name>/uploads', methods=['POST'])
+def create_ifc_project_upload(collection_name, project_name):
+    if bim_model_service.is_read_only():
+        return read_only_error()
+    if (collection_name in bim_model_service.get_collections_names() and
+            project_name in bim_model_service.get_projects_of_collection(collection_name)) or \
+            ingest_service.is_ingesting(collection_name, project_name):
+        return jsonify({'error': 'Project ' + project_name + ' already exists'}), 409
+
+    body = request.get_json(silent=True) or {}
+    size = body.get('size')
+    sha256 = body.get('sha256')
+    if not isinstance(size, int) or size <= 0 or not isinstance(sha256, str):
+        return jsonify({'error': 'size (bytes) and sha256 (hex checksum) of the IFC file are required'}), 400
+
+    try:
+        upload = upload_service.create_upload(collection_name, project_name, size, sha256)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    params = get_bim_request_query_parameters(request)
+    upload_info = bim_serializer.serialize_upload(upload, params)
+    return jsonify(upload_info), 201, {'Location': upload_info['upload@bim.navigationLink']}
+
+
+@bim.route('/bim/uploads/<upload_id>', methods=['GET', 'PATCH'])
+def ifc_project_upload(upload_id):
+    upload = upload_service.get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload ' + upload_id + ' not found'}), 404
+
+    params = get_bim_request_query_parameters(request)
+    if request.method == 'PATCH':
+        if bim_model_service.is_read_only():
+            return read_only_error()
+        # chunks are appended in order, the offset of a chunk must match the bytes already received
+        with upload.lock:
+            offset = request.headers.get('Upload-Offset', type=int)
+            if offset is None or offset != upload.get_offset():
+                return jsonify({'error': 'Upload-Offset must be ' + str(upload.get_offset())}), 409, \
+                    {'Upload-Offset': str(upload.get_offset())}
+            try:
+                upload.append(request.stream)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 413
+
+            if upload.is_complete():
+                try:
+                    job = upload_service.complete_upload(upload)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 422
+                if job is None:
+                    return jsonify({'error': 'Project ' + upload.project_name + ' already exists'}), 409
+                job_info = bim_serializer.serialize_ingest_job(job, params)
+                return jsonify(job_info), 202, {'Location': job_info['job@bim.navigationLink']}
+
+    upload_info = bim_serializer.serialize_upload(upload, params)
+    return jsonify(upload_info), 200, {'Upload-Offset': str(upload_info['offset'])}
+
+
+@bim.route('/bim/jobs/<job_id>')
+def get_job(job_id):
+    params = get_bim_request_query_parameters(request)
+    job = ingest_service.get_job(job_id)
+    if job is not None:
+        return jsonify(bim_serializer.serialize_ingest_job(job, params))
+
+    # a request deferred with Prefer: respond-async, redirected to the result of the job when done
+    job = deferred_service.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job ' + job_id + ' not found'}), 404
+    if job.status == 'done':
+        return redirect(params['BIM_JOBS_URL'] + '/' + job.id + '/result', code=303)
+    return get_deferred_response(job, params, status=200)
+
+
+@bim.route('/bim/jobs/<job_id>/result')
+def get_job_result(job_id):
+    params = get_bim_request_query_parameters(request)
+    job = deferred_service.get_job(job_id)
+    if job is None or job.status != 'done':
+        return jsonify({'error': 'Result of job ' + job_id + ' not found'}), 404
+    return get_deferred_response(job, params)
+
+
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/tree')
+@bim_model_service.reads_project
 def get_ifc_project_spatialtree(collection_name, project_name):
     if 'format' in request.args and request.args['format'] == 'text/html':
         f = furl(request.url).remove(['format'])
@@ -116,10 +234,18 @@ def get_ifc_project_spatialtree(collection_name, project_name):
 
     params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name)
     modeltree = bim_model_service.get_ifc_spatial_tree_of_project(collection_name, project_name)
-    return jsonify(bim_serializer.serialize_project_tree(modeltree.as_dict(), params))
+    if params['ROOT'] is not None:
+        try:
+            found = modeltree.has_node(get_guids(params['ROOT'])['ifc_guid'])
+        except ValueError:
+            found = False
+        if not found:
+            return jsonify({'error': 'Tree node ' + params['ROOT'] + ' not found'}), 404
+    return jsonify(bim_serializer.serialize_project_tree(modeltree, params))
 
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/georef')
+@bim_model_service.reads_project
 def get_ifc_project_georef(project_name, collection_name):
     if 'format' in request.args and request.args['format'] == 'text/html':
         f = furl(request.url).remove(['format'])
@@ -132,6 +258,7 @@ def get_ifc_project_georef(project_name, collection_name):
 
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/geometry')
+@bim_model_service.reads_project
 def get_ifc_project_geometry(collection_name, project_name):
     params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name)
     if 'format' in request.args and request.args['format'] == 'text/html':
@@ -140,19 +267,59 @@ def get_ifc_project_geometry(collection_name, project_name):
 
     model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
     ifcproject_guid = bim_model_service.get_project(collection_name, project_name)['ifc_project_guid']['json_guid']
-    gltf = bim_serializer.serialize_geometry(model, ifcproject_guid, params)
+    index = bim_model_service.get_relationship_index_of_project(collection_name, project_name)
+    if deferred_service.prefers_async(request):
+        job = deferred_service.submit(request.url, collection_name, project_name,
+                                      bim_serializer.serialize_geometry, model, ifcproject_guid, params, index)
+        if job.status != 'failed':
+            return get_deferred_response(job, params)
+    gltf = bim_serializer.serialize_geometry(model, ifcproject_guid, params, index)
     response = jsonify(gltf)
     return response
 
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/groundplan')
+@bim_model_service.reads_project
 def get_ifc_project_groundplan(collection_name, project_name):
     params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name)
     geojson = bim_model_service.get_geojson_of_project(collection_name, project_name)
     return jsonify(geojson)
 
 
+@bim.route('/bim/collections/<collection_name>/projects/<project_name>/ifcitems', methods=['GET', 'POST'])
+@bim_model_service.reads_project
+def get_ifc_elements(collection_name, project_name):
+    if 'format' in request.args and request.args['format'] == 'text/html':
+        f = furl(request.url).remove(['format'])
+        return get_generic_json_html(project_name, 'IfcItems of ' + project_name, f.url)
+
+    params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name)
+    model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
+
+    # batch retrieval of the elements given by guid parameters or a list of guids in the body
+    guids = request.args.getlist('guid')
+    if request.method == 'POST':
+        # guid parameters may be posted without a body
+        body = request.get_json(silent=True) if request.get_data() else []
+        if isinstance(body, dict):
+            body = body.get('guids')
+        if not isinstance(body, list) or not all(isinstance(guid, str) for guid in body):
+            return jsonify({'error': 'Body must be a list of guids or an object with a list of guids'}), 400
+        guids += body
+    if len(guids) > 0:
+        index = bim_model_service.get_relationship_index_of_project(collection_name, project_name)
+        property_index = bim_model_service.get_property_index_of_project(collection_name, project_name)
+        return jsonify(bim_serializer.serialize_ifc_elements_batch(model, guids, params, index, property_index))
+
+    query_index = bim_model_service.get_query_index_of_project(collection_name, project_name)
+    if params['TYPE'] is not None and not query_index.is_ifc_type(params['TYPE']):
+        return jsonify({'error': 'Unknown IFC type ' + params['TYPE']}), 400
+    response = jsonify(bim_serializer.serialize_ifc_elements_query(model, query_index, params))
+    return response
+
+
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/ifcitems/<guid>')
+@bim_model_service.reads_project
 def get_ifc_element(collection_name, project_name, guid):
     if 'format' in request.args and request.args['format'] == 'text/html':
         f = furl(request.url).remove(['format'])
@@ -160,8 +327,10 @@ def get_ifc_element(collection_name, project_name, guid):
 
     if 'format' in request.args and request.args['format'] == 'ifcjson':
         params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name, guid=guid)
-        # for ifcjson we need to use a copy of the models
-        model = bim_model_service.get_ifc_model_of_project_copy(collection_name, project_name)
+        model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
+        if params['DEPTH'] is not None:
+            # the element together with the objects reachable by at most depth references
+            return bim_serializer.ifc_element_subgraph_2_ifcjson(guid, model, params)
         response = bim_serializer.ifc_element_2_ifcjson(guid, model, params)
         return response
 
@@ -172,27 +341,67 @@ def get_ifc_element(collection_name, project_name, guid):
 
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/ifcitems/<guid>/psets')
+@bim_model_service.reads_project
 def get_ifc_element_psets(collection_name, project_name, guid):
     if 'format' in request.args and request.args['format'] == 'text/html':
         f = furl(request.url).remove(['format'])
         return get_generic_json_html(project_name, 'PSets of ' + guid, f.url)
 
     model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
-    response = jsonify(bim_serializer.serialize_psets(model, guid))
+    property_index = bim_model_service.get_property_index_of_project(collection_name, project_name)
+    response = jsonify(bim_serializer.serialize_psets(model, guid, property_index))
     return response
 
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/ifcitems/<guid>/psets/<pset_name>')
+@bim_model_service.reads_project
 def get_ifc_element_pset(collection_name, project_name, guid, pset_name):
     model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
-    guids = get_guids(guid)
-    entity = model.by_id(guids['ifc_guid'])
-    psets = ifcopenshell.util.element.get_psets(entity)
-    response = jsonify(psets[pset_name])
-    return response
+    property_index = bim_model_service.get_property_index_of_project(collection_name, project_name)
+    pset = bim_serializer.serialize_pset(model, guid, pset_name, property_index)
+    if pset is None:
+        return jsonify({'error': 'Property set ' + pset_name + ' not found'}), 404
+    return jsonify(pset)
+
+
+@bim.route('/bim/collections/<collection_name>/projects/<project_name>/psets', methods=['POST'])
+def add_ifc_elements_psets(collection_name, project_name):
+    if bim_model_service.is_read_only():
+        return read_only_error()
+    if collection_name not in bim_model_service.get_collections_names() or \
+            project_name not in bim_model_service.get_projects_of_collection(collection_name):
+        return jsonify({'error': 'Project ' + project_name + ' not found'}), 404
+
+    # psets of many elements in one request: guid -> pset name -> property name -> value
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not all(isinstance(psets, dict) and
+                                             all(isinstance(properties, dict) and
+                                                 all(bim_deserializer.is_property_value(value)
+                                                     for value in properties.values())
+                                                 for properties in psets.values())
+                                             for psets in body.values()):
+        return jsonify({'error': 'psets must be given as guid -> pset name -> property name -> value '
+                                 '(string, boolean or number)'}), 400
+
+    with bim_model_service.writing_project(collection_name, project_name):
+        # all elements are resolved before writing, so a request is added completely or not at all
+        model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
+        element_psets = []
+        missing = []
+        for guid, psets in body.items():
+            try:
+                element_psets.append((model.by_guid(get_guids(guid)['ifc_guid']), psets))
+            except (RuntimeError, ValueError):
+                missing.append(guid)
+        if len(missing) > 0:
+            return jsonify({'error': 'IfcItems not found', 'guids': missing}), 404
+
+        count = bim_model_service.add_property_sets_of_project(collection_name, project_name, element_psets)
+    return jsonify({'elements': len(element_psets), 'psets': count})
 
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/ifcitems/<guid>/geometry')
+@bim_model_service.reads_project
 def get_ifc_element_geometry(project_name, guid, collection_name):
     params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name, guid=guid)
     if 'format' in request.args and request.args['format'] == 'text/html':
@@ -201,18 +410,26 @@ def get_ifc_element_geometry(project_name, guid, collection_name):
 
     params = get_bim_request_query_parameters(request, collection_name=collection_name, project_name=project_name, guid=guid)
     model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
-    geometries = bim_serializer.serialize_geometry(model, guid, params)
+    index = bim_model_service.get_relationship_index_of_project(collection_name, project_name)
+    if deferred_service.prefers_async(request):
+        job = deferred_service.submit(request.url, collection_name, project_name,
+                                      bim_serializer.serialize_geometry, model, guid, params, index)
+        if job.status != 'failed':
+            return get_deferred_response(job, params)
+    geometries = bim_serializer.serialize_geometry(model, guid, params, index)
     response = jsonify(geometries)
     return response
 
 @bim.route('/bim/collections/<collection_name>/projects/<project_name>/ifcitems/<guid>/materials')
+@bim_model_service.reads_project
 def get_ifc_element_material(collection_name, project_name, guid):
     if 'format' in request.args and request.args['format'] == 'text/html':
         f = furl(request.url).remove(['format'])
         return get_generic_json_html(project_name, 'Material of ' + guid, f.url)
 
     model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
-    response = jsonify(bim_serializer.serialize_materials(model, guid))
+    property_index = bim_model_service.get_property_index_of_project(collection_name, project_name)
+    response = jsonify(bim_serializer.serialize_materials(model, guid, property_index))
     return response
 
 
@@ -220,6 +437,10 @@ def get_ifc_element_material(collection_name, project_name, guid):
 # Return in HTML format
 ####################################
 
+def read_only_error():
+    return jsonify({'error': 'Projects are read-only, the models are shared by the workers of a pre-fork server'}), 405
+
+
 def get_ifc_geometry_html(project_name, geometry_url, guid=''):
     return render_template('bim/geom.html', project_name=project_name, guid=guid, geometry_url=geometry_url)
 
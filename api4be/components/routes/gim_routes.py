@@ -21,9 +21,11 @@ from furl import furl
 from api4be.components.routes import gim
 from api4be.components.serializer import gim_serializer
 from api4be.components.service.bim_model_service import BimModelService
-from api4be.components.utils.routes_utils import get_gim_request_query_parameters
+from api4be.components.service.deferred_service import DeferredService
+from api4be.components.utils.routes_utils import get_gim_request_query_parameters, get_deferred_response
 
 bim_model_service = BimModelService()
+deferred_service = DeferredService()
 
 logger = logging.getLogger()
 
@@ -79,6 +81,7 @@ def get_collection_items(collection_name='default'):
 
 
 @gim.route('/gim/collections/<collection_name>/items/<project_name>')
+@bim_model_service.reads_project
 def get_project(project_name, collection_name='default'):
     if 'format' in request.args and request.args['format'] == 'text/html':
         f = furl(request.url).remove(['format'])
@@ -86,13 +89,23 @@ def get_project(project_name, collection_name='default'):
 
     params = get_gim_request_query_parameters(request, collection_name=collection_name, project_name=project_name)
     # filteroptions:
-    if 'type' in request.args:
-        filter_by_type = request.args.get('type')
-        model = bim_model_service.get_ifc_model_of_project(project_name, collection_name)
-        elements = model.by_type(filter_by_type)
-        geojson = gim_serializer.serialize_ifcelements_as_geojson(model, elements, params,
-                                                                  georef=bim_model_service.get_georef_of_project(
-                                                                      collection_name, project_name))
+    if params['TYPE'] is not None or params['STOREY'] is not None or len(params['PROPERTIES']) > 0:
+        model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
+        query_index = bim_model_service.get_query_index_of_project(collection_name, project_name)
+        if params['TYPE'] is not None and not query_index.is_ifc_type(params['TYPE']):
+            return jsonify({'error': 'Unknown IFC type ' + params['TYPE']}), 400
+        elements = query_index.query_elements(ifc_type=params['TYPE'], storey=params['STOREY'],
+                                              properties=params['PROPERTIES'])
+        kwargs = {'georef': bim_model_service.get_georef_of_project(collection_name, project_name),
+                  'index': bim_model_service.get_relationship_index_of_project(collection_name, project_name),
+                  'property_index': bim_model_service.get_property_index_of_project(collection_name, project_name)}
+        if deferred_service.prefers_async(request):
+            job = deferred_service.submit(request.url, collection_name, project_name,
+                                          gim_serializer.serialize_ifcelements_as_geojson, model, elements, params,
+                                          **kwargs)
+            if job.status != 'failed':
+                return get_deferred_response(job, params)
+        geojson = gim_serializer.serialize_ifcelements_as_geojson(model, elements, params, **kwargs)
         return jsonify(geojson)
     else:
         project = bim_model_service.get_project(collection_name, project_name)
@@ -102,6 +115,7 @@ def get_project(project_name, collection_name='default'):
 
 @gim.route('/gim/collections/<collection_name>/items/<project_name>/elements/<guid>')
 @gim.route('/gim/collections/<collection_name>/items/<project_name>:<guid>')
+@bim_model_service.reads_project
 def get_ifc_element(project_name, guid, collection_name='default'):
     if 'format' in request.args and request.args['format'] == 'text/html':
         f = furl(request.url).remove(['format'])
@@ -109,9 +123,16 @@ def get_ifc_element(project_name, guid, collection_name='default'):
 
     params = get_gim_request_query_parameters(request, collection_name=collection_name, project_name=project_name, guid=guid)
     model = bim_model_service.get_ifc_model_of_project(collection_name, project_name)
-    element_as_geojson = gim_serializer.serialize_ifcelement_by_guid_as_geojson(model, guid, params,
-                                                                                georef=bim_model_service.get_georef_of_project(
-                                                                                    collection_name, project_name))
+    kwargs = {'georef': bim_model_service.get_georef_of_project(collection_name, project_name),
+              'index': bim_model_service.get_relationship_index_of_project(collection_name, project_name),
+              'property_index': bim_model_service.get_property_index_of_project(collection_name, project_name)}
+    if deferred_service.prefers_async(request):
+        job = deferred_service.submit(request.url, collection_name, project_name,
+                                      gim_serializer.serialize_ifcelement_by_guid_as_geojson, model, guid, params,
+                                      **kwargs)
+        if job.status != 'failed':
+            return get_deferred_response(job, params)
+    element_as_geojson = gim_serializer.serialize_ifcelement_by_guid_as_geojson(model, guid, params, **kwargs)
     return jsonify(element_as_geojson)
 
 
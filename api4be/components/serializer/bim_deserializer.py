@@ -24,44 +24,82 @@ from api4be import ifcjson
 
 logger = logging.getLogger()
 
-def ifcjson_2_model(ifc_json_file):
-    logger.debug(ifc_json_file)
-    ifc_json = ifcjson.JSON2IFC(ifc_json_file)
+def ifcjson_2_model(ifc_json):
+    """
+    Builds an ifcopenshell model from ifcJSON (file path, stream or parsed data)
+    """
+    ifc_json = ifcjson.JSON2IFC(ifc_json)
     ifc_model = ifc_json.ifcModel()
     return ifc_model
 
 
-def add_property_sets(model, element, psets):
-    owner_history = model.by_type('IfcOwnerHistory')[0]
-    for pset in psets:
-        property_values = []
-        for property in psets[pset]:
-            single_value = None
-            if isinstance(psets[pset][property], float):
-                single_value = model.createIfcPropertySingleValue(property, property, model.create_entity('IfcReal',
-                                                                                                          psets[
-                                                                                                              pset][
-                                                                                                              property]),
-                                                                  None)
-            elif isinstance(psets[pset][property], int):
-                single_value = model.createIfcPropertySingleValue(property, property, model.create_entity('IfcInteger',
-                                                                                                          psets[
-                                                                                                              pset][
-                                                                                                              property]),
-                                                                  None)
-            elif isinstance(psets[pset][property], bool):
-                single_value = model.createIfcPropertySingleValue(property, property, model.create_entity('IfcBoolean',
-                                                                                                          psets[
-                                                                                                              pset][
-                                                                                                              property]),
-                                                                  None)
-            else:
-                single_value = model.createIfcPropertySingleValue(property, property, model.create_entity('IfcText',
-                                                                                                          psets[
-                                                                                                              pset][
-                                                                                                              property]),
-                                                                  None)
-            property_values.append(single_value)
-        property_set = model.createIfcPropertySet(ifcopenshell.guid.new(), owner_history, pset, None, property_values)
-        model.createIfcRelDefinesByProperties(ifcopenshell.guid.new(), owner_history, None, None, [element],
-                                              property_set)
\ No newline at end of file
+def add_property_sets(model, element, psets, property_index=None, changes=None):
+    add_property_sets_bulk(model, [(element, psets)], property_index=property_index, changes=changes)
+
+
+def add_property_sets_bulk(model, element_psets, property_index=None, changes=None):
+    """
+    Adds the psets (pset name -> property name -> value) to each element of the (element, psets) pairs.
+    The owner history, equal property values and equal property sets are shared, an equal property set of
+    many elements is related to all of them by one IfcRelDefinesByProperties.
+    """
+    # checked before any entity is created, so the model is not changed by invalid psets
+    for element, psets in element_psets:
+        for properties in psets.values():
+            for property, value in properties.items():
+                if not is_property_value(value):
+                    raise ValueError('Invalid value of property ' + str(property) + ': ' + repr(value))
+
+    owner_history = next(iter(model.by_type('IfcOwnerHistory')), None)
+    property_values = {}
+    property_sets = {}
+    created = []
+
+    for element, psets in element_psets:
+        for pset in psets:
+            key = (pset, tuple((property, _value_key(value)) for property, value in psets[pset].items()))
+            if key not in property_sets:
+                values = []
+                for property, value in psets[pset].items():
+                    value_key = (property, _value_key(value))
+                    if value_key not in property_values:
+                        property_values[value_key] = model.createIfcPropertySingleValue(
+                            property, property, _create_value(model, value), None)
+                        created.append(property_values[value_key])
+                    values.append(property_values[value_key])
+                property_set = model.createIfcPropertySet(ifcopenshell.guid.new(), owner_history, pset, None, values)
+                created.append(property_set)
+                property_sets[key] = (property_set, [])
+            property_sets[key][1].append(element)
+
+    for property_set, elements in property_sets.values():
+        created.append(model.createIfcRelDefinesByProperties(ifcopenshell.guid.new(), owner_history, None, None,
+                                                             elements, property_set))
+    if changes is not None:
+        changes.record_created(created)
+    if property_index is not None:
+        for element, psets in element_psets:
+            property_index.invalidate(element)
+    return len(property_sets)
+
+
+def is_property_value(value):
+    """
+    Returns True for the values of a property single value (string, boolean or number)
+    """
+    return isinstance(value, (str, bool, int, float))
+
+
+def _value_key(value):
+    # values of different types are not shared (1 and True and 1.0 are equal in python)
+    return type(value).__name__, value if isinstance(value, (bool, int, float)) else str(value)
+
+
+def _create_value(model, value):
+    if isinstance(value, bool):
+        return model.create_entity('IfcBoolean', value)
+    elif isinstance(value, float):
+        return model.create_entity('IfcReal', value)
+    elif isinstance(value, int):
+        return model.create_entity('IfcInteger', value)
+    return model.create_entity('IfcText', value)
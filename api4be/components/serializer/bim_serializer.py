@@ -17,24 +17,27 @@ import inspect
 import logging
 import os
 import sys
+import tempfile
 
 import ifcopenshell
-from flask import jsonify
+import ifcopenshell.util.element
+from flask import jsonify, Response
 
 from api4be.components.cache import cache
 from api4be.components.utils import gltf_utils
-from api4be.components.utils.guid_utils import get_guids, ifc_2_json_guid
+from api4be.components.utils.guid_utils import get_guids
+from api4be.components.utils.property_utils import get_material_as_dict
 from api4be.components.utils.spatial_tree_utils import collect_containing_geometry_elements, \
     collect_containing_geometry_elements_ids
 
-from api4be import ifcjson
+from api4be import ifcjson, config
 
 logger = logging.getLogger()
 
 
-@cache.memoize()
-def model_2_ifcjson(model, params):
-    return _model_2_ifcjson(model, params)
+def model_2_ifcjson_stream(model, params, ifc_path=None, reading=None):
+    # not memoized, the document is streamed while it is serialized
+    return _model_2_ifcjson_stream(model, params, ifc_path, reading)
 
 
 @cache.memoize()
@@ -42,6 +45,11 @@ def ifc_element_2_ifcjson(guid, model, params):
     return _ifc_element_2_ifcjson(guid, model, params)
 
 
+@cache.memoize()
+def ifc_element_subgraph_2_ifcjson(guid, model, params):
+    return _ifc_element_subgraph_2_ifcjson(guid, model, params)
+
+
 @cache.memoize()
 def serialize_collections_info(collections_names, params):
     return _serialize_collections_info(collections_names, params)
@@ -62,38 +70,83 @@ def serialize_project_info(collection_name, project_dict, params):
     return _serialize_project_info(collection_name, project_dict, params)
 
 
+@cache.memoize()
+def serialize_ifc_elements_query(model, query_index, params):
+    return _serialize_ifc_elements_query(model, query_index, params)
+
+
+def serialize_ifc_elements_batch(model, guids, params, index=None, property_index=None):
+    # not memoized, the lists of guids rarely repeat
+    return _serialize_ifc_elements_batch(model, guids, params, index, property_index)
+
+
 @cache.memoize()
 def serialize_ifc_element_info(model, guid, params):
     return _serialize_ifc_element_info(model, guid, params)
 
 
 @cache.memoize()
-def serialize_psets(model, guid):
-    return _serialize_psets(model, guid)
+def serialize_psets(model, guid, property_index=None):
+    return _serialize_psets(model, guid, property_index)
 
 
 @cache.memoize()
-def serialize_geometry(model, guid, params):
-    return _serialize_geometry(model, guid, params)
+def serialize_pset(model, guid, pset_name, property_index=None):
+    return _serialize_pset(model, guid, pset_name, property_index)
+
+
+@cache.memoize(response_filter=lambda gltf: not _has_placeholders(gltf))
+def serialize_geometry(model, guid, params, index=None):
+    # not cached with placeholders, the elements are tessellated in the background meanwhile
+    return _serialize_geometry(model, guid, params, index)
 
 
 @cache.memoize()
-def serialize_materials(model, guid):
-    return _serialize_materials(model, guid)
+def serialize_materials(model, guid, property_index=None):
+    return _serialize_materials(model, guid, property_index)
 
 
 @cache.memoize()
-def serialize_project_tree(tree_dict, params):
-    return _serialize_project_tree(tree_dict, params)
+def serialize_project_tree(tree, params):
+    return _serialize_project_tree(tree, params)
+
+
+def _has_placeholders(gltf):
+    return isinstance(gltf, dict) and 'placeholders' in gltf.get('extras', {})
+
+
+def _is_field_requested(field, params):
+    return params['FIELDS'] is None or field in params['FIELDS']
 
 
-def _model_2_ifcjson(model, params):
-    ifcjson_project = ifcjson.IFC2JSON4(model, COMPACT=params['COMPACT'], NO_INVERSE=params['NO_INVERSE'],
-                                        EMPTY_PROPERTIES=params['EMPTY_PROPERTIES'],
-                                        NO_OWNERHISTORY=params['NO_OWNERHISTORY'],
-                                        GEOMETRY=params['GEOMETRY']).spf2Json()
+def _select_fields(values, params):
+    if params['FIELDS'] is None:
+        return values
+    return {k: v for k, v in values.items() if k in params['FIELDS']}
 
-    return jsonify(ifcjson_project)
+
+def _model_2_ifcjson_stream(model, params, ifc_path=None, reading=None):
+    serializer = ifcjson.IFC2JSON4(model, COMPACT=params['COMPACT'], NO_INVERSE=params['NO_INVERSE'],
+                                   EMPTY_PROPERTIES=params['EMPTY_PROPERTIES'],
+                                   NO_OWNERHISTORY=params['NO_OWNERHISTORY'],
+                                   GEOMETRY=params['GEOMETRY'],
+                                   OBJECT_CACHE_SIZE=config.IFCJSON_OBJECT_CACHE_SIZE)
+
+    chunks = serializer.spf2JsonStream(processes=config.IFCJSON_EXPORT_PROCESSES, ifcPath=ifc_path)
+    if reading is not None:
+        # the model is read after the view returned, so it is exported in the reading context into a spooled file,
+        # which is transferred to the client after the context is left
+        chunks = _iter_spooled(reading, chunks)
+    return Response(chunks, mimetype='application/json')
+
+
+def _iter_spooled(context, chunks):
+    with tempfile.SpooledTemporaryFile(max_size=config.IFCJSON_SPOOL_SIZE) as spooled:
+        with context:
+            for chunk in chunks:
+                spooled.write(chunk.encode())
+        spooled.seek(0)
+        yield from iter(lambda: spooled.read(65536), b'')
 
 
 def _ifc_element_2_ifcjson(guid, model, params):
@@ -170,6 +223,61 @@ def _ifc_element_2_ifcjson(guid, model, params):
     return jsonify(ifcjson_element)
 
 
+def _ifc_element_subgraph_2_ifcjson(guid, model, params):
+    serializer = ifcjson.IFC2JSON4(model, COMPACT=params['COMPACT'], NO_INVERSE=params['NO_INVERSE'],
+                                   EMPTY_PROPERTIES=params['EMPTY_PROPERTIES'],
+                                   NO_OWNERHISTORY=params['NO_OWNERHISTORY'],
+                                   GEOMETRY=params['GEOMETRY'])
+
+    entity = model.by_id(get_guids(guid)['ifc_guid'])
+    return jsonify(serializer.spf2JsonSubgraph(entity, depth=params['DEPTH']))
+
+
+def serialize_ingest_job(job, params):
+    # not memoized, the state of the job changes
+    result = {
+        'id': job.id,
+        'status': job.status,
+        'progress': job.get_progress(),
+        'stages': [{'name': stage, 'status': state} for stage, state in job.stages.items()],
+        'created': job.created.isoformat(),
+        'updated': job.updated.isoformat(),
+        'job@bim.navigationLink': params['BIM_JOBS_URL'] + '/' + job.id
+    }
+    if job.error is not None:
+        result['error'] = job.error
+    if job.status == 'done':
+        result['project@bim.navigationLink'] = params['BIM_COLLECTIONS_URL'] + '/' + job.collection_name + \
+                                               '/projects/' + job.project_name
+    return result
+
+
+def serialize_deferred_job(job, params):
+    # not memoized, the state of the job changes
+    result = {
+        'id': job.id,
+        'status': job.status,
+        'created': job.created.isoformat(),
+        'updated': job.updated.isoformat(),
+        'job@bim.navigationLink': params['BIM_JOBS_URL'] + '/' + job.id,
+        'result@bim.navigationLink': params['BIM_JOBS_URL'] + '/' + job.id + '/result'
+    }
+    if job.error is not None:
+        result['error'] = job.error
+    return result
+
+
+def serialize_upload(upload, params):
+    # not memoized, the offset of the upload changes
+    return {
+        'id': upload.id,
+        'size': upload.size,
+        'offset': upload.get_offset(),
+        'sha256': upload.sha256,
+        'upload@bim.navigationLink': params['BIM_UPLOADS_URL'] + '/' + upload.id
+    }
+
+
 def _serialize_collections_info(collections_names, params):
     result_collections = []
     for collection_name in collections_names:
@@ -223,42 +331,122 @@ def _serialize_project_info(collection_name, project_dict, params):
         'geometry@bim.navigationLink': params['BIM_PROJECTS_URL'] + '/' + project_dict['id'] + '/geometry',
         'project@gim.navigationLink': params['GIM_ITEMS_URL'] + '/' + project_dict['id']
     }
-    return project_info
+    return _select_fields(project_info, params)
+
+
+def _serialize_ifc_elements_query(model, query_index, params):
+    elements_ids = query_index.query(ifc_type=params['TYPE'], storey=params['STOREY'],
+                                     properties=params['PROPERTIES'])
+    end = None if params['LIMIT'] is None else params['OFFSET'] + params['LIMIT']
+    ifc_items = []
+    for element_id in elements_ids[params['OFFSET']:end]:
+        element = model.by_id(element_id)
+        guids = get_guids(element.GlobalId)
+        ifc_items.append({
+            'globalId': guids['json_guid'],
+            'ifcGlobalId': guids['ifc_guid'],
+            'name': element.Name,
+            'type': element.is_a(),
+            'ifcitem@bim.navigationLink': params['BIM_IFCITEMS_URL'] + '/' + guids['json_guid'],
+            'feature@gim.navigationLink': params['GIM_PROJECT_URL'] + ':' + guids['json_guid']
+        })
+    return {
+        'ifcitems': ifc_items,
+        'total': len(elements_ids)
+    }
+
+
+def _serialize_ifc_elements_batch(model, guids, params, index=None, property_index=None):
+    ifc_items = []
+    not_found = []
+    errors = []
+    for guid in guids:
+        try:
+            element_guids = get_guids(guid)
+            entity = model.by_id(element_guids['ifc_guid'])
+        except (RuntimeError, ValueError):
+            not_found.append(guid)
+            continue
+        try:
+            ifc_item = {
+                'globalId': element_guids['json_guid'],
+                'ifcitem@bim.navigationLink': params['BIM_IFCITEMS_URL'] + '/' + element_guids['json_guid']
+            }
+            # only the requested parts are computed
+            if _is_field_requested('info', params):
+                ifc_item['info'] = _serialize_ifc_element_info_entity(entity)
+            if _is_field_requested('psets', params):
+                ifc_item['psets'] = _serialize_psets_entity(entity, property_index)
+            if _is_field_requested('materials', params):
+                ifc_item['materials'] = _serialize_materials_entity(entity, property_index)
+            if params['GEOMETRY'] or (params['FIELDS'] is not None and 'geometry' in params['FIELDS']):
+                ifc_item['geometry'] = _serialize_geometry_entity(entity, params, index)
+            ifc_items.append(ifc_item)
+        except Exception as e:
+            # the other elements are returned, the failed ones are listed
+            logger.error(e)
+            errors.append(guid)
+    result = {
+        'ifcitems': ifc_items,
+        'total': len(ifc_items)
+    }
+    if len(not_found) > 0:
+        result['notFound'] = not_found
+    if len(errors) > 0:
+        result['errors'] = errors
+    return result
 
 
 def _serialize_ifc_element_info(model, guid, params):
     guids = get_guids(guid)
     entity = model.by_id(guids['ifc_guid'])
-    entity_info = entity.get_info(scalar_only=True)
+    return _serialize_ifc_element_info_entity(entity, params['FIELDS'])
+
+
+def _serialize_ifc_element_info_entity(entity, fields=None):
+    if fields is None:
+        entity_info = entity.get_info(scalar_only=True)
+    else:
+        # attributes which are not requested are not read at all
+        ignore = [attr for attr in entity.wrapped_data.get_attribute_names() if attr not in fields]
+        entity_info = entity.get_info(scalar_only=True, ignore=ignore)
+        entity_info = {k: v for k, v in entity_info.items() if k in fields}
     return {k: v for k, v in entity_info.items() if v is not None}
 
 
-def _serialize_psets(model, guid):
+def _serialize_psets(model, guid, property_index=None):
     guids = get_guids(guid)
     entity = model.by_id(guids['ifc_guid'])
-    return _serialize_psets_entity(entity)
+    return _serialize_psets_entity(entity, property_index)
+
 
+def _serialize_pset(model, guid, pset_name, property_index=None):
+    # None if the element has no property set of this name
+    return _serialize_psets(model, guid, property_index).get(pset_name)
 
-def _serialize_psets_entity(entity):
+
+def _serialize_psets_entity(entity, property_index=None):
+    if property_index is not None:
+        return property_index.get_psets(entity)
     psets = ifcopenshell.util.element.get_psets(entity)
     return psets
 
 
-def _serialize_geometry(model, guid, params):
+def _serialize_geometry(model, guid, params, index=None):
     guids = get_guids(guid)
     entity = model.by_id(guids['ifc_guid'])
-    return _serialize_geometry_entity(entity, params)
+    return _serialize_geometry_entity(entity, params, index)
 
 
-def _serialize_geometry_entity(entity, params):
+def _serialize_geometry_entity(entity, params, index=None):
     if (hasattr(entity, 'CompositionType') or entity.is_a('IFCProject') or len(
             entity.IsDecomposedBy) > 0) and not entity.is_a('IFCSpace'):
 
         if params['COMPOSED'] or (params['COMPOSE_ASSEMBLY'] and entity.is_a('IFCElementAssembly')):
-            elements = collect_containing_geometry_elements(entity)
+            elements = collect_containing_geometry_elements(entity, index)
             return gltf_utils.get_json_serialized_gltf_of_ifc_elements(elements, params)
         else:
-            elements_with_geometry = collect_containing_geometry_elements_ids(entity)
+            elements_with_geometry = collect_containing_geometry_elements_ids(entity, index)
             geometry_hrefs = []
             for element in elements_with_geometry:
                 geometry_hrefs.append(params['BIM_IFCITEMS_URL'] + '/' + element['json_guid'] + '/geometry')
@@ -267,45 +455,68 @@ def _serialize_geometry_entity(entity, params):
         return gltf_utils.get_json_serialized_gltf_of_ifc_element(entity, params)
 
 
-def _serialize_materials(model, guid):
+def _serialize_materials(model, guid, property_index=None):
     guids = get_guids(guid)
     entity = model.by_id(guids['ifc_guid'])
-    return _serialize_materials_entity(entity)
+    return _serialize_materials_entity(entity, property_index)
 
 
-def _serialize_materials_entity(entity):
-    materials = ifcopenshell.util.element.get_materials(entity)
-    if len(materials) == 0:
+def _serialize_materials_entity(entity, property_index=None):
+    if property_index is not None:
+        materials_list = property_index.get_materials(entity)
+    else:
+        materials_list = [get_material_as_dict(material) for material in
+                          ifcopenshell.util.element.get_materials(entity)]
+    if len(materials_list) == 0:
         return {}
-    materials_list = []
-    for material in materials:
-        material_dict = {
-            "name": getattr(material, "Name", None),
-            "description": getattr(material, "Description", None),
-            "category": getattr(material, "Category", None),
-            "properties": {}
-        }
-        for props in material.HasProperties:
-            if props.is_a("IfcMaterialProperties"):
-                for prop in props.Properties:
-                    material_dict["properties"][prop.Name] = prop.NominalValue.wrappedValue
-        materials_list.append(material_dict)
     return materials_list
 
 
-def _serialize_project_tree(tree_dict, params):
-    # enhance tree to refs to ifcelements
-    def add_ref(parent):
-        for item in parent['data']:
-            item['ifcGlobalId'] = item['globalId']
-            json_guid = ifc_2_json_guid(item['globalId'])
-            item['ifcitem' + '@bim.navigationLink'] = params['BIM_IFCITEMS_URL'] + '/' + json_guid
-            item['geometry' + '@bim.navigationLink'] = params['BIM_IFCITEMS_URL'] + '/' + json_guid + '/geometry'
-            item['psets' + '@bim.navigationLink'] = params['BIM_IFCITEMS_URL'] + '/' + json_guid + '/psets'
-            item['materials' + '@bim.navigationLink'] = params['BIM_IFCITEMS_URL'] + '/' + json_guid + '/materials'
-            item['feature' + '@gim.navigationLink'] = params['GIM_PROJECT_URL'] + ':' + json_guid
-            item['globalId'] = json_guid
-            add_ref(item)
-
-    add_ref(tree_dict)
-    return tree_dict
+def _serialize_project_tree(tree, params):
+    root = 0
+    if params['ROOT'] is not None:
+        root = tree.get_node(get_guids(params['ROOT'])['ifc_guid'])
+
+    # build tree with refs to ifcelements
+    def serialize_node(node, depth):
+        if node == 0:
+            item = {
+                'name': tree.names[node],
+                'type': tree.types[node],
+                'globalId': tree.global_ids[node]
+            }
+        else:
+            json_guid = tree.json_guids[node]
+            item = {
+                'name': tree.names[node],
+                'type': tree.types[node],
+                'globalId': json_guid,
+                'ifcGlobalId': tree.global_ids[node],
+                'ifcitem' + '@bim.navigationLink': params['BIM_IFCITEMS_URL'] + '/' + json_guid,
+                'geometry' + '@bim.navigationLink': params['BIM_IFCITEMS_URL'] + '/' + json_guid + '/geometry',
+                'psets' + '@bim.navigationLink': params['BIM_IFCITEMS_URL'] + '/' + json_guid + '/psets',
+                'materials' + '@bim.navigationLink': params['BIM_IFCITEMS_URL'] + '/' + json_guid + '/materials',
+                'feature' + '@gim.navigationLink': params['GIM_PROJECT_URL'] + ':' + json_guid
+            }
+
+        if node == root:
+            children = tree.get_children(node, offset=params['OFFSET'], limit=params['LIMIT'])
+            if params['OFFSET'] > 0 or params['LIMIT'] is not None:
+                item['total'] = tree.get_child_count(node)
+        else:
+            children = tree.get_children(node)
+
+        if depth is not None and depth <= 0:
+            item['data'] = []
+            if len(children) > 0:
+                # children are loaded lazily by following the link, which expands at least one level
+                link_depth = params['DEPTH'] if params['DEPTH'] > 0 else config.TREE_LINK_DEPTH
+                # the root node of the tree has no guid, its link omits root
+                link_root = '' if node == 0 else 'root=' + item['globalId'] + '&'
+                item['tree' + '@bim.navigationLink'] = params['BIM_PROJECT_URL'] + '/tree?' + link_root + \
+                                                       'depth=' + str(link_depth)
+        else:
+            item['data'] = [serialize_node(child, None if depth is None else depth - 1) for child in children]
+        return item
+
+    return serialize_node(root, params['DEPTH'])
@@ -20,7 +20,7 @@ import shapely
 
 from api4be.components.cache import cache
 from api4be.components.serializer import bim_serializer
-from api4be.components.utils import geom_utils, spatial_tree_utils
+from api4be.components.utils import geometry_pool, spatial_tree_utils
 from api4be.components.utils.geom_utils import get_2d_bbox_of_ifc_element, get_2d_footprint_of_ifc_element, get_2d_footprint_approx_of_ifc_element
 from api4be.components.utils.georef_utils import transform_local_to_world
 from api4be.components.utils.guid_utils import get_guids
@@ -49,18 +49,18 @@ def serialize_project_as_geojson(project_name, project_dict, params):
 
 
 @cache.memoize()
-def serialize_ifcelement_by_guid_as_geojson(model, guid, params, georef=None):
-    return _serialize_ifcelement_by_guid_as_geojson(model, guid, params, georef)
+def serialize_ifcelement_by_guid_as_geojson(model, guid, params, georef=None, index=None, property_index=None):
+    return _serialize_ifcelement_by_guid_as_geojson(model, guid, params, georef, index, property_index)
 
 
 @cache.memoize()
-def serialize_ifcelement_as_geojson(model, element, params, georef=None, guids=None):
-    return _serialize_ifcelement_as_geojson(model, element, params, georef, guids)
+def serialize_ifcelement_as_geojson(model, element, params, georef=None, guids=None, index=None, property_index=None):
+    return _serialize_ifcelement_as_geojson(model, element, params, georef, guids, index, property_index)
 
 
 @cache.memoize()
-def serialize_ifcelements_as_geojson(model, elements, params, georef=None):
-    return _serialize_ifcelements_as_geojson(model, elements, params, georef)
+def serialize_ifcelements_as_geojson(model, elements, params, georef=None, index=None, property_index=None):
+    return _serialize_ifcelements_as_geojson(model, elements, params, georef, index, property_index)
 
 
 def _serialize_collections_info(collections_names, params):
@@ -119,23 +119,24 @@ def _serialize_project_as_geojson(project_name, project_dict, params):
     feature = {
         'type': 'Feature',
         'geometry': project_dict['geojson_geometry'],
-        'properties': properties
+        'properties': bim_serializer._select_fields(properties, params)
     }
     return feature
 
 
-def _serialize_ifcelement_by_guid_as_geojson(model, guid, params, georef=None):
+def _serialize_ifcelement_by_guid_as_geojson(model, guid, params, georef=None, index=None, property_index=None):
     guids = get_guids(guid)
     element = model.by_id(guids['ifc_guid'])
-    return _serialize_ifcelement_as_geojson(model, element, params, georef=georef, guids=guids)
+    return _serialize_ifcelement_as_geojson(model, element, params, georef=georef, guids=guids, index=index,
+                                            property_index=property_index)
 
 
-def _serialize_ifcelement_as_geojson(model, element, params, georef=None, guids=None):
+def _serialize_ifcelement_as_geojson(model, element, params, georef=None, guids=None, index=None, property_index=None):
     if guids is None:
         guids = get_guids(element.GlobalId)
 
     if hasattr(element, 'CompositionType') or element.is_a('IFCProject'):
-        elements_ids_with_geometry = spatial_tree_utils.collect_containing_geometry_elements_ids(element)
+        elements_ids_with_geometry = spatial_tree_utils.collect_containing_geometry_elements_ids(element, index)
         if (params['COMPOSED']):
             geom = geojson_geometry_of_composed_element(model, element, gtype=params['GTYPE'], georef=georef,
                                                         elements_ids=elements_ids_with_geometry)
@@ -151,15 +152,18 @@ def _serialize_ifcelement_as_geojson(model, element, params, georef=None, guids=
                 properties['psets@bim.navigationLink'] = params['BIM_IFCITEM_URL'] + '/psets'
                 properties['materials@bim.navigationLink'] = params['BIM_IFCITEM_URL'] + '/materials'
             else:
-                psets = bim_serializer._serialize_psets_entity(element)
-                properties['psets'] = psets
-                materials = bim_serializer._serialize_materials_entity(element)
-                properties['materials'] = materials
+                # psets and materials are only looked up if requested
+                if bim_serializer._is_field_requested('psets', params):
+                    psets = bim_serializer._serialize_psets_entity(element, property_index)
+                    properties['psets'] = psets
+                if bim_serializer._is_field_requested('materials', params):
+                    materials = bim_serializer._serialize_materials_entity(element, property_index)
+                    properties['materials'] = materials
 
             geojson = {
                 'type': 'Feature',
                 'geometry': geom,
-                'properties': properties
+                'properties': bim_serializer._select_fields(properties, params)
             }
 
             return geojson
@@ -170,7 +174,7 @@ def _serialize_ifcelement_as_geojson(model, element, params, georef=None, guids=
                 decomposed_element = model.by_id(element_idx['ifc_guid'])
                 try:
                     geojson_feature = geojson_feature_of_element(decomposed_element, element_idx['json_guid'], params,
-                                                                 georef=georef)
+                                                                 georef=georef, property_index=property_index)
                     features.append(geojson_feature)
                 except Exception as e:
                     logging.error(e)
@@ -183,17 +187,18 @@ def _serialize_ifcelement_as_geojson(model, element, params, georef=None, guids=
             return geojson_feature_collection
 
     else:
-        geojson_feature = geojson_feature_of_element(element, guids['json_guid'], params, georef=georef)
+        geojson_feature = geojson_feature_of_element(element, guids['json_guid'], params, georef=georef,
+                                                     property_index=property_index)
         return geojson_feature
 
 
-def _serialize_ifcelements_as_geojson(model, elements, params, georef=None):
+def _serialize_ifcelements_as_geojson(model, elements, params, georef=None, index=None, property_index=None):
     features = []
     with_feature_collections = False
     for element in elements:
         try:
             guids = get_guids(element.GlobalId)
-            geojson_feature = serialize_ifcelement_as_geojson(model, element, params, georef, guids)
+            geojson_feature = serialize_ifcelement_as_geojson(model, element, params, georef, guids, index, property_index)
             if geojson_feature['type'] == 'FeatureCollection':
                 with_feature_collections = True
             features.append(geojson_feature)
@@ -226,7 +231,7 @@ def geojson_geom_of_element(element, gtype=config.DEFAULT_FOOTPRINT_TYPE, georef
     return json.loads(shapely.to_geojson(geometry_as_polygon))
 
 
-def geojson_feature_of_element(element, guid, params, georef=None):
+def geojson_feature_of_element(element, guid, params, georef=None, property_index=None):
     geojson_geom = geojson_geom_of_element(element, gtype=params['GTYPE'], georef=georef)
 
     properties = {}
@@ -240,35 +245,32 @@ def geojson_feature_of_element(element, guid, params, georef=None):
         properties['psets@bim.navigationLink'] = params['BIM_IFCITEM_URL'] + '/psets'
         properties['materials@bim.navigationLink'] = params['BIM_IFCITEM_URL'] + '/materials'
     else:
-        psets = bim_serializer._serialize_psets_entity(element)
-        properties['psets'] = psets
-        materials = bim_serializer._serialize_materials_entity(element)
-        properties['materials'] = materials
+        # psets and materials are only looked up if requested
+        if bim_serializer._is_field_requested('psets', params):
+            psets = bim_serializer._serialize_psets_entity(element, property_index)
+            properties['psets'] = psets
+        if bim_serializer._is_field_requested('materials', params):
+            materials = bim_serializer._serialize_materials_entity(element, property_index)
+            properties['materials'] = materials
 
     geojson_feature = {
         'type': 'Feature',
         'geometry': geojson_geom,
-        'properties': properties
+        'properties': bim_serializer._select_fields(properties, params)
     }
     return geojson_feature
 
 
-def geojson_geometry_of_composed_element(model, element, gtype=config.DEFAULT_FOOTPRINT_TYPE, georef=None, elements_ids=None):
+def geojson_geometry_of_composed_element(model, element, gtype=config.DEFAULT_FOOTPRINT_TYPE, georef=None, elements_ids=None, index=None):
     elements_id_with_geometry = elements_ids
     if elements_id_with_geometry is None:
-        elements_id_with_geometry = spatial_tree_utils.collect_containing_geometry_elements_ids(element)
+        elements_id_with_geometry = spatial_tree_utils.collect_containing_geometry_elements_ids(element, index)
 
     geom = None
     if element.is_a('IFCSpace'):
         geom = geojson_geom_of_element(element)
     else:
-        geometry = None
-        if gtype == 'footprint':
-            geometry = geom_utils.get_2d_footprint_of_ifc_elements(model, elements_id_with_geometry)
-        elif gtype == 'footprint_approx':
-            geometry = geom_utils.get_2d_footprint_approx_of_ifc_elements(model, elements_id_with_geometry)
-        else:
-            geometry = geom_utils.get_2d_bbox_of_ifc_elements(model, elements_id_with_geometry)
+        geometry = geometry_pool.get_2d_geometry_of_ifc_elements(model, gtype, elements_id_with_geometry)
 
         if georef is not None:
             geometry = transform_local_to_world(geometry, georef)
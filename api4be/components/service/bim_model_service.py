@@ -13,9 +13,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
 
+import functools
 import logging
+from contextlib import nullcontext
 
 from api4be.components.repositories.ifc_file_repository import IfcFileRepository
+from api4be.components.serializer import bim_deserializer
 
 logger = logging.getLogger()
 
@@ -25,6 +28,33 @@ class BimModelService:
     def __init__(self):
         self.ifc_file_repository = IfcFileRepository()
 
+    def reading_project(self, collection_name, project_name):
+        """
+        Context in which the project is read, readers run in parallel but never while the project is written
+        """
+        lock = self.ifc_file_repository.get_project_lock(collection_name, project_name)
+        return lock.read() if lock is not None else nullcontext()
+
+    def writing_project(self, collection_name, project_name):
+        """
+        Context in which the project is modified and committed, isolated from readers and other writers
+        """
+        lock = self.ifc_file_repository.get_project_lock(collection_name, project_name)
+        return lock.write() if lock is not None else nullcontext()
+
+    def reads_project(self, view):
+        """
+        Decorator running a view with collection_name and project_name arguments while reading the project
+        """
+        @functools.wraps(view)
+        def read_view(*args, **kwargs):
+            with self.reading_project(kwargs.get('collection_name', 'default'), kwargs['project_name']):
+                return view(*args, **kwargs)
+        return read_view
+
+    def is_read_only(self):
+        return self.ifc_file_repository.read_only
+
     def get_collections_names(self):
         return self.ifc_file_repository.get_collections().keys()
 
@@ -37,17 +67,43 @@ class BimModelService:
     def get_ifc_model_of_project(self, collection_name, project_name):
         return self.ifc_file_repository.get_ifc_model(collection_name, project_name)
 
-    def get_ifc_model_of_project_copy(self, collection_name, project_name):
-        return self.ifc_file_repository.get_ifc_model_from_file(collection_name, project_name)
-
     def get_ifc_filepath(self, collection_name, project_name):
         return self.ifc_file_repository.get_ifc_filepath(collection_name, project_name)
 
     def get_ifc_spatial_tree_of_project(self, collection_name, project_name):
         return self.ifc_file_repository.get_ifc_spatial_tree(collection_name, project_name)
 
+    def get_relationship_index_of_project(self, collection_name, project_name):
+        return self.ifc_file_repository.get_relationship_index(collection_name, project_name)
+
+    def get_property_index_of_project(self, collection_name, project_name):
+        return self.ifc_file_repository.get_property_index(collection_name, project_name)
+
+    def get_query_index_of_project(self, collection_name, project_name):
+        return self.ifc_file_repository.get_query_index(collection_name, project_name)
+
+    def get_change_tracker_of_project(self, collection_name, project_name):
+        return self.ifc_file_repository.get_change_tracker(collection_name, project_name)
+
+    def get_version_of_project(self, collection_name, project_name):
+        return self.get_project(collection_name, project_name)['version']
+
     def get_georef_of_project(self, collection_name, project_name):
         return self.ifc_file_repository.get_georef(collection_name, project_name)
 
     def get_geojson_of_project(self, collection_name, project_name):
-        return self.ifc_file_repository.get_geojson_geometry(collection_name, project_name)
\ No newline at end of file
+        return self.ifc_file_repository.get_geojson_geometry(collection_name, project_name)
+
+    def add_property_sets_of_project(self, collection_name, project_name, element_psets):
+        """
+        Adds the psets to the elements ((element, psets) pairs) in one batch and commits the project once if psets
+        were created, returns the number of created property sets
+        """
+        project = self.ifc_file_repository.get_project(collection_name, project_name)
+        with self.writing_project(collection_name, project_name):
+            count = bim_deserializer.add_property_sets_bulk(project['model'], element_psets,
+                                                            property_index=project['property_index'],
+                                                            changes=project['changes'])
+            if count > 0:
+                self.ifc_file_repository.commit_model(project_name, collection_name)
+        return count
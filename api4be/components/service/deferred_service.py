@@ -0,0 +1,99 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from api4be import config
+from api4be.components.cache import cache
+from api4be.components.models.deferred_job import DeferredJob
+from api4be.components.service.bim_model_service import BimModelService
+from api4be.components.utils import geom_utils
+
+logger = logging.getLogger()
+
+JOB_KEY_PREFIX = 'deferred_job/'
+
+
+class DeferredService:
+    """
+    Runs long-running requests (Prefer: respond-async) as background jobs in a pool of worker threads. The jobs
+    are kept in the cache, so they are seen by all workers of a pre-fork server. The result is stored with the
+    job, so it expires together with the job and not with the responses of the memoized serializers.
+    """
+    executor = None
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.bim_model_service = BimModelService()
+
+    def prefers_async(self, request):
+        preferences = [preference.split('=')[0].strip().lower()
+                       for header in request.headers.getlist('Prefer') for preference in header.split(',')]
+        return 'respond-async' in preferences
+
+    def submit(self, url, collection_name, project_name, serialize, *args, **kwargs):
+        """
+        Returns the job of the request to the project, the response is serialized in the background while reading
+        the project unless the job is already running or done. A failed job is submitted again.
+        """
+        version = self.bim_model_service.get_version_of_project(collection_name, project_name)
+        job_id = hashlib.sha1((url + '#' + str(version)).encode('utf-8')).hexdigest()
+        job = self.get_job(job_id)
+        if job is not None and job.status != 'failed':
+            return job
+
+        job = DeferredJob(job_id, url)
+        if not cache.add(JOB_KEY_PREFIX + job_id, job, timeout=config.DEFERRED_JOB_TTL):
+            # submitted by a concurrent request
+            submitted = self.get_job(job_id)
+            if submitted is not None and submitted.status != 'failed':
+                return submitted
+            self.__store(job)
+        reading = self.bim_model_service.reading_project(collection_name, project_name)
+        self.__get_executor().submit(self.__run_job, current_app._get_current_object(), job, reading,
+                                     lambda: serialize(*args, **kwargs))
+        return job
+
+    def get_job(self, job_id):
+        return cache.get(JOB_KEY_PREFIX + job_id)
+
+    def __get_executor(self):
+        # started on first use, so a forked worker starts a pool of its own
+        with self.lock:
+            if DeferredService.executor is None:
+                DeferredService.executor = ThreadPoolExecutor(config.DEFERRED_WORKERS, thread_name_prefix='deferred')
+            return DeferredService.executor
+
+    def __store(self, job):
+        cache.set(JOB_KEY_PREFIX + job.id, job, timeout=config.DEFERRED_JOB_TTL)
+
+    def __run_job(self, app, job, reading, compute):
+        with app.app_context():
+            job.start()
+            self.__store(job)
+            try:
+                # the client waits for the complete result
+                with reading, geom_utils.unlimited_tessellation():
+                    result = compute()
+                job.finish(result)
+            except Exception as e:
+                logger.exception(e)
+                job.fail(e)
+            self.__store(job)
@@ -0,0 +1,148 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+from api4be.components.models.ingest_job import IngestJob
+from api4be.components.repositories.ifc_file_repository import IfcFileRepository
+from api4be import config
+
+logger = logging.getLogger()
+
+IFCJSON_STAGES = ['parse', 'index', 'georef', 'footprint', 'publish']
+IFC_STAGES = ['write', 'parse', 'index', 'georef', 'footprint', 'publish']
+
+
+class IngestService:
+    """
+    Runs the ingestion of uploaded models as background jobs in a pool of worker threads
+    """
+    # all jobs by id
+    jobs = {}
+    executor = None
+    # a project is checked and its job created in one step
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.ifc_file_repository = IfcFileRepository()
+
+    def get_staging_path(self):
+        return os.path.join(self.ifc_file_repository.serving_path, '.uploads')
+
+    def submit_ifcjson(self, collection_name, project_name, stream):
+        """
+        Submits the ingestion of the ifcJSON read from the stream, which is spooled to a temporary file first.
+        Returns None if the project exists or is ingested, raises ValueError for invalid names (see check_names).
+        """
+        job = self.__reserve_job(collection_name, project_name, IFCJSON_STAGES)
+        if job is None:
+            return None
+        spooled = tempfile.SpooledTemporaryFile(max_size=config.INGEST_SPOOL_SIZE)
+        try:
+            shutil.copyfileobj(stream, spooled)
+            spooled.seek(0)
+        except Exception as e:
+            spooled.close()
+            job.fail(e)
+            raise
+        self.__get_executor().submit(self.__run_job, job, self.ifc_file_repository.create_project_from_ifcjson,
+                                     spooled)
+        return job
+
+    def submit_ifcstream(self, collection_name, project_name, stream):
+        """
+        Submits the ingestion of the IFC file read from the stream, which is staged to a file first.
+        Returns None if the project exists or is ingested, raises ValueError for invalid names (see check_names).
+        """
+        job = self.__reserve_job(collection_name, project_name, IFC_STAGES)
+        if job is None:
+            return None
+        os.makedirs(self.get_staging_path(), exist_ok=True)
+        file_path = os.path.join(self.get_staging_path(), uuid.uuid4().hex + '.part')
+        try:
+            with open(file_path, 'wb') as f:
+                shutil.copyfileobj(stream, f)
+        except Exception as e:
+            os.remove(file_path)
+            job.fail(e)
+            raise
+        self.__get_executor().submit(self.__run_job, job, self.ifc_file_repository.create_project_from_ifcfile,
+                                     file_path)
+        return job
+
+    def submit_ifcfile(self, collection_name, project_name, file_path):
+        """
+        Submits the ingestion of the staged IFC file. Returns None if the project exists or is ingested,
+        raises ValueError for invalid names (see check_names).
+        """
+        job = self.__reserve_job(collection_name, project_name, IFC_STAGES)
+        if job is None:
+            return None
+        self.__get_executor().submit(self.__run_job, job, self.ifc_file_repository.create_project_from_ifcfile,
+                                     file_path)
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def __get_executor(self):
+        # started on first use, so a forked worker starts a pool of its own
+        with self.lock:
+            if IngestService.executor is None:
+                IngestService.executor = ThreadPoolExecutor(config.INGEST_WORKERS, thread_name_prefix='ingest')
+            return IngestService.executor
+
+    def is_ingesting(self, collection_name, project_name):
+        return any(not job.is_finished() and job.collection_name == collection_name and
+                   job.project_name == project_name for job in list(self.jobs.values()))
+
+    def __reserve_job(self, collection_name, project_name, stages):
+        # raises ValueError for names which are not a single plain path segment
+        self.ifc_file_repository.check_names(collection_name, project_name)
+        with self.lock:
+            if project_name in self.ifc_file_repository.get_collections().get(collection_name, {}) or \
+                    self.is_ingesting(collection_name, project_name):
+                return None
+            return self.__create_job(collection_name, project_name, stages)
+
+    def __create_job(self, collection_name, project_name, stages):
+        self.__remove_expired_jobs()
+        job = IngestJob(collection_name, project_name, stages)
+        self.jobs[job.id] = job
+        return job
+
+    def __remove_expired_jobs(self):
+        expired = datetime.now(timezone.utc) - timedelta(seconds=config.INGEST_JOB_TTL)
+        for job in list(self.jobs.values()):
+            if job.is_finished() and job.updated < expired:
+                self.jobs.pop(job.id, None)
+
+    def __run_job(self, job, create_project, data):
+        try:
+            create_project(data, job.project_name, job.collection_name, progress=job.start_stage)
+            job.finish()
+        except Exception as e:
+            logger.exception(e)
+            job.fail(e)
+        finally:
+            if hasattr(data, 'close'):
+                data.close()
@@ -0,0 +1,70 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import logging
+import os
+
+from api4be.components.models.chunked_upload import ChunkedUpload
+from api4be.components.repositories.ifc_file_repository import IfcFileRepository
+from api4be.components.service.ingest_service import IngestService
+
+logger = logging.getLogger()
+
+
+class UploadService:
+    """
+    Resumable chunked uploads of IFC files, staged under the serving path and ingested when complete
+    """
+    # open uploads by id
+    uploads = {}
+
+    def __init__(self):
+        self.ifc_file_repository = IfcFileRepository()
+        self.ingest_service = IngestService()
+
+    def get_staging_path(self):
+        return self.ingest_service.get_staging_path()
+
+    def create_upload(self, collection_name, project_name, size, sha256):
+        self.ifc_file_repository.check_names(collection_name, project_name)
+        upload = ChunkedUpload(self.get_staging_path(), collection_name, project_name, size, sha256)
+        upload.save()
+        self.uploads[upload.id] = upload
+        return upload
+
+    def get_upload(self, upload_id):
+        if upload_id not in self.uploads:
+            # uploads started before a restart are resumed from their stored state
+            upload = ChunkedUpload.load(self.get_staging_path(), upload_id)
+            if upload is None:
+                return None
+            self.uploads.setdefault(upload_id, upload)
+        return self.uploads[upload_id]
+
+    def complete_upload(self, upload):
+        """
+        Verifies the checksum of the complete upload and submits the ingestion of the staged file,
+        raises ValueError (and discards the upload) if the checksum does not match. Returns None (and discards
+        the upload) if the project has been created meanwhile.
+        """
+        self.uploads.pop(upload.id, None)
+        if not upload.verify():
+            upload.remove()
+            raise ValueError('Checksum of upload ' + upload.id + ' does not match')
+        upload.remove(keep_file=True)
+        job = self.ingest_service.submit_ifcfile(upload.collection_name, upload.project_name, upload.part_path)
+        if job is None:
+            os.remove(upload.part_path)
+        return job
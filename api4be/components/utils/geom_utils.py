@@ -13,11 +13,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
 
+import contextvars
 import logging
 import math
 import multiprocessing
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 
 import ifcopenshell.geom
+import ifcopenshell.util.placement
+import ifcopenshell.util.unit
 import numpy as np
 from shapely import MultiPoint, Polygon
 from shapely.geometry import box
@@ -25,9 +32,15 @@ from shapely.ops import unary_union
 from ifcopenshell.util.shape import get_bbox_centroid
 
 from api4be.components.utils.logging_utils import print_ifc_element
+from api4be import config
 
 logger = logging.getLogger()
 
+# model -> {element id: shape} of the elements exceeding the tessellation budget (None while tessellated in background)
+_over_budget = weakref.WeakKeyDictionary()
+_over_budget_lock = threading.Lock()
+_budgets_enabled = contextvars.ContextVar('budgets_enabled', default=True)
+
 
 ####################################
 # Get 3D shapes of ifc elements
@@ -91,6 +104,185 @@ def get_shape_of_ifc_element(element):
     }
 
 
+####################################
+# Tessellation budgets
+####################################
+
+class TessellationBudget:
+    """
+    Time budgets of the tessellation of a request (GEOMETRY_REQUEST_BUDGET) and of an element (GEOMETRY_ELEMENT_BUDGET).
+    Elements exceeding the budget of an element and elements left when the budget of the request is spent are
+    substituted by a placeholder until their shape is tessellated in the background.
+    """
+
+    def __init__(self):
+        enabled = _budgets_enabled.get()
+        self.element_seconds = config.GEOMETRY_ELEMENT_BUDGET if enabled else 0
+        request_seconds = config.GEOMETRY_REQUEST_BUDGET if enabled else 0
+        self.deadline = time.monotonic() + request_seconds if request_seconds > 0 else None
+
+    def remaining(self):
+        """
+        Returns the seconds left of the budget of the request (None without budget)
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def is_spent(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def is_exceeded_by(self, seconds):
+        return 0 < self.element_seconds < seconds
+
+
+@contextmanager
+def unlimited_tessellation():
+    """
+    Context without tessellation budgets, e.g. for requests computed in the background
+    """
+    token = _budgets_enabled.set(False)
+    try:
+        yield
+    finally:
+        _budgets_enabled.reset(token)
+
+
+def is_over_budget(element):
+    return element.id() in _over_budget.get(element.file, {})
+
+
+def get_shape_over_budget(element):
+    """
+    Returns the shape of an element exceeding the budget, None while it is not tessellated
+    """
+    return _over_budget.get(element.file, {}).get(element.id())
+
+
+def mark_over_budget(element):
+    """
+    Marks the element as exceeding the budget, returns False if it has been marked before
+    """
+    with _over_budget_lock:
+        shapes = _over_budget.setdefault(element.file, {})
+        if element.id() in shapes:
+            return False
+        shapes[element.id()] = None
+        return True
+
+
+def set_shape_over_budget(element, shape):
+    """
+    Keeps the shape of an element exceeding the budget, so it is not tessellated again (without shape it is unmarked)
+    """
+    with _over_budget_lock:
+        shapes = _over_budget.setdefault(element.file, {})
+        if shape is None:
+            shapes.pop(element.id(), None)
+        else:
+            shapes[element.id()] = shape
+
+
+def reset_tessellation_budgets(model):
+    """
+    Forgets the shapes of the elements exceeding the budget after the geometry of the model changed
+    """
+    with _over_budget_lock:
+        _over_budget.pop(model, None)
+
+
+def get_placeholder_shape(element):
+    """
+    Returns a shape of the bounding box of the element, computed from the points of its representation
+    without tessellation (None if the element has no points)
+    """
+    if element.Representation is None:
+        return None
+    try:
+        points = [point for representation in element.Representation.Representations
+                  if representation.RepresentationIdentifier in [None, 'Body', 'Facetation', 'Box']
+                  for item in representation.Items for point in _get_points_of_item(item)]
+    except (AttributeError, TypeError) as e:
+        # items with unset attributes or attributes of another schema version
+        logger.error(e)
+        return None
+    if len(points) == 0:
+        return None
+
+    matrix = ifcopenshell.util.placement.get_local_placement(element.ObjectPlacement)
+    points = _transform_points(points, matrix) * ifcopenshell.util.unit.calculate_unit_scale(element.file)
+    (x0, y0, z0), (x1, y1, z1) = points.min(axis=0), points.max(axis=0)
+    vertices = [x0, y0, z0, x1, y0, z0, x1, y1, z0, x0, y1, z0, x0, y0, z1, x1, y0, z1, x1, y1, z1, x0, y1, z1]
+    faces = [0, 2, 1, 0, 3, 2, 4, 5, 6, 4, 6, 7, 0, 1, 5, 0, 5, 4, 1, 2, 6, 1, 6, 5, 2, 3, 7, 2, 7, 6, 3, 0, 4, 3, 4, 7]
+    edges = [0, 1, 1, 2, 2, 3, 3, 0, 4, 5, 5, 6, 6, 7, 7, 4, 0, 4, 1, 5, 2, 6, 3, 7]
+    return {
+        'vertices': vertices,
+        'edges': edges,
+        'faces': faces,
+        'materials': [{'name': 'placeholder', 'diffuse': [0.8, 0.8, 0.8], 'transparency': 0.5}],
+        'material_ids': [0] * (len(faces) // 3),
+        'placeholder': 'bbox',
+    }
+
+
+def _get_points_of_item(item):
+    """
+    Returns points bounding the representation item in the coordinates of the representation
+    """
+    if item.is_a('IfcMappedItem'):
+        points = [point for mapped_item in item.MappingSource.MappedRepresentation.Items
+                  for point in _get_points_of_item(mapped_item)]
+        return _transform_points(points, ifcopenshell.util.placement.get_mappeditem_transformation(item)).tolist()
+    if item.is_a('IfcBooleanResult'):
+        # differences and clippings are inside of the first operand
+        points = _get_points_of_item(item.FirstOperand)
+        if item.Operator == 'UNION':
+            points += _get_points_of_item(item.SecondOperand)
+        return points
+    if item.is_a('IfcExtrudedAreaSolid'):
+        profile = _get_points_of_profile(item.SweptArea)
+        dx, dy, dz = np.array(item.ExtrudedDirection.DirectionRatios, dtype=float) * item.Depth
+        points = [[x, y, 0.0] for x, y in profile] + [[x + dx, y + dy, dz] for x, y in profile]
+        if item.Position is None:
+            return points
+        return _transform_points(points, ifcopenshell.util.placement.get_axis2placement(item.Position)).tolist()
+    if item.is_a('IfcHalfSpaceSolid'):
+        return []
+    return _get_points_of_entity(item)
+
+
+def _get_points_of_profile(profile):
+    if profile.is_a('IfcRectangleProfileDef'):
+        x, y = profile.XDim / 2, profile.YDim / 2
+        points = [[-x, -y], [x, -y], [x, y], [-x, y]]
+    elif profile.is_a('IfcCircleProfileDef'):
+        r = profile.Radius
+        points = [[-r, -r], [r, -r], [r, r], [-r, r]]
+    else:
+        points = [point[:2] for point in _get_points_of_entity(profile)]
+    if getattr(profile, 'Position', None) is None or len(points) == 0:
+        return points
+    matrix = ifcopenshell.util.placement.get_axis2placement(profile.Position)
+    return [point[:2] for point in _transform_points([[x, y, 0.0] for x, y in points], matrix).tolist()]
+
+
+def _get_points_of_entity(entity):
+    points = []
+    for referenced in entity.file.traverse(entity):
+        if referenced.is_a('IfcCartesianPoint'):
+            points.append(list(referenced.Coordinates) + [0.0] * (3 - len(referenced.Coordinates)))
+        elif referenced.is_a('IfcCartesianPointList3D'):
+            points.extend(list(coordinates) for coordinates in referenced.CoordList)
+        elif referenced.is_a('IfcCartesianPointList2D'):
+            points.extend(list(coordinates) + [0.0] for coordinates in referenced.CoordList)
+    return points
+
+
+def _transform_points(points, matrix):
+    points = np.array(points, dtype=float).reshape(-1, 3)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
 def get_3d_bbox_of_ifc_element(element):
     shape = None
     try:
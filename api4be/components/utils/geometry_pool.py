@@ -0,0 +1,371 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import ifcopenshell
+import numpy as np
+import shapely
+
+from api4be.components.utils import geom_utils
+from api4be.components.utils.logging_utils import print_ifc_element
+from api4be import config
+
+logger = logging.getLogger()
+
+# arrays of a tessellated shape (see geom_utils.get_shape_of_ifc_element) and their types in shared memory
+SHAPE_ARRAYS = [('vertices', np.float64), ('edges', np.int32), ('faces', np.int32), ('material_ids', np.int32)]
+
+_executor = None
+_executor_lock = threading.Lock()
+# bounds the submitted and unfinished jobs, further jobs are rejected instead of queued
+_job_slots = None
+# model -> function returning the path of an IFC file equal to the model (None while it is not up to date)
+_model_paths = weakref.WeakKeyDictionary()
+
+# in-process tessellation of elements exceeding the budget
+_background = None
+
+# Models opened by a worker process by path -> (modification time, model)
+_worker_models = {}
+
+
+class GeometryPoolBusy(Exception):
+    """
+    The geometry pool has no free job slot or a job did not finish in time
+    """
+
+
+def is_enabled():
+    return config.GEOMETRY_PROCESSES > 0
+
+
+def register_model(model, get_path):
+    """
+    Makes the geometry of the model computable by the workers, which open their own copy of the IFC file
+    returned by get_path (the geometry is computed in-process while it returns None)
+    """
+    _model_paths[model] = get_path
+
+
+def _get_path(model):
+    if not is_enabled() or model not in _model_paths:
+        return None
+    return _model_paths[model]()
+
+
+def _get_executor():
+    global _executor, _job_slots
+    with _executor_lock:
+        if _executor is None:
+            # spawned workers do not inherit the state (threads, locks) of the serving process
+            _executor = ProcessPoolExecutor(config.GEOMETRY_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+            _job_slots = threading.BoundedSemaphore(config.GEOMETRY_MAX_JOBS)
+        return _executor
+
+
+def _submit(function, *args):
+    executor = _get_executor()
+    if not _job_slots.acquire(blocking=False):
+        raise GeometryPoolBusy('All ' + str(config.GEOMETRY_MAX_JOBS) + ' geometry job slots are taken')
+    try:
+        future = executor.submit(function, *args)
+    except BrokenProcessPool:
+        _job_slots.release()
+        _reset_executor(executor)
+        raise GeometryPoolBusy('The geometry pool is restarting')
+    future.add_done_callback(lambda done: _job_slots.release())
+    return future
+
+
+def _result(future):
+    try:
+        return future.result(timeout=config.GEOMETRY_JOB_TIMEOUT)
+    except FutureTimeoutError:
+        raise GeometryPoolBusy('Geometry job did not finish within ' + str(config.GEOMETRY_JOB_TIMEOUT) + ' seconds')
+    except BrokenProcessPool:
+        # a worker died (e.g. in the geometry kernel), the next job starts a new pool
+        _reset_executor(_executor)
+        raise GeometryPoolBusy('A geometry worker died, the geometry pool is restarting')
+
+
+def _reset_executor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor and executor is not None:
+            _executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+####################################
+# Tessellation
+####################################
+
+class SharedShapes:
+    """
+    Shapes tessellated by a worker, the arrays are views of the shared memory block written by the worker
+    """
+
+    def __init__(self, name, layouts):
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.shapes = []
+        for layout in layouts:
+            if layout is None:
+                self.shapes.append(None)
+                continue
+            shape = {'materials': layout['materials']}
+            for (field, dtype), (offset, count) in zip(SHAPE_ARRAYS, layout['arrays']):
+                shape[field] = np.ndarray((count,), dtype=dtype, buffer=self.memory.buf, offset=offset)
+            self.shapes.append(shape)
+
+    def release(self):
+        self.shapes = None
+        try:
+            self.memory.close()
+        except BufferError as e:
+            # arrays are still referenced, the block is unmapped when they are released
+            logger.warning('Shared shapes %s still referenced on release: %s', self.memory.name, e)
+        self.memory.unlink()
+
+
+def _release_late_result(future):
+    """
+    Releases the shared memory of a job whose result is not used, once the job finishes
+    """
+    def release(done):
+        if not done.cancelled() and done.exception() is None:
+            memory = shared_memory.SharedMemory(name=done.result()[0])
+            memory.close()
+            memory.unlink()
+    future.cancel()
+    future.add_done_callback(release)
+
+
+@contextmanager
+def shapes_of_ifc_elements(elements):
+    """
+    Yields the shapes of the elements (None for elements without shape). With a pool the elements are
+    tessellated by the workers in parallel and the shapes are valid inside the context only. Elements exceeding
+    the tessellation budget (see geom_utils.TessellationBudget) are substituted by a placeholder shape.
+    """
+    elements = list(elements)
+    budget = geom_utils.TessellationBudget()
+    path = _get_path(elements[0].file) if len(elements) > 0 else None
+    if path is None:
+        yield _get_shapes_in_process(elements, budget)
+        return
+
+    shapes = [_get_shape_over_budget(element, path) if geom_utils.is_over_budget(element) else None
+              for element in elements]
+    tessellated = [i for i, element in enumerate(elements) if not geom_utils.is_over_budget(element)]
+    chunk_size = max(math.ceil(len(tessellated) / config.GEOMETRY_PROCESSES), 1)
+    chunks = [tessellated[start:start + chunk_size] for start in range(0, len(tessellated), chunk_size)]
+    pending = []
+    shared = []
+    try:
+        for chunk in chunks:
+            pending.append(_submit(_tessellate, path, [elements[i].id() for i in chunk]))
+        for chunk in chunks:
+            remaining = budget.remaining()
+            if remaining is not None and remaining < config.GEOMETRY_JOB_TIMEOUT and \
+                    len(wait([pending[0]], timeout=remaining).not_done) > 0:
+                # the budget of the request is spent, the shapes are kept once the jobs are finished
+                for late_chunk, future in zip(chunks[len(chunks) - len(pending):], pending):
+                    late_elements = [elements[i] for i in late_chunk]
+                    for i, element in zip(late_chunk, late_elements):
+                        geom_utils.mark_over_budget(element)
+                        shapes[i] = geom_utils.get_placeholder_shape(element)
+                    future.add_done_callback(lambda done, late=late_elements: _keep_late_shapes(done, late))
+                pending = []
+                break
+            name, layouts = _result(pending[0])
+            pending.pop(0)
+            shared.append(SharedShapes(name, layouts))
+            for i, shape, layout in zip(chunk, shared[-1].shapes, layouts):
+                if layout is not None and budget.is_exceeded_by(layout['seconds']):
+                    geom_utils.set_shape_over_budget(elements[i], _copy_shape(shape))
+                shapes[i] = shape
+        yield shapes
+    finally:
+        for future in pending:
+            _release_late_result(future)
+        for shared_shapes in shared:
+            shared_shapes.release()
+
+
+def _get_shapes_in_process(elements, budget):
+    shapes = []
+    for element in elements:
+        if geom_utils.is_over_budget(element) or budget.is_spent():
+            shapes.append(_get_shape_over_budget(element, None))
+            continue
+        # the tessellation of an element can not be interrupted, an element exceeding the budget is known afterwards
+        start = time.monotonic()
+        shape = _get_shape_of_ifc_element(element)
+        if shape is not None and budget.is_exceeded_by(time.monotonic() - start):
+            geom_utils.set_shape_over_budget(element, _copy_shape(shape))
+        shapes.append(shape)
+    return shapes
+
+
+def _get_shape_over_budget(element, path):
+    """
+    Returns the shape of an element exceeding the budget once it is tessellated in the background, until then
+    its placeholder
+    """
+    shape = geom_utils.get_shape_over_budget(element)
+    if shape is not None:
+        return _copy_shape(shape)
+    if geom_utils.mark_over_budget(element):
+        _tessellate_in_background(element, path)
+    return geom_utils.get_placeholder_shape(element)
+
+
+def _tessellate_in_background(element, path):
+    global _background
+    if path is None:
+        with _executor_lock:
+            if _background is None:
+                _background = ThreadPoolExecutor(1, thread_name_prefix='tessellation')
+        future = _background.submit(_get_shape_of_ifc_element, element)
+        future.add_done_callback(lambda done: geom_utils.set_shape_over_budget(
+            element, None if done.exception() is not None else done.result()))
+        return
+    try:
+        future = _submit(_tessellate, path, [element.id()])
+    except GeometryPoolBusy:
+        # tried again by the next request
+        geom_utils.set_shape_over_budget(element, None)
+        return
+    future.add_done_callback(lambda done: _keep_late_shapes(done, [element]))
+
+
+def _keep_late_shapes(future, elements):
+    """
+    Keeps the shapes of a job finished after the budget of its request was spent
+    """
+    if future.cancelled() or future.exception() is not None:
+        for element in elements:
+            geom_utils.set_shape_over_budget(element, None)
+        return
+    shared_shapes = SharedShapes(*future.result())
+    try:
+        for element, shape in zip(elements, shared_shapes.shapes):
+            geom_utils.set_shape_over_budget(element, _copy_shape(shape))
+    finally:
+        shared_shapes.release()
+
+
+def _copy_shape(shape):
+    # the arrays may be views of shared memory, the lists are modified by the glTF serialization
+    if shape is None:
+        return None
+    return {field: value.copy() if isinstance(value, np.ndarray) else list(value) if isinstance(value, (list, tuple))
+            else value for field, value in shape.items()}
+
+
+def _get_shape_of_ifc_element(element):
+    try:
+        return geom_utils.get_shape_of_ifc_element(element)
+    except Exception as e:
+        traceback.print_exception(type(e), e, e.__traceback__)
+        logger.error(e)
+        logger.error('Error in getting shape of element: ' + print_ifc_element(element))
+        return None
+
+
+def _open_worker_model(path):
+    modification_time = os.path.getmtime(path)
+    if path not in _worker_models or _worker_models[path][0] != modification_time:
+        _worker_models[path] = (modification_time, ifcopenshell.open(path))
+    return _worker_models[path][1]
+
+
+def _tessellate(path, element_ids):
+    """
+    Worker of the tessellation, writes the arrays of the shapes into a new shared memory block and returns
+    its name with the layout (offsets and lengths of the arrays) and materials of each shape
+    """
+    model = _open_worker_model(path)
+    shapes = []
+    seconds = []
+    for element_id in element_ids:
+        start = time.monotonic()
+        shapes.append(_get_shape_of_ifc_element(model.by_id(element_id)))
+        seconds.append(time.monotonic() - start)
+    arrays = [None if shape is None else [np.asarray(shape[field], dtype=dtype) for field, dtype in SHAPE_ARRAYS]
+              for shape in shapes]
+    # arrays start at multiples of 8 bytes, so they are aligned
+    size = sum((array.nbytes + 7) // 8 * 8 for shape_arrays in arrays if shape_arrays for array in shape_arrays)
+    memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+    layouts = []
+    offset = 0
+    for shape, shape_arrays, shape_seconds in zip(shapes, arrays, seconds):
+        if shape is None:
+            layouts.append(None)
+            continue
+        layout = {'materials': shape['materials'], 'arrays': [], 'seconds': shape_seconds}
+        for array in shape_arrays:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf, offset=offset)[:] = array
+            layout['arrays'].append((offset, len(array)))
+            offset += (array.nbytes + 7) // 8 * 8
+        layouts.append(layout)
+    memory.close()
+    return memory.name, layouts
+
+
+####################################
+# Footprints
+####################################
+
+def get_2d_geometry_of_ifc_elements(model, gtype, elements_ids):
+    """
+    Returns the union of the 2D geometries [footprint, footprint_approx, bbox] of the elements
+    """
+    path = _get_path(model)
+    if path is None:
+        return _get_2d_geometry_of_ifc_elements(model, gtype, elements_ids)
+    future = _submit(_compute_2d_geometry, path, gtype, elements_ids)
+    try:
+        return shapely.from_wkb(_result(future))
+    finally:
+        future.cancel()
+
+
+def _get_2d_geometry_of_ifc_elements(model, gtype, elements_ids):
+    if gtype == 'footprint':
+        return geom_utils.get_2d_footprint_of_ifc_elements(model, elements_ids)
+    elif gtype == 'footprint_approx':
+        return geom_utils.get_2d_footprint_approx_of_ifc_elements(model, elements_ids)
+    return geom_utils.get_2d_bbox_of_ifc_elements(model, elements_ids)
+
+
+def _compute_2d_geometry(path, gtype, elements_ids):
+    """
+    Worker of the footprints, returns the geometry as WKB
+    """
+    return shapely.to_wkb(_get_2d_geometry_of_ifc_elements(_open_worker_model(path), gtype, elements_ids))
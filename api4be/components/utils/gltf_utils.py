@@ -16,24 +16,25 @@
 import base64
 import json
 import logging
-import traceback
 
 import numpy as np
 import pygltflib
 
-from api4be.components.utils.geom_utils import get_shape_of_ifc_element
+from api4be.components.utils import geometry_pool
 from api4be.components.utils.guid_utils import get_guids
-from api4be.components.utils.logging_utils import print_ifc_element
 
 logger = logging.getLogger()
 
 def get_gltf_of_ifc_element(element, params):
-    try:
-        shape = get_shape_of_ifc_element(element)
-    except Exception as e:
-        traceback.print_exception(type(e), e, e.__traceback__)
-        logger.error(e)
-        logger.error('Error in getting shape of element: ' + print_ifc_element(element))
+    with geometry_pool.shapes_of_ifc_elements([element]) as shapes:
+        gltf = _get_gltf_of_shape(shapes[0])
+        if shapes[0] is not None and 'placeholder' in shapes[0]:
+            gltf.extras = {'placeholders': [get_guids(element.GlobalId)['json_guid']]}
+        return gltf
+
+
+def _get_gltf_of_shape(shape):
+    if shape is None:
         return {}
 
     grouped_verts = [shape['vertices'][x:x + 3] for x in range(0, len(shape['vertices']), 3)]
@@ -199,10 +200,13 @@ def get_gltf_of_ifc_element(element, params):
 
 
 def get_gltf_of_ifc_elements(elements, params):
-    gltfs = []
-    for element in elements:
-        guids = get_guids(element.GlobalId)
-        gltfs.append([guids['json_guid'], get_gltf_of_ifc_element(element, params)])
+    # the shapes of all elements are tessellated at once (in parallel by the geometry pool)
+    with geometry_pool.shapes_of_ifc_elements(elements) as shapes:
+        gltfs = [[get_guids(element.GlobalId)['json_guid'], _get_gltf_of_shape(shape)]
+                 for element, shape in zip(elements, shapes)]
+        # elements exceeding the tessellation budget, substituted by a placeholder
+        placeholders = {get_guids(element.GlobalId)['json_guid']: shape['placeholder']
+                        for element, shape in zip(elements, shapes) if shape is not None and 'placeholder' in shape}
 
     if len(gltfs) == 0:
         return pygltflib.GLTF2()
@@ -210,6 +214,8 @@ def get_gltf_of_ifc_elements(elements, params):
 
     nodes = []
     nodes.append(pygltflib.Node(mesh=0, name=gltfs[0][0]))
+    if gltfs[0][0] in placeholders:
+        nodes[0].extras = {'placeholder': placeholders[gltfs[0][0]]}
 
     materials = gltfs[0][1].materials.copy()
     accessors = gltfs[0][1].accessors.copy()
@@ -225,6 +231,8 @@ def get_gltf_of_ifc_elements(elements, params):
             continue
 
         nodes.append(pygltflib.Node(mesh=idx, name=gltfs[idx][0]))
+        if gltfs[idx][0] in placeholders:
+            nodes[-1].extras = {'placeholder': placeholders[gltfs[idx][0]]}
 
         len_materials = len(materials)
         len_accessors = len(accessors)
@@ -261,6 +269,8 @@ def get_gltf_of_ifc_elements(elements, params):
         buffers=buffers,
         materials=materials
     )
+    if len(placeholders) > 0:
+        gltf.extras = {'placeholders': list(placeholders.keys())}
     return gltf
 
 
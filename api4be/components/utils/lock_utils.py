@@ -0,0 +1,89 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """
+    Lock held by many readers or a single writer. Waiting writers are preferred over new readers, so
+    writes are not starved by a steady stream of reads. A thread holding the lock may acquire it again and
+    a writer may also read, but a reader cannot upgrade to a writer.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # thread id -> number of read acquisitions
+        self._readers = {}
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        thread = threading.get_ident()
+        with self._condition:
+            if self._writer != thread and thread not in self._readers:
+                while self._writer is not None or self._waiting_writers > 0:
+                    self._condition.wait()
+            self._readers[thread] = self._readers.get(thread, 0) + 1
+
+    def release_read(self):
+        thread = threading.get_ident()
+        with self._condition:
+            self._readers[thread] -= 1
+            if self._readers[thread] == 0:
+                del self._readers[thread]
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        thread = threading.get_ident()
+        with self._condition:
+            if self._writer == thread:
+                self._writes += 1
+                return
+            if thread in self._readers:
+                raise RuntimeError('A read lock cannot be upgraded to a write lock')
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or len(self._readers) > 0:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = thread
+            self._writes = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writes -= 1
+            if self._writes == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -0,0 +1,27 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+def get_material_as_dict(material):
+    material_dict = {
+        "name": getattr(material, "Name", None),
+        "description": getattr(material, "Description", None),
+        "category": getattr(material, "Category", None),
+        "properties": {}
+    }
+    for props in material.HasProperties:
+        if props.is_a("IfcMaterialProperties"):
+            for prop in props.Properties:
+                material_dict["properties"][prop.Name] = prop.NominalValue.wrappedValue
+    return material_dict
@@ -16,7 +16,16 @@
 from urllib.parse import urljoin
 from urllib.parse import urlparse, urlunparse
 
+from flask import jsonify
+
 from api4be import config
+from api4be.components.serializer import bim_serializer
+
+
+class InvalidQueryParameter(ValueError):
+    """
+    A query parameter has a value the routes can not serve, answered with 400
+    """
 
 
 def _get_request_urls(endpoint, collection_name=None, project_name=None, guid=None):
@@ -29,6 +38,8 @@ def _get_request_urls(endpoint, collection_name=None, project_name=None, guid=No
 
     URLS_DICT['BIM_COLLECTIONS_URL'] = endpoint + '/' + 'bim/collections'
     URLS_DICT['GIM_COLLECTIONS_URL'] = endpoint + '/' + 'gim/collections'
+    URLS_DICT['BIM_JOBS_URL'] = endpoint + '/' + 'bim/jobs'
+    URLS_DICT['BIM_UPLOADS_URL'] = endpoint + '/' + 'bim/uploads'
 
     if collection_name is not None:
         URLS_DICT['GIM_COLLECTION_URL'] = URLS_DICT['GIM_COLLECTIONS_URL'] + '/' + collection_name
@@ -58,6 +69,29 @@ def _is_it_true(value):
     return value.lower() == 'true'
 
 
+def _get_list(value):
+    return [item.strip() for item in value.split(',') if item.strip() != '']
+
+
+def _get_non_negative_int(request, name, default):
+    value = request.args.get(name, default=default, type=int)
+    if value is not None and value < 0:
+        raise InvalidQueryParameter(name + ' must not be negative')
+    return value
+
+
+def _get_property_predicates(request):
+    """
+    Collects the property filters given as <pset name>.<property name>=<value> query parameters
+    """
+    predicates = []
+    for key, value in request.args.items():
+        if '.' in key:
+            pset_name, property_name = key.split('.', 1)
+            predicates.append((pset_name, property_name, value))
+    return sorted(predicates)
+
+
 def get_bim_request_query_parameters(request, collection_name=None, project_name=None, guid=None):
     endpoint = urljoin(request.host_url, config.API_PATH)
     URLS_DICT = _get_request_urls(endpoint, collection_name, project_name, guid)
@@ -77,6 +111,20 @@ def get_bim_request_query_parameters(request, collection_name=None, project_name
         'COMPOSED': request.args.get('composed', default=False, type=_is_it_true),
         'COMPOSE_ASSEMBLY': request.args.get('compose_assembly', default=True, type=_is_it_true),
 
+        # Query parameters for spatial tree
+        'ROOT': request.args.get('root', default=None, type=str),
+        'DEPTH': request.args.get('depth', default=None, type=int),
+        'OFFSET': _get_non_negative_int(request, 'offset', 0),
+        'LIMIT': _get_non_negative_int(request, 'limit', None),
+
+        # Query parameters for filtering ifcitems
+        'TYPE': request.args.get('type', default=None, type=str),
+        'STOREY': request.args.get('storey', default=None, type=str),
+        'PROPERTIES': _get_property_predicates(request),
+
+        # Query parameter for sparse fieldsets
+        'FIELDS': request.args.get('fields', default=None, type=_get_list),
+
         # Query parameter for format
         'FORMAT': request.args.get('format', default='json', type=str),
     }
@@ -95,6 +143,15 @@ def get_gim_request_query_parameters(request, collection_name=None, project_name
         'COMPOSED': request.args.get('composed', default=True, type=_is_it_true),
         'GTYPE': request.args.get('gtype', default=config.DEFAULT_FOOTPRINT_TYPE, type=str),
 
+        # Query parameters for filtering features
+        'TYPE': request.args.get('type', default=None, type=str),
+        'STOREY': request.args.get('storey', default=None, type=str),
+        'PROPERTIES': _get_property_predicates(request),
+
+        # Query parameter for sparse fieldsets (properties of the features)
+        'FIELDS': request.args.get('properties', default=request.args.get('fields', default=None, type=_get_list),
+                                   type=_get_list),
+
         # Query parameter for format
         'FORMAT': request.args.get('format', default='application/geo+json', type=str),
 
@@ -102,3 +159,17 @@ def get_gim_request_query_parameters(request, collection_name=None, project_name
 
     GIM_PARAMS_DICT.update(URLS_DICT)
     return GIM_PARAMS_DICT
+
+
+def get_deferred_response(job, params, status=202):
+    """
+    Returns the result of a done deferred job or the state of an unfinished job, the client polls the job until
+    it is redirected to the result
+    """
+    if job.status == 'done':
+        return jsonify(job.result)
+    response = jsonify(bim_serializer.serialize_deferred_job(job, params))
+    response.status_code = status
+    response.headers['Location'] = params['BIM_JOBS_URL'] + '/' + job.id
+    response.headers['Retry-After'] = '5'
+    return response
@@ -16,7 +16,10 @@
 from api4be.components.utils.guid_utils import get_guids
 
 
-def collect_containing_geometry_elements(element):
+def collect_containing_geometry_elements(element, index=None):
+    if index is not None:
+        return index.get_geometry_elements(element)
+
     geometry_elements = []
 
     def collect_geometries(parent, geometry_elements):
@@ -41,7 +44,10 @@ def collect_containing_geometry_elements(element):
     return geometry_elements
 
 
-def collect_containing_geometry_elements_ids(element):
+def collect_containing_geometry_elements_ids(element, index=None):
+    if index is not None:
+        return index.get_geometry_elements_ids(element)
+
     geometry_elements_guids = []
     geometry_elements = collect_containing_geometry_elements(element)
     for geometry_element in geometry_elements:
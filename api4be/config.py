@@ -28,4 +28,31 @@ REL_URI = os.getenv('REL_URI', False)
 CACHE_TYPE = os.getenv('CACHE_TYPE', 'SimpleCache')
 CACHE_DIR = os.getenv('CACHE_DIR','cache')
 CACHE_DEFAULT_TIMEOUT = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 0))
-DEFAULT_FOOTPRINT_TYPE = os.getenv('DEFAULT_FOOTPRINT_TYPE', 'footprint') # [footprint, footprint_approx, bbox]
\ No newline at end of file
+DEFAULT_FOOTPRINT_TYPE = os.getenv('DEFAULT_FOOTPRINT_TYPE', 'footprint') # [footprint, footprint_approx, bbox]
+TREE_LINK_DEPTH = int(os.getenv('TREE_LINK_DEPTH', 1)) # levels expanded by the lazy-load links of a tree requested with depth=0
+IFCJSON_EXPORT_PROCESSES = int(os.getenv('IFCJSON_EXPORT_PROCESSES', 0)) # > 1 exports ifcJSON with a pool of processes
+IFCJSON_OBJECT_CACHE_SIZE = int(os.getenv('IFCJSON_OBJECT_CACHE_SIZE', 65536)) # shared sub-objects kept by an ifcJSON export, the least recently used are dropped beyond
+IFCJSON_SPOOL_SIZE = int(os.getenv('IFCJSON_SPOOL_SIZE', 8 * 1024 * 1024)) # bytes of a streamed ifcJSON export kept in memory, larger exports are spooled to disk
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 2)) # worker threads ingesting uploaded models
+INGEST_SPOOL_SIZE = int(os.getenv('INGEST_SPOOL_SIZE', 8 * 1024 * 1024)) # bytes of an ifcJSON body kept in memory, larger bodies are spooled to disk
+INGEST_JOB_TTL = int(os.getenv('INGEST_JOB_TTL', 3600)) # seconds finished ingest jobs are kept
+CHANGE_LOG_COMPACTION_INTERVAL = int(os.getenv('CHANGE_LOG_COMPACTION_INTERVAL', 60)) # seconds until committed changes are compacted into the IFC file
+CHANGE_LOG_COMPACTION_SIZE = int(os.getenv('CHANGE_LOG_COMPACTION_SIZE', 100)) # logged commits compacted immediately
+GEOMETRY_PROCESSES = int(os.getenv('GEOMETRY_PROCESSES', 0)) # > 0 tessellates and computes footprints in a pool of processes
+GEOMETRY_MAX_JOBS = int(os.getenv('GEOMETRY_MAX_JOBS', 32)) # unfinished geometry jobs, further requests are rejected
+GEOMETRY_JOB_TIMEOUT = int(os.getenv('GEOMETRY_JOB_TIMEOUT', 120)) # seconds a request waits for a geometry job
+PREFORK = os.getenv('PREFORK', 'False').lower() == 'true' # models loaded once and shared read-only by the workers of a pre-fork server
+PREFORK_CACHE_TIMEOUT = int(os.getenv('PREFORK_CACHE_TIMEOUT', 3600)) # seconds the responses shared by the workers of a pre-fork server are cached (without CACHE_DEFAULT_TIMEOUT)
+ASGI_WORKERS = int(os.getenv('ASGI_WORKERS', 8)) # threads of the ASGI app running the routes not served on the event loop
+DEFERRED_WORKERS = int(os.getenv('DEFERRED_WORKERS', 2)) # worker threads computing requests with Prefer: respond-async
+DEFERRED_JOB_TTL = int(os.getenv('DEFERRED_JOB_TTL', 3600)) # seconds deferred jobs are kept in the cache
+GEOMETRY_ELEMENT_BUDGET = float(os.getenv('GEOMETRY_ELEMENT_BUDGET', 10)) # seconds tessellating an element, slower elements are substituted by their bounding box (0 = unlimited)
+GEOMETRY_REQUEST_BUDGET = float(os.getenv('GEOMETRY_REQUEST_BUDGET', 30)) # seconds tessellating the elements of a request, the rest is substituted by bounding boxes (0 = unlimited)
+ADMISSION_CHEAP_LIMIT = int(os.getenv('ADMISSION_CHEAP_LIMIT', 64)) # concurrent requests of catalogue, tree, georef and pset routes
+ADMISSION_CHEAP_QUEUE = int(os.getenv('ADMISSION_CHEAP_QUEUE', 256)) # cheap requests waiting, further requests are rejected
+ADMISSION_STANDARD_LIMIT = int(os.getenv('ADMISSION_STANDARD_LIMIT', 16)) # concurrent requests of the other routes
+ADMISSION_STANDARD_QUEUE = int(os.getenv('ADMISSION_STANDARD_QUEUE', 64)) # standard requests waiting, further requests are rejected
+ADMISSION_EXPENSIVE_LIMIT = int(os.getenv('ADMISSION_EXPENSIVE_LIMIT', 2)) # concurrent composed geometry, ifcJSON/IFC export and filtered GIM requests
+ADMISSION_EXPENSIVE_QUEUE = int(os.getenv('ADMISSION_EXPENSIVE_QUEUE', 8)) # expensive requests waiting, further requests are rejected
+ADMISSION_QUEUE_TIMEOUT = int(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10)) # seconds a request waits in the queue before it is rejected
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 5)) # Retry-After of rejected requests in seconds
@@ -23,16 +23,39 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import OrderedDict
+
 import ifcopenshell
 import ifcopenshell.guid as guid
 
 
+class ObjectCache(OrderedDict):
+    """Serialized sub-objects by entity id, beyond maxSize entries the least recently used are dropped"""
+
+    def __init__(self, maxSize=None):
+        super().__init__()
+        self.maxSize = maxSize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if self.maxSize is not None and len(self) > self.maxSize:
+            self.popitem(last=False)
+
+
 class IFC2JSON:
     """Base class for all IFC SPF to ifcJSON writers
     """
 
     VERSION = '0.0.1'
 
+    # Entity types that are skipped while serializing (the models itself is not modified)
+    excludeTypes = ()
+
     DIMENSIONALEXPONENTS = {
         'METRE': (1, 0, 0, 0, 0, 0, 0),
         'SQUARE_METRE': (2, 0, 0, 0, 0, 0, 0),
@@ -72,6 +95,32 @@ class IFC2JSON:
 
         return string[0].lower() + string[1:]
 
+    def getAttributeKey(self, entityType, attr):
+        """Returns the ifcJSON-4 key of an attribute, the conversions are cached per entity type"""
+
+        keys = self.attributeKeys.get(entityType)
+        if keys is None:
+            keys = self.attributeKeys[entityType] = {}
+        attrKey = keys.get(attr)
+        if attrKey is None:
+            attrKey = self.toLowerCamelcase(attr)
+
+            # Replace wrappedvalue key names to value
+            if attrKey == 'wrappedValue':
+                attrKey = 'value'
+            keys[attr] = attrKey
+        return attrKey
+
+    def isExcluded(self, entity):
+        """Returns True if the entity is of one of the excluded types (including subtypes)"""
+
+        if not self.excludeTypes:
+            return False
+        entityType = entity.is_a()
+        if entityType not in self.excludedCache:
+            self.excludedCache[entityType] = any(entity.is_a(excludeType) for excludeType in self.excludeTypes)
+        return self.excludedCache[entityType]
+
     def getDimensionsForSiUnit(self, entity):
         dimensions = {
             'type': 'IfcDimensionalExponents'
@@ -110,36 +159,58 @@ class IFC2JSON:
             jsonValue = None
         elif isinstance(value, ifcopenshell.entity_instance):
             entity = value
-            entityAttributes = entity.__dict__
-
-            # Remove empty properties
-            if entity.is_a('IfcProperty'):
-                if not self.EMPTY_PROPERTIES:
-                    if self.empty_property(entity):
-                        return None
-
-            # Add unit dimensions https://standards.buildingsmart.org/IFC/DEV/IFC4_2/FINAL/HTML/schema/ifcmeasureresource/lexical/ifcdimensionsforsiunit.htm
-            if entity.is_a('IfcSIUnit'):
-                entityAttributes['dimensions'] = self.getDimensionsForSiUnit(
-                    entity)
-
-            # All objects with a GlobalId must be referenced, all others nested
-            if entity.id() in self.rootObjects:
-                entityAttributes["GlobalId"] = self.rootObjects[entity.id()]
-                return self.createReferenceObject(entityAttributes, self.COMPACT)
-            else:
-                if 'GlobalId' in entityAttributes:
-                    entityAttributes["GlobalId"] = guid.split(
-                        guid.expand(entity.GlobalId))[1:-1]
-
-            return self.createFullObject(entityAttributes)
+
+            # Shared entities (points, units, property values, ...) are serialized once and reused while they are in
+            # the cache, entities referenced once are not kept. The cache grows with the shared entities of the
+            # model up to the size of an ObjectCache, dropped entities are serialized again when referenced.
+            entityId = entity.id()
+            if entityId in self.objectCache:
+                return self.objectCache[entityId]
+            jsonValue = self.getEntityValue(entity)
+            if entityId and entity.file.get_total_inverses(entity) > 1:
+                self.objectCache[entityId] = jsonValue
         elif isinstance(value, tuple):
             jsonValue = tuple(x for x in map(
                 self.getAttributeValue, value) if x is not None)
+            # Aggregates of only excluded entities are omitted, like aggregates emptied by removing entities
+            if not jsonValue and value and all(
+                    isinstance(x, ifcopenshell.entity_instance) and self.isExcluded(x) for x in value):
+                jsonValue = None
         else:
             jsonValue = value
         return jsonValue
 
+    def getEntityValue(self, entity):
+        """Returns the ifcJSON-4 models structure of an entity (a reference for root objects)"""
+
+        # Skip excluded entities, references to them are omitted
+        if self.isExcluded(entity):
+            return None
+
+        entityAttributes = entity.__dict__
+
+        # Remove empty properties
+        if entity.is_a('IfcProperty'):
+            if not self.EMPTY_PROPERTIES:
+                if self.empty_property(entity):
+                    return None
+
+        # Add unit dimensions https://standards.buildingsmart.org/IFC/DEV/IFC4_2/FINAL/HTML/schema/ifcmeasureresource/lexical/ifcdimensionsforsiunit.htm
+        if entity.is_a('IfcSIUnit'):
+            entityAttributes['dimensions'] = self.getDimensionsForSiUnit(
+                entity)
+
+        # All objects with a GlobalId must be referenced, all others nested
+        if entity.id() in self.rootObjects:
+            entityAttributes["GlobalId"] = self.rootObjects[entity.id()]
+            return self.createReferenceObject(entityAttributes, self.COMPACT)
+        else:
+            if 'GlobalId' in entityAttributes:
+                entityAttributes["GlobalId"] = guid.split(
+                    guid.expand(entity.GlobalId))[1:-1]
+
+        return self.createFullObject(entityAttributes)
+
     def empty_property(self, entity):
 
         # IfcPropertySingleValue
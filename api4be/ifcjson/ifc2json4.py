@@ -24,8 +24,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
+import multiprocessing
 import os
+import pickle
+import tempfile
+import threading
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 import ifcopenshell
 import ifcopenshell.geom
 import ifcopenshell.guid as guid
@@ -33,6 +39,41 @@ import api4be.ifcjson.common as common
 from datetime import datetime
 from ifcopenshell.entity_instance import entity_instance
 
+# Process pools of the parallel export by number of processes, created by concurrent exports under the lock
+_executors = {}
+_executorsLock = threading.Lock()
+
+# Models opened by a worker process by (path, modification time)
+_workerModels = {}
+
+# Root objects of the running export loaded by a worker process by path of their file
+_workerRootObjects = {}
+
+
+def _getExecutor(processes):
+    with _executorsLock:
+        if processes not in _executors:
+            # spawned workers do not inherit the state (threads, locks) of the serving process
+            _executors[processes] = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        return _executors[processes]
+
+
+def _serializeObjects(ifcPath, options, rootObjectsPath, keys):
+    """Worker of the parallel export, returns the ifcJSON-4 objects of the given root objects as json text"""
+
+    modelKey = (ifcPath, os.path.getmtime(ifcPath))
+    if modelKey not in _workerModels:
+        _workerModels.clear()
+        _workerModels[modelKey] = ifcopenshell.open(ifcPath)
+    # the root objects are loaded once per export, not with every chunk
+    if rootObjectsPath not in _workerRootObjects:
+        _workerRootObjects.clear()
+        with open(rootObjectsPath, 'rb') as file:
+            _workerRootObjects[rootObjectsPath] = pickle.load(file)
+    serializer = IFC2JSON4(_workerModels[modelKey], **options)
+    serializer.rootObjects = _workerRootObjects[rootObjectsPath]
+    return ', '.join(json.dumps(jsonObject) for jsonObject in serializer.iterJsonObjects(keys))
+
 
 class IFC2JSON4(common.IFC2JSON):
     SCHEMA_VERSION = '0.0.1'
@@ -40,25 +81,36 @@ class IFC2JSON4(common.IFC2JSON):
     settings = ifcopenshell.geom.settings()
     settings.set(settings.USE_WORLD_COORDS, False)
 
+    GEOMETRY_TYPES = ['IfcLocalPlacement', 'IfcRepresentationMap', 'IfcGeometricRepresentationContext', 'IfcGeometricRepresentationSubContext', 'IfcProductDefinitionShape',
+                      'IfcMaterialDefinitionRepresentation', 'IfcShapeRepresentation', 'IfcRepresentationItem', 'IfcStyledRepresentation', 'IfcPresentationLayerAssignment', 'IfcTopologyRepresentation']
+
     def __init__(self,
                  ifcModel,
                  COMPACT=False,
                  NO_INVERSE=False,
                  EMPTY_PROPERTIES=False,
                  NO_OWNERHISTORY=False,
-                 GEOMETRY=True):
+                 GEOMETRY=True,
+                 OBJECT_CACHE_SIZE=None):
         """IFC SPF to ifcJSON-4 writer
 
         parameters:
         ifcModel: IFC filePath or ifcopenshell models instance
         COMPACT (boolean): if True then pretty print is turned off and references are created without informative "type" property
         NO_INVERSE (boolean): if True then inverse relationships will be explicitly added to entities
+        NO_OWNERHISTORY (boolean): if True then IfcOwnerHistory entities and references to them are skipped
+        GEOMETRY (boolean or 'tessellate'): if False then geometry entities and references to them are skipped,
+            'tessellate' adds tessellated representations to the models (modifies the models)
+        OBJECT_CACHE_SIZE (int): maximum number of serialized shared sub-objects kept during an export, None is unbounded
 
         """
 
         self.COMPACT = COMPACT
         self.NO_INVERSE = NO_INVERSE
         self.EMPTY_PROPERTIES = EMPTY_PROPERTIES
+        self.NO_OWNERHISTORY = NO_OWNERHISTORY
+        self.GEOMETRY = GEOMETRY
+        self.OBJECT_CACHE_SIZE = OBJECT_CACHE_SIZE
 
         if isinstance(ifcModel, ifcopenshell.file):
             self.ifcModel = ifcModel
@@ -68,6 +120,10 @@ class IFC2JSON4(common.IFC2JSON):
         # Dictionary referencing all objects with a GlobalId that are already created
         self.rootObjects = {}
 
+        # Serialized sub-objects by entity id and attribute keys by entity type, kept for the duration of an export
+        self.objectCache = common.ObjectCache(self.OBJECT_CACHE_SIZE)
+        self.attributeKeys = {}
+
         # input(dir(self.ifcModel.wrapped_data.header))
         # input(self.ifcModel.wrapped_data.header)
         # print(dir(self.ifcModel.wrapped_data.header.file_description))
@@ -75,14 +131,19 @@ class IFC2JSON4(common.IFC2JSON):
         #     print(self.ifcModel.wrapped_data.header.file_description[0])
         # input()
         
+        # Excluded entity types are skipped during serialization instead of being removed from the models,
+        # so the models can be shared
+        self.excludeTypes = []
+        self.excludedCache = {}
+
         if NO_OWNERHISTORY:
-            self.remove_ownerhistory()
+            self.excludeTypes.append('IfcOwnerHistory')
 
         # adjust GEOMETRY type
         if GEOMETRY == 'tessellate':
             self.tessellate()
         elif GEOMETRY == False:
-            self.remove_geometry()
+            self.excludeTypes.extend(self.GEOMETRY_TYPES)
 
     def spf2Json(self):
         """
@@ -95,7 +156,181 @@ class IFC2JSON4(common.IFC2JSON):
 
         """
 
-        jsonObjects = []
+        self.collectRootObjects()
+        jsonObjects = list(self.iterJsonObjects())
+        self.objectCache = common.ObjectCache(self.OBJECT_CACHE_SIZE)
+
+        ifcJson = self.createHeader()
+        ifcJson['data'] = jsonObjects
+        return ifcJson
+
+    def spf2JsonStream(self, chunkSize=65536, processes=0, ifcPath=None):
+        """
+        Generator of the same ifcJSON-4 document as spf2Json, the header first and then
+        the objects one by one as they are serialized
+
+        Parameters:
+        chunkSize (int): minimum size of the yielded text chunks
+        processes (int): if > 1 the root objects are serialized in parallel by a pool of processes
+        ifcPath (str): IFC file of the models opened by the worker processes (required for parallel export)
+
+        Returns:
+        generator: str chunks of the ifcJSON-4 document
+
+        """
+
+        self.collectRootObjects()
+
+        if processes > 1 and ifcPath is not None and self.GEOMETRY != 'tessellate':
+            jsonTexts = self.iterJsonTextsParallel(processes, ifcPath)
+        else:
+            jsonTexts = (json.dumps(jsonObject) for jsonObject in self.iterJsonObjects())
+
+        header = json.dumps(self.createHeader())
+        chunk = [header[:-1] + ', "data": [']
+        size = len(chunk[0])
+        separator = ''
+        for jsonText in jsonTexts:
+            if not jsonText:
+                continue
+            text = separator + jsonText
+            separator = ', '
+            chunk.append(text)
+            size += len(text)
+            if size >= chunkSize:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        self.objectCache = common.ObjectCache(self.OBJECT_CACHE_SIZE)
+        chunk.append(']}')
+        yield ''.join(chunk)
+
+    def spf2JsonSubgraph(self, entity, depth=1):
+        """
+        Create the ifcJSON-4 document of the subgraph of an entity: all objects with a GlobalId that are
+        reachable by at most depth forward or inverse references. Entities without a GlobalId are nested
+        as usual, objects at the border of the subgraph are only referenced.
+
+        Parameters:
+        entity (entity_instance): start entity of the subgraph
+        depth (int): maximum number of references between the entity and an object of the subgraph
+
+        Returns:
+        dict: ifcJSON-4 models structure
+
+        """
+
+        keys = self.collectSubgraphRootObjects(entity, depth)
+        jsonObjects = list(self.iterJsonObjects(keys))
+        self.objectCache = common.ObjectCache(self.OBJECT_CACHE_SIZE)
+
+        ifcJson = self.createHeader()
+        ifcJson['data'] = jsonObjects
+        return ifcJson
+
+    def collectSubgraphRootObjects(self, entity, depth):
+        """
+        Collects the objects reachable from the entity (breadth-first) as root objects, the objects one reference
+        beyond the depth are collected too so they are referenced instead of nested
+
+        Returns:
+        list: step ids of the objects of the subgraph in breadth-first order
+
+        """
+
+        keys = [entity.id()]
+        self.rootObjects[entity.id()] = guid.split(guid.expand(entity.GlobalId))[1:-1]
+        level = [entity]
+        for currentDepth in range(depth + 1):
+            nextLevel = []
+            for current in level:
+                for referenced in self.iterReferencedRootObjects(current):
+                    if referenced.id() not in self.rootObjects:
+                        self.rootObjects[referenced.id()] = guid.split(guid.expand(referenced.GlobalId))[1:-1]
+                        nextLevel.append(referenced)
+            if currentDepth < depth:
+                keys.extend(referenced.id() for referenced in nextLevel)
+            level = nextLevel
+        return keys
+
+    def iterReferencedRootObjects(self, entity):
+        """
+        Generator of the entities with a GlobalId referenced by the entity, directly or through nested entities,
+        and of the relationships referencing the entity (inverse attributes)
+        """
+
+        visited = {entity.id()}
+        stack = list(entity)
+        while stack:
+            value = stack.pop()
+            if isinstance(value, tuple):
+                stack.extend(value)
+            elif isinstance(value, entity_instance) and value.id() not in visited and not self.isExcluded(value):
+                visited.add(value.id())
+                if hasattr(value, 'GlobalId'):
+                    yield value
+                else:
+                    stack.extend(value)
+
+        # inverse references are followed even if they are not written (NO_INVERSE), the relationships
+        # reference the entity themselves
+        for attr in entity.wrapped_data.get_inverse_attribute_names():
+            for relationship in getattr(entity, attr) or ():
+                if relationship.id() not in visited and not self.isExcluded(relationship):
+                    visited.add(relationship.id())
+                    yield relationship
+
+    def iterJsonTextsParallel(self, processes, ifcPath):
+        """
+        Generator of the json texts of the root objects serialized by a pool of processes. The root objects
+        are partitioned into contiguous chunks, the texts are yielded in the order of the root objects.
+        The workers read the root objects once from a temporary file, the chunks only pass their keys.
+        """
+
+        options = {
+            'COMPACT': self.COMPACT,
+            'NO_INVERSE': self.NO_INVERSE,
+            'EMPTY_PROPERTIES': self.EMPTY_PROPERTIES,
+            'NO_OWNERHISTORY': self.NO_OWNERHISTORY,
+            'GEOMETRY': self.GEOMETRY,
+            'OBJECT_CACHE_SIZE': self.OBJECT_CACHE_SIZE
+        }
+        keys = list(self.rootObjects)
+        # more chunks than processes to balance chunks of different cost
+        chunkCount = processes * 4
+        chunkLength = max(1, -(-len(keys) // chunkCount))
+        chunks = [keys[i:i + chunkLength] for i in range(0, len(keys), chunkLength)]
+
+        # the root objects (with generated ids) are shared with the workers in a file unique to the export
+        with tempfile.NamedTemporaryFile(prefix='ifcjson-' + uuid.uuid4().hex, suffix='.pickle', delete=False) as file:
+            pickle.dump(self.rootObjects, file, pickle.HIGHEST_PROTOCOL)
+        executor = _getExecutor(processes)
+        futures = []
+        try:
+            futures = [executor.submit(_serializeObjects, ifcPath, options, file.name, chunk) for chunk in chunks]
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            os.remove(file.name)
+
+    def createHeader(self):
+        """Returns the ifcJSON-4 header (all attributes except data)"""
+
+        return {
+            'type': 'ifcJSON',
+            'version': self.SCHEMA_VERSION,
+            # 'schemaIdentifiers': self.ifcModel.wrapped_data.header.file_schema.schema_identifiers,
+            'schemaIdentifier': self.ifcModel.wrapped_data.schema,
+            'originatingSystem': 'IFC2JSON_python Version ' + self.VERSION,
+            'preprocessorVersion': 'IfcOpenShell ' + ifcopenshell.version,
+            'timeStamp': datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        }
+
+    def collectRootObjects(self):
+        """Collects all objects that are serialized as root objects (referenced by GlobalId)"""
+
         relationships = []
 
         # Collect all entity types that already have a GlobalId
@@ -109,19 +344,20 @@ class IFC2JSON4(common.IFC2JSON):
         # seperately collect all entity types where a GlobalId needs to be added
         # for entity in self.ifcModel.by_type('IfcMaterialDefinition'):
         #     self.rootObjects[entity.id()] = str(uuid.uuid4())
-        for entity in self.ifcModel.by_type('IfcShapeRepresentation'):
-            self.rootObjects[entity.id()] = str(uuid.uuid4())
-        for entity in self.ifcModel.by_type('IfcOwnerHistory'):
-            self.rootObjects[entity.id()] = str(uuid.uuid4())
-        for entity in self.ifcModel.by_type('IfcGeometricRepresentationContext'):
-            self.rootObjects[entity.id()] = str(uuid.uuid4())
+        for entityType in ['IfcShapeRepresentation', 'IfcOwnerHistory', 'IfcGeometricRepresentationContext']:
+            for entity in self.ifcModel.by_type(entityType):
+                if not self.isExcluded(entity):
+                    self.rootObjects[entity.id()] = str(uuid.uuid4())
 
         # Seperately add all IfcRelationship entities so they appear at the end of the list
         for entity in relationships:
             self.rootObjects[entity.id()] = guid.split(
                 guid.expand(entity.GlobalId))[1:-1]
 
-        for key in self.rootObjects:
+    def iterJsonObjects(self, keys=None):
+        """Generator of the full ifcJSON-4 objects of the root objects (of all or the given keys)"""
+
+        for key in (self.rootObjects if keys is None else keys):
             entity = self.ifcModel.by_id(key)
             entityAttributes = entity.__dict__
             entityType = entityAttributes['type']
@@ -136,18 +372,7 @@ class IFC2JSON4(common.IFC2JSON):
                             entityAttributes[attr] = attrValue
 
             entityAttributes["GlobalId"] = self.rootObjects[entity.id()]
-            jsonObjects.append(self.createFullObject(entityAttributes))
-
-        return {
-            'type': 'ifcJSON',
-            'version': self.SCHEMA_VERSION,
-            # 'schemaIdentifiers': self.ifcModel.wrapped_data.header.file_schema.schema_identifiers,
-            'schemaIdentifier': self.ifcModel.wrapped_data.schema,
-            'originatingSystem': 'IFC2JSON_python Version ' + self.VERSION,
-            'preprocessorVersion': 'IfcOpenShell ' + ifcopenshell.version,
-            'timeStamp': datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-            'data': jsonObjects
-        }
+            yield self.createFullObject(entityAttributes)
 
     def createFullObject(self, entityAttributes):
         """Returns complete ifcJSON-4 object
@@ -160,6 +385,7 @@ class IFC2JSON4(common.IFC2JSON):
 
         """
         fullObject = {}
+        entityType = entityAttributes['type']
 
         for attr in entityAttributes:
 
@@ -167,11 +393,7 @@ class IFC2JSON4(common.IFC2JSON):
             if attr == 'id':
                 continue
 
-            attrKey = self.toLowerCamelcase(attr)
-
-            # Replace wrappedvalue key names to value
-            if attrKey == 'wrappedValue':
-                attrKey = 'value'
+            attrKey = self.getAttributeKey(entityType, attr)
 
             jsonValue = self.getAttributeValue(entityAttributes[attr])
             if jsonValue is not None:
@@ -229,16 +451,3 @@ class IFC2JSON4(common.IFC2JSON):
                 except Exception as e:
                     print(str(e) + ': Unable to generate OBJ data for ' +
                           str(product))
-
-    def remove_ownerhistory(self):
-        for entity in self.ifcModel.by_type('IfcOwnerHistory'):
-            self.ifcModel.remove(entity)
-
-    def remove_geometry(self):
-        removeTypes = ['IfcLocalPlacement', 'IfcRepresentationMap', 'IfcGeometricRepresentationContext', 'IfcGeometricRepresentationSubContext', 'IfcProductDefinitionShape',
-                       'IfcMaterialDefinitionRepresentation', 'IfcShapeRepresentation', 'IfcRepresentationItem', 'IfcStyledRepresentation', 'IfcPresentationLayerAssignment', 'IfcTopologyRepresentation']
-        for ifcType in removeTypes:
-            # print(ifcType)
-            # (lambda x: self.ifcModel.remove(x), self.ifcModel.by_type(ifcType))
-            for entity in self.ifcModel.by_type(ifcType):
-                self.ifcModel.remove(entity)
@@ -101,6 +101,8 @@ class IFC2JSON5a(common.IFC2JSON):
 
         # Dictionary referencing all objects with a GlobalId that are already created
         self.rootObjects = {}
+        self.objectCache = {}
+        self.attributeKeys = {}
 
         # Representations are kept seperate to be added to the end of the list
         self.representations = {}
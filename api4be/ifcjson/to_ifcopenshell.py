@@ -1,5 +1,4 @@
 import json
-import pandas as pd
 import uuid
 
 import ifcopenshell
@@ -17,7 +16,13 @@ EXCLUDE_ATTRIBUTES = ['id', 'type', 'dimensions']
 
 class JSON2IFC(IFCJSON):
 
-    def __init__(self, inFilePath):
+    def __init__(self, ifcJson):
+        """ifcJSON to IFC converter
+
+        parameters:
+        ifcJson: ifcJSON file path, readable (binary or text) stream or already parsed ifcJSON data
+
+        """
 
         self.fileSchema = None
         self.schemaIdentifier = None
@@ -28,30 +33,34 @@ class JSON2IFC(IFCJSON):
         self.timeStamp = None
         self.application = None
 
-        with open(inFilePath) as ifcJsonFile:
-            ifcJson = json.load(ifcJsonFile)
-
-            # When ifcJson data is a complete filestructure including header
-            if type(ifcJson) is dict:
-                self.parseHeader(ifcJson)
-                if 'type' in ifcJson:
-                    if ifcJson['type'] == 'ifcJSON':
-                        
-                        self.timestamp = None
-                        
-                        if 'data' in ifcJson:
-                            self.collect_objects(ifcJson['data'])
-                        else:
-                            print('Not a valid ifcJson file')
+        if isinstance(ifcJson, str):
+            with open(ifcJson) as ifcJsonFile:
+                ifcJson = json.load(ifcJsonFile)
+        elif hasattr(ifcJson, 'read'):
+            # parsed straight from the stream, without an intermediate copy on disk
+            ifcJson = json.load(ifcJson)
+
+        # When ifcJson data is a complete filestructure including header
+        if type(ifcJson) is dict:
+            self.parseHeader(ifcJson)
+            if 'type' in ifcJson:
+                if ifcJson['type'] == 'ifcJSON':
+
+                    self.timestamp = None
+
+                    if 'data' in ifcJson:
+                        self.collect_objects(ifcJson['data'])
                     else:
                         print('Not a valid ifcJson file')
-
                 else:
                     print('Not a valid ifcJson file')
 
-            # When ifcJson data is just a list of objects
-            elif type(ifcJson) is dict:
-                self.collect_objects(ifcJson['data'])
+            else:
+                print('Not a valid ifcJson file')
+
+        # When ifcJson data is just a list of objects
+        elif type(ifcJson) is list:
+            self.collect_objects(ifcJson)
 
     def toLowerCamelcase(self, string):
         """Convert string from upper to lower camelCase"""
@@ -73,11 +82,14 @@ class JSON2IFC(IFCJSON):
             return uuid
 
     def readData(self, data):
-        self.data = pd.DataFrame()
-        self.data["data"] = data
-        self.data['type'] = self.data['data'].apply(pd.Series)['type']
-        self.data['uuid'] = self.data['data'].apply(pd.Series)['globalId']
-        return(self.data)
+        """Returns the objects of the data together with an index of their globalIds (first object wins)"""
+
+        self.data = data
+        self.uuids = {}
+        for position, jsonObject in enumerate(data):
+            if 'globalId' in jsonObject and jsonObject['globalId'] not in self.uuids:
+                self.uuids[jsonObject['globalId']] = position
+        return self.data
 
     def createNestedEntity(self, attributes):
         entityType = attributes['type']
@@ -85,22 +97,23 @@ class JSON2IFC(IFCJSON):
         self.fillEntity(attributes, entity)
         return entity
 
-    def fillEntityFromDf(self, row):
-        data = row.data
-        entity = self.model.by_id(row.id)
-        self.fillEntity(data, entity)
-
-    def createEntity(self, row):
-        entityType = row.type
+    def createEntity(self, jsonObject):
+        entityType = jsonObject['type']
         entity = self.model.create_entity(entityType)
-        return entity.id()
+        return entity
+
+    def getAttributeNames(self, entity):
+        """Returns the attribute names of the entity type, cached per type"""
+
+        entityType = entity.is_a()
+        if entityType not in self.attributeNames:
+            self.attributeNames[entityType] = {'id', 'type'}.union(entity.wrapped_data.get_attribute_names())
+        return self.attributeNames[entityType]
 
     def getAttributeObject(self, attributeValue):
         if type(attributeValue) is dict:
             if 'ref' in attributeValue:
-                row = self.data.loc[self.data['uuid'] ==
-                                    attributeValue['ref']]['id'].values
-                return self.model.by_id(int(row[0]))
+                return self.entities[self.uuids[attributeValue['ref']]]
             else:
                 return self.createNestedEntity(attributeValue)
         elif type(attributeValue) is list:
@@ -113,7 +126,7 @@ class JSON2IFC(IFCJSON):
             return attributeValue
 
     def fillEntity(self, data, entity):
-        attributes = entity.get_info().keys()
+        attributes = self.getAttributeNames(entity)
         for attribute in data:
             attributeName = self.toUpperCamelcase(attribute)
             if attributeName not in attributes and attribute not in INCLUDE_ATTRIBUTES:
@@ -138,13 +151,17 @@ class JSON2IFC(IFCJSON):
 
     def collect_objects(self, data):
         self.data = self.readData(data)
-        project = self.data[self.data.type == 'IfcProject'].iloc[0].data
+        project = next(jsonObject for jsonObject in self.data if jsonObject['type'] == 'IfcProject')
         self.project_globalid = ifcopenshell.guid.compress(
             uuid.UUID(project['globalId']).hex)
         self.project_name = project['name']
         self.model = ifcopenshell.file(None, self.schemaIdentifier)
-        self.data['id'] = self.data.apply(self.createEntity, axis=1)
-        self.data.apply(self.fillEntityFromDf, axis=1)
+        self.attributeNames = {}
+
+        # First pass creates all objects so references can be resolved by position, second pass fills them
+        self.entities = [self.createEntity(jsonObject) for jsonObject in self.data]
+        for jsonObject, entity in zip(self.data, self.entities):
+            self.fillEntity(jsonObject, entity)
 
     def ifcModel(self):
         return self.model
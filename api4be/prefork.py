@@ -0,0 +1,65 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import gc
+import logging
+import os
+import threading
+
+from api4be.components.repositories.ifc_file_repository import IfcFileRepository
+from api4be.components.service.deferred_service import DeferredService
+from api4be.components.service.ingest_service import IngestService
+from api4be.components.utils import geometry_pool, geom_utils
+from api4be.ifcjson import ifc2json4
+
+logger = logging.getLogger()
+
+_registered = False
+
+
+def prepare_fork():
+    """
+    Prepares the master process of a pre-fork server after the models and indexes are loaded. The loaded
+    objects are moved to the permanent generation of the garbage collector, so the collector of a worker
+    does not write to (and copy) the memory pages shared with the master.
+    """
+    global _registered
+    # no background writes may run while forking
+    IfcFileRepository().flush_models()
+    gc.collect()
+    gc.freeze()
+    if not _registered:
+        os.register_at_fork(after_in_child=_after_fork_in_worker)
+        _registered = True
+    logger.info('prepared ' + str(gc.get_freeze_count()) + ' objects to be shared with forked workers')
+
+
+def _after_fork_in_worker():
+    # pools and timers of the master are not running in a forked process, they are started on demand
+    geometry_pool._executor = None
+    geometry_pool._job_slots = None
+    geometry_pool._background = None
+    ifc2json4._executors.clear()
+    IfcFileRepository.compaction_timers.clear()
+    IngestService.executor = None
+    DeferredService.executor = None
+    # unfinished ingestions of the master never finish in a worker
+    IngestService.jobs.clear()
+    # locks may have been held by threads of the master while forking
+    geometry_pool._executor_lock = threading.Lock()
+    geom_utils._over_budget_lock = threading.Lock()
+    ifc2json4._executorsLock = threading.Lock()
+    IngestService.lock = threading.Lock()
+    DeferredService.lock = threading.Lock()
@@ -0,0 +1,5 @@
+from api4be.asgi import create_asgi_app
+
+# app of an ASGI server, e.g.
+# uvicorn --workers 1 asgi:app
+app = create_asgi_app()
@@ -0,0 +1,86 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import asyncio
+import threading
+
+from api4be import config, create_app
+from api4be.components.admission import admission
+
+app = create_app()
+
+
+def test_admission_rejects_expensive_requests(monkeypatch):
+    monkeypatch.setattr(config, 'ADMISSION_QUEUE_TIMEOUT', 0.2)
+    expensive = admission.classes['expensive']
+    monkeypatch.setattr(expensive, 'queue_size', 0)
+    for _ in range(expensive.limit):
+        assert expensive.acquire(0)
+    try:
+        with app.test_client() as c:
+            response = c.get('/bimapi/bim/collections/pim/projects/duplex?format=ifcjson')
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == str(config.ADMISSION_RETRY_AFTER)
+
+            # cheap and standard requests are admitted meanwhile
+            assert c.get('/bimapi/bim/collections').status_code == 200
+            assert c.get('/bimapi/bim/collections/pim/projects/duplex/tree').status_code == 200
+            assert c.get('/bimapi/bim/collections/pim/projects/duplex').status_code == 200
+
+            metrics = c.get('/bimapi/admission').get_json()
+            assert metrics['expensive']['running'] == expensive.limit
+            assert metrics['expensive']['rejected'] >= 1
+            assert metrics['cheap']['running'] == 1
+            assert metrics['standard']['running'] == 0
+    finally:
+        for _ in range(expensive.limit):
+            expensive.release()
+
+
+def test_admission_queue(monkeypatch):
+    standard = admission.classes['standard']
+    monkeypatch.setattr(standard, 'limit', 1)
+    assert standard.acquire(0)
+    queued = []
+    thread = threading.Thread(target=lambda: queued.append(standard.acquire(5)))
+    thread.start()
+    while standard.get_metrics()['queued'] == 0:
+        thread.join(0.01)
+    standard.release()
+    thread.join()
+    assert queued == [True]
+    standard.release()
+    assert standard.get_metrics()['running'] == 0
+
+
+def test_admission_queue_async(monkeypatch):
+    standard = admission.classes['standard']
+    monkeypatch.setattr(standard, 'limit', 1)
+    assert standard.acquire(0)
+
+    async def acquire():
+        timed_out = await standard.acquire_async(0.05)
+        queued = asyncio.ensure_future(standard.acquire_async(5))
+        while standard.get_metrics()['queued'] == 0:
+            await asyncio.sleep(0.01)
+        # the slot is handed over to the queued request
+        threading.Thread(target=standard.release).start()
+        return timed_out, await queued
+
+    assert asyncio.run(acquire()) == (False, True)
+    metrics = standard.get_metrics()
+    assert metrics['running'] == 1 and metrics['queued'] == 0
+    standard.release()
+    assert standard.get_metrics()['running'] == 0
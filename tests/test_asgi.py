@@ -0,0 +1,121 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import asyncio
+import json
+import threading
+
+from api4be import create_app
+from api4be.asgi import AsgiApp
+from api4be.components.admission import admission
+
+app = create_app()
+asgi_app = AsgiApp(app, workers=2)
+
+
+async def _request(path, query=b'', method='GET', body=b'', headers=()):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': list(headers),
+             'http_version': '1.1', 'scheme': 'http', 'server': ('localhost', 80)}
+    messages = []
+    # a list of bodies is received as one http.request message each
+    bodies = list(body) if isinstance(body, list) else [body]
+
+    async def receive():
+        if not bodies:
+            return {'type': 'http.disconnect'}
+        return {'type': 'http.request', 'body': bodies.pop(0), 'more_body': len(bodies) > 0}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(scope, receive, send)
+    assert messages[0]['type'] == 'http.response.start'
+    assert messages[-1]['more_body'] is False
+    return messages[0]['status'], b''.join(m['body'] for m in messages[1:])
+
+
+def test_asgi_responses():
+    routes = [
+        ('/bimapi/bim/collections', b''),
+        ('/bimapi/bim/collections/pim/projects/duplex', b''),
+        ('/bimapi/bim/collections/pim/projects/duplex', b'format=ifc_file'),
+        ('/bimapi/bim/collections/pim/projects/duplex', b'format=ifcjson'),
+        ('/bimapi/bim/collections/pim/projects/duplex/ifcitems/7606d7eb-508f-40ce-a522-9b526ddc7201', b''),
+        ('/bimapi/bim/collections/pim/projects/unknown', b''),
+    ]
+    with app.test_client() as c:
+        for path, query in routes:
+            expected = c.get(path + '?' + query.decode())
+            status, body = asyncio.run(_request(path, query))
+            assert status == expected.status_code
+            if query == b'format=ifcjson':
+                # the header has the time of the export
+                assert json.loads(body)['data'] == json.loads(expected.data)['data']
+            else:
+                assert body == expected.data
+
+
+def test_asgi_request_body():
+    status, _ = asyncio.run(_request('/bimapi/bim/collections/pim/projects/duplex/psets', method='POST',
+                                     body=b'[]'))
+    assert status == 400
+
+
+def test_asgi_streamed_request_body():
+    # the body is received in parts while the route reads it, with and without Content-Length
+    guids = json.dumps(['7b7032cc-b822-417b-9aea-6429f95d6512', '7606d7eb-508f-40ce-a522-9b526ddc7201']).encode()
+    parts = [guids[:10], guids[10:40], guids[40:]]
+    content_type = (b'content-type', b'application/json')
+    for headers in [[content_type], [content_type, (b'content-length', str(len(guids)).encode())]]:
+        status, body = asyncio.run(_request('/bimapi/bim/collections/pim/projects/duplex/ifcitems', method='POST',
+                                            body=list(parts), headers=headers))
+        assert status == 200
+        assert json.loads(body)['total'] == 2
+
+
+def test_asgi_catalogue_on_event_loop():
+    # catalogue routes are answered while all threads of the pool are busy
+    release = threading.Event()
+    busy = [asgi_app.executor.submit(release.wait) for _ in range(2)]
+    try:
+        status, _ = asyncio.run(asyncio.wait_for(_request('/bimapi/bim/collections'), 5))
+        assert status == 200
+    finally:
+        release.set()
+        for future in busy:
+            future.result()
+
+
+def test_asgi_admission_queue_on_event_loop():
+    # requests queued for admission do not hold the threads of the pool
+    expensive = admission.classes['expensive']
+    for _ in range(expensive.limit):
+        assert expensive.acquire(0)
+
+    async def requests():
+        queued = [asyncio.ensure_future(_request('/bimapi/bim/collections/pim/projects/duplex', b'format=ifc'))
+                  for _ in range(3)]
+        while expensive.get_metrics()['queued'] < 3:
+            await asyncio.sleep(0.01)
+        status, _ = await asyncio.wait_for(_request('/bimapi/bim/collections/pim/projects/duplex/tree'), 5)
+        assert status == 200
+        for _ in range(expensive.limit):
+            expensive.release()
+        return [status for status, _ in await asyncio.gather(*queued)]
+
+    assert asyncio.run(requests()) == [200] * 3
+    metrics = expensive.get_metrics()
+    assert metrics['running'] == 0
+    assert metrics['queued'] == 0
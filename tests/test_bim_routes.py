@@ -13,15 +13,31 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
 
+import hashlib
 import json
+import os
+import threading
+import time
 from urllib.parse import urlencode, unquote, quote
 
-from api4be import create_app
+from api4be import config, create_app
+from api4be.components.repositories.ifc_file_repository import IfcFileRepository
+from api4be.components.serializer import bim_serializer
+from api4be.components.utils.guid_utils import get_guids
 app = create_app()
 
 resource_path = 'tests/resources'
 
 
+def _poll(c, job_url):
+    for _ in range(3000):
+        job = c.get(job_url).get_json()
+        if job['status'] in ['done', 'failed']:
+            return job
+        time.sleep(0.1)
+    raise AssertionError('job ' + job_url + ' did not finish')
+
+
 def test_collections_route():
     with app.test_client() as c:
         response = c.get('/bimapi/bim/collections')
@@ -175,3 +191,368 @@ def test_project_duplex_door_psets_route():
             ground_truth = json.load(file)
             assert json_response == ground_truth
 
+
+def test_project_duplex_door_pset_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/ifcitems/7606d7eb-508f-40ce-a522-9b526ddc7201/psets'
+        with open(resource_path + route + '.json', 'r') as file:
+            ground_truth = json.load(file)
+        pset_name = next(iter(ground_truth))
+        response = c.get(route + '/' + pset_name)
+        assert response.status_code == 200
+        assert response.get_json() == ground_truth[pset_name]
+        assert c.get(route + '/Pset_Unknown').status_code == 404
+
+
+
+def test_project_duplex_tree_depth_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/tree'
+        response = c.get(route + '?depth=1')
+        json_response = response.get_json()
+        with open(resource_path + route + '.json', 'r') as file:
+            ground_truth = json.load(file)
+            ifc_project = ground_truth['data'][0]
+            assert json_response['data'][0]['globalId'] == ifc_project['globalId']
+            assert json_response['data'][0]['data'] == []
+            assert json_response['data'][0]['tree@bim.navigationLink'] == \
+                   'http://localhost' + route + '?root=' + ifc_project['globalId'] + '&depth=1'
+
+
+def test_project_duplex_tree_root_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/tree'
+        with open(resource_path + route + '.json', 'r') as file:
+            ground_truth = json.load(file)
+            ifc_site = ground_truth['data'][0]['data'][0]
+            response = c.get(route + '?root=' + ifc_site['globalId'])
+            assert response.get_json() == ifc_site
+
+            response = c.get(route + '?root=' + ifc_site['globalId'] + '&offset=0&limit=1')
+            json_response = response.get_json()
+            assert json_response['total'] == len(ifc_site['data'])
+            assert json_response['data'] == ifc_site['data'][:1]
+
+
+def test_project_duplex_tree_depth_zero_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/tree'
+        with open(resource_path + route + '.json', 'r') as file:
+            ground_truth = json.load(file)
+            ifc_site = ground_truth['data'][0]['data'][0]
+            json_response = c.get(route + '?root=' + ifc_site['globalId'] + '&depth=0').get_json()
+            assert json_response['data'] == []
+            # the lazy-load link expands the children of the node
+            link = json_response['tree@bim.navigationLink']
+            assert link == 'http://localhost' + route + '?root=' + ifc_site['globalId'] + '&depth=1'
+            expanded = c.get(link).get_json()
+            assert [child['globalId'] for child in expanded['data']] == \
+                   [child['globalId'] for child in ifc_site['data']]
+
+
+            # the link of the root node of the tree has no root parameter
+            json_response = c.get(route + '?depth=0').get_json()
+            link = json_response['tree@bim.navigationLink']
+            assert link == 'http://localhost' + route + '?depth=' + str(config.TREE_LINK_DEPTH)
+            expanded = c.get(link)
+            assert expanded.status_code == 200
+            assert expanded.get_json()['data'][0]['globalId'] == ground_truth['data'][0]['globalId']
+
+
+def test_project_duplex_negative_offset_limit_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex'
+        with open(resource_path + route + '/tree.json', 'r') as file:
+            ifc_site = json.load(file)['data'][0]['data'][0]
+        for query in ['offset=-1&limit=1', 'offset=0&limit=-1']:
+            assert c.get(route + '/tree?root=' + ifc_site['globalId'] + '&' + query).status_code == 400
+        for query in ['offset=-2', 'limit=-1']:
+            response = c.get(route + '/ifcitems?' + query)
+            assert response.status_code == 400
+            assert 'must not be negative' in response.get_json()['error']
+
+
+def test_project_duplex_tree_unknown_root_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/tree'
+        assert c.get(route + '?root=0000000000000000000000').status_code == 404
+        assert c.get(route + '?root=nonexistent').status_code == 404
+
+
+def test_project_duplex_ifcitems_query_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/ifcitems'
+        walls = c.get(route + '?type=IfcWall').get_json()
+        assert walls['total'] == 57
+        assert all(item['type'] in ['IfcWall', 'IfcWallStandardCase'] for item in walls['ifcitems'])
+
+        external_walls = c.get(route + '?type=IfcWall&Pset_WallCommon.IsExternal=true').get_json()
+        assert 0 < external_walls['total'] < walls['total']
+
+        ground_walls = c.get(route + '?type=IfcWall&storey=Level 1').get_json()
+        assert sorted(item['globalId'] for item in ground_walls['ifcitems']) == [
+            '2c391822-07f8-4a22-86a8-a1e57412d365', '2c391822-07f8-4a22-86a8-a1e57412d386',
+            '2c391822-07f8-4a22-86a8-a1e57412d8c1', '2c391822-07f8-4a22-86a8-a1e57412dcef',
+            '2c391822-07f8-4a22-86a8-a1e57412df9e', '64b7f7d3-8cfc-4277-ba33-8de2e6533a28',
+            '64b7f7d3-8cfc-4277-ba33-8de2e6533ae9', '9808fd7f-dc48-478e-9217-628e833d441c',
+            '9808fd7f-dc48-478e-9217-628e833d44b8', '9808fd7f-dc48-478e-9217-628e833d46d1',
+            '9808fd7f-dc48-478e-9217-628e833d46ec', '9808fd7f-dc48-478e-9217-628e833d471d',
+            '9808fd7f-dc48-478e-9217-628e833d5239', '9808fd7f-dc48-478e-9217-628e833d574f',
+            '9808fd7f-dc48-478e-9217-628e833d7938', '9808fd7f-dc48-478e-9217-628e833d795d',
+            '9808fd7f-dc48-478e-9217-628e833d7af9', '9808fd7f-dc48-478e-9217-628e833d7be7',
+            '9808fd7f-dc48-478e-9217-628e833d7d12', '9808fd7f-dc48-478e-9217-628e833d7d42',
+            '9808fd7f-dc48-478e-9217-628e833d7df1']
+
+        assert c.get(route + '?type=IfcWal').status_code == 400
+        assert c.get(route + '?type=IfcLabel').status_code == 400
+
+
+def test_project_duplex_ifcitems_batch_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/ifcitems'
+        guids = ['7b7032cc-b822-417b-9aea-6429f95d6512', '7606d7eb-508f-40ce-a522-9b526ddc7201']
+        response = c.post(route, json={'guids': guids})
+        json_response = response.get_json()
+        assert json_response['total'] == 2
+        for guid, ifc_item in zip(guids, json_response['ifcitems']):
+            assert ifc_item['globalId'] == guid
+            with open(resource_path + route + '/' + guid + '/psets.json', 'r') as file:
+                assert ifc_item['psets'] == json.load(file)
+        assert 'notFound' not in json_response
+
+        response = c.post(route, json=guids + ['unknown'])
+        assert response.get_json()['total'] == 2
+        assert response.get_json()['notFound'] == ['unknown']
+        for body in [{'ids': guids}, 'guid', 42, [42], {'guids': 'guid'}]:
+            assert c.post(route, json=body).status_code == 400
+        assert c.post(route, data='no json', content_type='application/json').status_code == 400
+        assert c.post(route + '?guid=' + guids[0]).get_json()['total'] == 1
+
+
+def test_project_duplex_ifcitems_batch_errors_route(monkeypatch):
+    serialize_psets_entity = bim_serializer._serialize_psets_entity
+    guids = ['7b7032cc-b822-417b-9aea-6429f95d6512', '7606d7eb-508f-40ce-a522-9b526ddc7201']
+    failing = IfcFileRepository().get_ifc_model('pim', 'duplex').by_id(get_guids(guids[1])['ifc_guid'])
+
+    def fail_on_element(entity, property_index=None):
+        if entity == failing:
+            raise RuntimeError('failed')
+        return serialize_psets_entity(entity, property_index)
+
+    monkeypatch.setattr(bim_serializer, '_serialize_psets_entity', fail_on_element)
+    with app.test_client() as c:
+        response = c.post('/bimapi/bim/collections/pim/projects/duplex/ifcitems', json=guids)
+        json_response = response.get_json()
+        assert json_response['total'] == 1
+        assert json_response['ifcitems'][0]['globalId'] == guids[0]
+        assert json_response['errors'] == [guids[1]]
+
+
+def test_project_duplex_door_fields_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/ifcitems/7606d7eb-508f-40ce-a522-9b526ddc7201'
+        response = c.get(route + '?fields=Name,type')
+        json_response = response.get_json()
+        with open(resource_path + route + '.json', 'r') as file:
+            ground_truth = json.load(file)
+            assert json_response == {'Name': ground_truth['Name'], 'type': ground_truth['type']}
+
+
+def test_project_duplex_ifcjson_stream_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex'
+        response = c.get(route + '?format=ifcjson')
+        assert response.status_code == 200
+        assert response.is_streamed
+        json_response = json.loads(response.data)
+        assert json_response['type'] == 'ifcJSON'
+        assert len(json_response['data']) > 0
+
+
+def test_project_duplex_ifcjson_stream_releases_lock_route():
+    # the export is spooled while reading the project, the transfer to the client does not hold the lock
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex'
+        response = c.get(route + '?format=ifcjson', buffered=False)
+        chunks = response.iter_encoded()
+        first = next(chunks)
+        lock = IfcFileRepository().get_project_lock('pim', 'duplex')
+        writer = threading.Thread(target=lambda: (lock.acquire_write(), lock.release_write()))
+        writer.start()
+        writer.join(5)
+        assert not writer.is_alive()
+        json_response = json.loads(first + b''.join(chunks))
+        response.close()
+        assert json_response['type'] == 'ifcJSON'
+
+
+def test_project_duplex_door_ifcjson_subgraph_route():
+    with app.test_client() as c:
+        route = '/bimapi/bim/collections/pim/projects/duplex/ifcitems/7606d7eb-508f-40ce-a522-9b526ddc7201'
+        response = c.get(route + '?format=ifcjson&depth=2')
+        json_response = response.get_json()
+        assert json_response['type'] == 'ifcJSON'
+        assert json_response['data'][0]['type'] == 'IfcDoor'
+        types = set(ifc_object['type'] for ifc_object in json_response['data'])
+        assert {'IfcRelDefinesByType', 'IfcDoorStyle', 'IfcRelDefinesByProperties', 'IfcPropertySet'} <= types
+
+
+def test_project_upload_job_route():
+    collection_name = 'upload'
+    try:
+        with app.test_client() as c:
+            route = '/bimapi/bim/collections/' + collection_name + '/projects/duplex'
+            with open('api4be/data/pim/duplex.ifc', 'rb') as file:
+                response = c.post(route, data=file.read(), content_type='application/octet-stream')
+            assert response.status_code == 202
+            job_url = response.headers['Location']
+            assert response.get_json()['job@bim.navigationLink'] == job_url
+
+            job = _poll(c, job_url)
+            assert job['status'] == 'done'
+            assert all(stage['status'] == 'done' for stage in job['stages'])
+            assert job['project@bim.navigationLink'] == 'http://localhost' + route
+
+            response = c.get(route)
+            assert response.status_code == 200
+            response = c.post(route, data=b'', content_type='application/octet-stream')
+            assert response.status_code == 409
+    finally:
+        IfcFileRepository().delete_collection(collection_name)
+
+
+def test_project_malformed_upload_job_route():
+    collection_name = 'upload'
+    try:
+        with app.test_client() as c:
+            route = '/bimapi/bim/collections/' + collection_name + '/projects/broken'
+            response = c.post(route, data=b'no IFC file', content_type='application/octet-stream')
+            assert response.status_code == 202
+            # a second ingestion of the project is rejected while the first is running
+            assert c.post(route, data=b'no IFC file', content_type='application/octet-stream').status_code == 409
+
+            job_url = response.headers['Location']
+            job = _poll(c, job_url)
+            assert job['status'] == 'failed'
+            # no broken file is left in the collection
+            collection_path = os.path.join(IfcFileRepository().serving_path, collection_name)
+            assert not any(name.startswith('broken') or name.endswith('.part') for name in os.listdir(collection_path))
+            assert not any(name.endswith('.part') for name in os.listdir(os.path.join(
+                IfcFileRepository().serving_path, '.uploads')))
+    finally:
+        IfcFileRepository().delete_collection(collection_name)
+
+
+def test_project_upload_invalid_names_route():
+    serving_path = IfcFileRepository().serving_path
+    with open('api4be/data/pim/duplex.ifc', 'rb') as file:
+        ifc_bytes = file.read()
+    with app.test_client() as c:
+        for collection_name, project_name in [('%2e%2e', 'evil'), ('.uploads', 'evil'), ('upload', '%2e%2e'),
+                                              ('upload', 'evil.ifc'), ('up load', 'evil')]:
+            route = '/bimapi/bim/collections/' + collection_name + '/projects/' + project_name
+            response = c.post(route, data=ifc_bytes, content_type='application/octet-stream')
+            assert response.status_code == 400
+            response = c.post(route + '/uploads', json={'size': len(ifc_bytes),
+                                                        'sha256': hashlib.sha256(ifc_bytes).hexdigest()})
+            assert response.status_code == 400
+    # nothing is written outside of the collections
+    assert not any(name.startswith('evil') for name in os.listdir(os.path.dirname(os.path.abspath(serving_path))))
+    assert not os.path.exists(os.path.join(serving_path, 'upload'))
+
+
+def test_unknown_job_route():
+    with app.test_client() as c:
+        response = c.get('/bimapi/bim/jobs/unknown')
+        assert response.status_code == 404
+
+
+def test_project_chunked_upload_route():
+    collection_name = 'upload'
+    try:
+        with app.test_client() as c:
+            with open('api4be/data/pim/duplex.ifc', 'rb') as file:
+                ifc_bytes = file.read()
+            route = '/bimapi/bim/collections/' + collection_name + '/projects/duplex'
+            response = c.post(route + '/uploads', json={'size': len(ifc_bytes),
+                                                        'sha256': hashlib.sha256(ifc_bytes).hexdigest()})
+            assert response.status_code == 201
+            upload_url = response.headers['Location']
+
+            chunk_size = len(ifc_bytes) // 3 + 1
+            response = c.patch(upload_url, data=ifc_bytes[:chunk_size], headers={'Upload-Offset': '0'})
+            assert response.status_code == 200
+            assert response.get_json()['offset'] == chunk_size
+
+            # a repeated chunk is rejected with the offset to resume from
+            response = c.patch(upload_url, data=ifc_bytes[:chunk_size], headers={'Upload-Offset': '0'})
+            assert response.status_code == 409
+            assert response.headers['Upload-Offset'] == str(chunk_size)
+
+            offset = int(c.get(upload_url).headers['Upload-Offset'])
+            while offset < len(ifc_bytes):
+                response = c.patch(upload_url, data=ifc_bytes[offset:offset + chunk_size],
+                                   headers={'Upload-Offset': str(offset)})
+                offset += chunk_size
+            assert response.status_code == 202
+
+            job_url = response.headers['Location']
+            job = _poll(c, job_url)
+            assert job['status'] == 'done'
+            assert c.get(route).status_code == 200
+            assert c.get(upload_url).status_code == 404
+    finally:
+        IfcFileRepository().delete_collection(collection_name)
+
+
+def test_project_bulk_psets_route():
+    collection_name = 'upload'
+    try:
+        with app.test_client() as c:
+            route = '/bimapi/bim/collections/' + collection_name + '/projects/duplex'
+            with open('api4be/data/pim/duplex.ifc', 'rb') as file:
+                job_url = c.post(route, data=file.read(), content_type='application/octet-stream').headers['Location']
+            assert _poll(c, job_url)['status'] == 'done'
+
+            door_guids = ['7606d7eb-508f-40ce-a522-9b526ddc7201', '1aj$VJZFn2TxepZUBcKp$i']
+            response = c.get(route + '/ifcitems/' + door_guids[0] + '/psets')
+            assert 'Pset_Sensor' not in response.get_json()
+            # the property column is built before the change and updated with the changed elements
+            assert c.get(route + '/ifcitems?Pset_Sensor.Id=S1').get_json()['total'] == 0
+
+            # unknown elements reject the whole request
+            response = c.post(route + '/psets', json={door_guids[0]: {'Pset_Sensor': {'Temperature': 21.5}},
+                                                      'unknown': {'Pset_Sensor': {'Temperature': 21.5}}})
+            assert response.status_code == 404
+            assert response.get_json()['guids'] == ['unknown']
+            response = c.post(route + '/psets', json=['no psets'])
+            assert response.status_code == 400
+            # invalid values reject the whole request before the model is changed
+            entities = len(list(IfcFileRepository().get_ifc_model(collection_name, 'duplex')))
+            for value in [None, [1, 2], {'a': 1}]:
+                response = c.post(route + '/psets', json={door_guids[0]: {'Pset_Sensor': {'Id': 'S1', 'Value': value}}})
+                assert response.status_code == 400
+            assert len(list(IfcFileRepository().get_ifc_model(collection_name, 'duplex'))) == entities
+
+            # requests without psets do not commit the project
+            version = IfcFileRepository().get_project(collection_name, 'duplex')['version']
+            for body in [{}, {door_guids[0]: {}}]:
+                response = c.post(route + '/psets', json=body)
+                assert response.status_code == 200
+                assert response.get_json()['psets'] == 0
+            assert IfcFileRepository().get_project(collection_name, 'duplex')['version'] == version
+
+            sensor_psets = {'Pset_Sensor': {'Temperature': 21.5, 'Occupied': True, 'Count': 3, 'Id': 'S1'}}
+            response = c.post(route + '/psets', json={guid: sensor_psets for guid in door_guids})
+            assert response.status_code == 200
+            # equal property sets are shared by the elements
+            assert response.get_json() == {'elements': 2, 'psets': 1}
+            for guid in door_guids:
+                psets = c.get(route + '/ifcitems/' + guid + '/psets').get_json()
+                assert {key: value for key, value in psets['Pset_Sensor'].items() if key != 'id'} == \
+                       sensor_psets['Pset_Sensor']
+            sensors = c.get(route + '/ifcitems?Pset_Sensor.Id=S1').get_json()
+            assert sorted(item['globalId'] for item in sensors['ifcitems']) == \
+                   sorted(get_guids(guid)['json_guid'] for guid in door_guids)
+    finally:
+        IfcFileRepository().delete_collection(collection_name)
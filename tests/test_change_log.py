@@ -0,0 +1,73 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import shutil
+
+import ifcopenshell
+
+from api4be.components.models.change_log import IfcChangeLog, get_compacted_sequence
+from api4be.components.models.change_tracker import IfcChangeTracker
+from api4be.components.serializer import bim_deserializer
+
+
+def _add_pset(model, changes, name):
+    door = model.by_id('1s1jVhK8z0pgKYcr9jt781')
+    bim_deserializer.add_property_sets(model, door, {name: {'Checked': 'yes'}}, changes=changes)
+
+
+def _get_pset_names(model):
+    door = model.by_id('1s1jVhK8z0pgKYcr9jt781')
+    return [rel.RelatingPropertyDefinition.Name for rel in door.IsDefinedBy]
+
+
+def test_replay_change_log(tmp_path):
+    model = ifcopenshell.open('api4be/data/pim/duplex.ifc')
+    changes = IfcChangeTracker(model)
+    change_log = IfcChangeLog(str(tmp_path / 'duplex.log'))
+    _add_pset(model, changes, 'Pset_First')
+    assert change_log.append(model, changes) == 1
+    changes.reset()
+    _add_pset(model, changes, 'Pset_Second')
+    assert change_log.append(model, changes) == 2
+
+    # a commit interrupted while appending is cut off
+    with open(tmp_path / 'duplex.log', 'a') as log_file:
+        log_file.write('{"created": [')
+
+    replayed = ifcopenshell.open('api4be/data/pim/duplex.ifc')
+    replayed_log = IfcChangeLog(str(tmp_path / 'duplex.log'))
+    assert replayed_log.replay(replayed) == 2
+    assert _get_pset_names(replayed) == _get_pset_names(model)
+    assert replayed.by_type('IfcPropertySet')[-1].id() == model.by_type('IfcPropertySet')[-1].id()
+
+
+def test_compact_change_log(tmp_path):
+    shutil.copy('api4be/data/pim/duplex.ifc', tmp_path / 'duplex.ifc')
+    model = ifcopenshell.open(str(tmp_path / 'duplex.ifc'))
+    changes = IfcChangeTracker(model)
+    change_log = IfcChangeLog(str(tmp_path / 'duplex.log'))
+    _add_pset(model, changes, 'Pset_Compacted')
+    change_log.append(model, changes)
+    log_before_compaction = open(tmp_path / 'duplex.log').read()
+    change_log.compact(model, str(tmp_path / 'duplex.ifc'))
+    assert open(tmp_path / 'duplex.log').read() == ''
+
+    # records of a log not truncated after the compaction (crash) are skipped
+    with open(tmp_path / 'duplex.log', 'w') as log_file:
+        log_file.write(log_before_compaction)
+    compacted = ifcopenshell.open(str(tmp_path / 'duplex.ifc'))
+    assert get_compacted_sequence(compacted) == 1
+    assert IfcChangeLog(str(tmp_path / 'duplex.log')).replay(compacted) == 0
+    assert _get_pset_names(compacted) == _get_pset_names(model)
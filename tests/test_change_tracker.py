@@ -0,0 +1,98 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import os
+import shutil
+
+import ifcopenshell
+import ifcopenshell.guid
+
+from api4be import create_app
+from api4be.components.models.relationship_index import IfcRelationshipIndex
+from api4be.components.repositories.ifc_file_repository import IfcFileRepository
+from api4be.components.serializer import bim_deserializer
+app = create_app()
+
+
+def _insert_duplex(tmp_path):
+    shutil.copy('api4be/data/pim/duplex.ifc', tmp_path / 'duplex.ifc')
+    shutil.copy('api4be/data/pim/duplex.json', tmp_path / 'duplex.json')
+    repository = IfcFileRepository()
+    repository.insert_ifc_model('duplex', ifcopenshell.open(str(tmp_path / 'duplex.ifc')), str(tmp_path), 'changes')
+    return repository, repository.get_project('changes', 'duplex')
+
+
+def test_commit_pset_change(tmp_path):
+    repository, project = _insert_duplex(tmp_path)
+    try:
+        model = project['model']
+        door = model.by_id('1s1jVhK8z0pgKYcr9jt781')
+        index_version = project['index'].version
+        bim_deserializer.add_property_sets(model, door, {'Pset_Test': {'Checked': 'yes'}},
+                                           project['property_index'], project['changes'])
+        with app.app_context():
+            repository.commit_model('duplex', 'changes')
+
+        # a property change neither touches the relationship index nor the tree
+        assert project['index'].version == index_version
+        assert project['property_index'].get_psets(door)['Pset_Test']['Checked'] == 'yes'
+        assert not project['changes'].has_changes()
+        assert 'Pset_Test' in open(tmp_path / 'duplex.log').read()
+    finally:
+        repository.delete_project('duplex', 'changes')
+        del repository.collections['changes']
+
+
+def test_commit_structure_change(tmp_path):
+    repository, project = _insert_duplex(tmp_path)
+    try:
+        model = project['model']
+        building = model.by_type('IfcBuilding')[0]
+        storey = model.createIfcBuildingStorey(ifcopenshell.guid.new(), None, 'Roof')
+        rel = model.createIfcRelAggregates(ifcopenshell.guid.new(), None, None, None, building, [storey])
+        project['changes'].record_created([storey, rel])
+        with app.app_context():
+            repository.commit_model('duplex', 'changes')
+
+        tree = project['tree']
+        assert tree.names[tree.get_node(storey.GlobalId)] == 'Roof'
+        assert storey in project['index'].get_children(building)
+        reloaded = IfcRelationshipIndex(model)
+        for element in model.by_type('IfcObjectDefinition'):
+            assert [e.id() for e in project['index'].get_geometry_elements(element)] == \
+                   [e.id() for e in reloaded.get_geometry_elements(element)]
+    finally:
+        repository.delete_project('duplex', 'changes')
+        del repository.collections['changes']
+
+
+def test_commit_without_changes(tmp_path):
+    repository, project = _insert_duplex(tmp_path)
+    try:
+        version, index_version = project['version'], project['index'].version
+        with app.app_context():
+            repository.commit_model('duplex', 'changes')
+        # nothing is rebuilt or rewritten
+        assert project['version'] == version
+        assert project['index'].version == index_version
+        assert not os.path.exists(tmp_path / 'duplex.log')
+
+        with app.app_context():
+            repository.commit_model('duplex', 'changes', reload_tree=True)
+        assert project['version'] == version + 1
+        assert project['index'].version > index_version
+    finally:
+        repository.delete_project('duplex', 'changes')
+        del repository.collections['changes']
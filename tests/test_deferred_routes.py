@@ -0,0 +1,75 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import time
+
+from api4be import create_app
+from api4be.components.cache import cache
+from api4be.components.serializer import gim_serializer
+
+app = create_app()
+
+
+def _poll(c, job_url):
+    for _ in range(600):
+        response = c.get(job_url)
+        if response.status_code != 200:
+            return response
+        assert response.get_json()['status'] in ['pending', 'running']
+        time.sleep(0.1)
+
+
+def test_deferred_gim_items_route():
+    route = '/bimapi/gim/collections/pim/items/duplex?type=IfcDoor'
+    with app.test_client() as c:
+        response = c.get(route, headers={'Prefer': 'respond-async'})
+        assert response.status_code == 202
+        job = response.get_json()
+        assert job['status'] in ['pending', 'running', 'done']
+        assert response.headers['Location'] == job['job@bim.navigationLink']
+
+        response = _poll(c, job['job@bim.navigationLink'])
+        assert response.status_code == 303
+        assert response.headers['Location'] == job['result@bim.navigationLink']
+
+        # the result is kept with the job, also served to another request preferring an asynchronous response
+        result = c.get(response.headers['Location']).get_json()
+        assert len(result['features']) > 0
+        assert c.get(route).get_json() == result
+        # evicted memoized responses do not affect the result of the job
+        with app.app_context():
+            cache.delete_memoized(gim_serializer.serialize_ifcelements_as_geojson)
+        assert c.get(job['result@bim.navigationLink']).get_json() == result
+        response = c.get(route, headers={'Prefer': 'respond-async'})
+        assert response.status_code == 200
+        assert response.get_json() == result
+
+
+def test_deferred_geometry_route():
+    route = '/bimapi/bim/collections/pim/projects/duplex/ifcitems/7606d7eb-508f-40ce-a522-9b526ddc7201/geometry'
+    with app.test_client() as c:
+        response = c.get(route, headers={'Prefer': 'respond-async, wait=10'})
+        assert response.status_code == 202
+        response = _poll(c, response.headers['Location'])
+        assert response.status_code == 303
+        result = c.get(response.headers['Location']).get_json()
+        assert c.get(route).get_json() == result
+        assert c.get(route, headers={'Prefer': 'respond-async'}).get_json() == result
+
+
+def test_deferred_job_not_found():
+    with app.test_client() as c:
+        assert c.get('/bimapi/bim/jobs/unknown').status_code == 404
+        assert c.get('/bimapi/bim/jobs/unknown/result').status_code == 404
@@ -0,0 +1,158 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import threading
+import time
+
+import ifcopenshell
+import numpy as np
+import pytest
+
+from api4be import config
+from api4be.components.utils import geometry_pool, geom_utils, gltf_utils
+from api4be.components.utils.guid_utils import get_guids_by_element
+
+ifc_path = 'api4be/data/pim/duplex.ifc'
+model = ifcopenshell.open(ifc_path)
+geometry_pool.register_model(model, lambda: ifc_path)
+
+
+@pytest.fixture
+def processes(monkeypatch):
+    monkeypatch.setattr(config, 'GEOMETRY_PROCESSES', 2)
+    yield
+    geometry_pool._reset_executor(geometry_pool._executor)
+
+
+def test_pool_matches_in_process(processes):
+    doors = model.by_type('IfcDoor')[:3]
+    guids = [get_guids_by_element(door) for door in doors]
+    pooled = (gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {}),
+              geometry_pool.get_2d_geometry_of_ifc_elements(model, 'bbox', guids).wkt)
+
+    config.GEOMETRY_PROCESSES = 0
+    assert pooled == (gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {}),
+                      geometry_pool.get_2d_geometry_of_ifc_elements(model, 'bbox', guids).wkt)
+
+
+def test_pool_rejects_jobs_when_full(processes, monkeypatch):
+    geometry_pool._get_executor()
+    monkeypatch.setattr(geometry_pool, '_job_slots', threading.BoundedSemaphore(1))
+    geometry_pool._job_slots.acquire()
+    with pytest.raises(geometry_pool.GeometryPoolBusy):
+        gltf_utils.get_json_serialized_gltf_of_ifc_element(model.by_type('IfcDoor')[0], {})
+
+
+@pytest.fixture
+def budgets(monkeypatch):
+    yield monkeypatch
+    geom_utils.reset_tessellation_budgets(model)
+
+
+def _wait_for_shapes_over_budget(elements):
+    for _ in range(600):
+        if all(geom_utils.get_shape_over_budget(element) is not None for element in elements):
+            return
+        time.sleep(0.1)
+
+
+def test_placeholder_encloses_shape():
+    for element in model.by_type('IfcDoor')[:3] + model.by_type('IfcSlab')[:3]:
+        vertices = np.array(geom_utils.get_shape_of_ifc_element(element)['vertices']).reshape(-1, 3)
+        placeholder = np.array(geom_utils.get_placeholder_shape(element)['vertices']).reshape(-1, 3)
+        assert np.allclose(placeholder.min(axis=0), vertices.min(axis=0), atol=0.05)
+        assert np.allclose(placeholder.max(axis=0), vertices.max(axis=0), atol=0.05)
+
+
+def _proxy_with_items(items_of_file):
+    # an element at x=100 with the representation items created by items_of_file(file, context)
+    f = ifcopenshell.file(schema='IFC4')
+    origin = f.createIfcAxis2Placement3D(f.createIfcCartesianPoint((0.0, 0.0, 0.0)))
+    f.createIfcProject(ifcopenshell.guid.new(), None, 'Project', None, None, None, None, None,
+                       f.createIfcUnitAssignment([f.createIfcSIUnit(None, 'LENGTHUNIT', None, 'METRE')]))
+    context = f.createIfcGeometricRepresentationContext(None, 'Model', 3, 1e-5, origin, None)
+    representation = f.createIfcShapeRepresentation(context, 'Body', 'SweptSolid', items_of_file(f, context))
+    location = f.createIfcCartesianPoint((100.0, 0.0, 0.0))
+    placement = f.createIfcLocalPlacement(None, f.createIfcAxis2Placement3D(location))
+    return f.createIfcBuildingElementProxy(ifcopenshell.guid.new(), None, 'Proxy', None, None, placement,
+                                           f.createIfcProductDefinitionShape(None, None, [representation]))
+
+
+def _box_solid(f, position=None):
+    # 2 x 4 x 3 box centered on the xy-origin of its position
+    profile = f.createIfcRectangleProfileDef('AREA', None, None, 2.0, 4.0)
+    return f.createIfcExtrudedAreaSolid(profile, position, f.createIfcDirection((0.0, 0.0, 1.0)), 3.0)
+
+
+def _assert_placeholder_extents(element, expected_min, expected_max):
+    placeholder = np.array(geom_utils.get_placeholder_shape(element)['vertices']).reshape(-1, 3)
+    assert np.allclose(placeholder.min(axis=0), expected_min)
+    assert np.allclose(placeholder.max(axis=0), expected_max)
+
+
+def test_placeholder_of_extruded_solid_with_position():
+    # the solid is moved by 10 along x and rotated by 90 degrees around z
+    element = _proxy_with_items(lambda f, context: [_box_solid(f, f.createIfcAxis2Placement3D(
+        f.createIfcCartesianPoint((10.0, 0.0, 0.0)), f.createIfcDirection((0.0, 0.0, 1.0)),
+        f.createIfcDirection((0.0, 1.0, 0.0))))])
+    _assert_placeholder_extents(element, [108.0, -1.0, 0.0], [112.0, 1.0, 3.0])
+
+
+def test_placeholder_of_mapped_item():
+    # the mapped solid is scaled by 2 and moved to (5, 0, 1)
+    def mapped_items(f, context):
+        mapped = f.createIfcShapeRepresentation(context, 'Body', 'SweptSolid', [_box_solid(f)])
+        source = f.createIfcRepresentationMap(f.createIfcAxis2Placement3D(f.createIfcCartesianPoint((0.0, 0.0, 0.0))),
+                                              mapped)
+        target = f.createIfcCartesianTransformationOperator3D(None, None, f.createIfcCartesianPoint((5.0, 0.0, 1.0)),
+                                                              2.0, None)
+        return [f.createIfcMappedItem(source, target)]
+
+    element = _proxy_with_items(mapped_items)
+    _assert_placeholder_extents(element, [103.0, -4.0, 1.0], [107.0, 4.0, 7.0])
+
+
+def test_request_budget_substitutes_placeholders(budgets):
+    doors = model.by_type('IfcDoor')[:3]
+    complete = gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {})
+
+    budgets.setattr(config, 'GEOMETRY_REQUEST_BUDGET', 1e-9)
+    gltf = gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {})
+    assert gltf['extras']['placeholders'] == [get_guids_by_element(door)['json_guid'] for door in doors]
+    assert all(node['extras']['placeholder'] == 'bbox' for node in gltf['nodes'])
+
+    # tessellated in the background meanwhile
+    _wait_for_shapes_over_budget(doors)
+    assert gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {}) == complete
+
+
+def test_element_budget_keeps_slow_shapes(budgets):
+    door = model.by_type('IfcDoor')[0]
+    budgets.setattr(config, 'GEOMETRY_ELEMENT_BUDGET', 1e-9)
+    gltf = gltf_utils.get_json_serialized_gltf_of_ifc_element(door, {})
+    assert 'extras' not in gltf
+    assert geom_utils.get_shape_over_budget(door) is not None
+    assert gltf_utils.get_json_serialized_gltf_of_ifc_element(door, {}) == gltf
+
+
+def test_pool_request_budget_keeps_late_shapes(processes, budgets):
+    doors = model.by_type('IfcDoor')[:3]
+    complete = gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {})
+
+    budgets.setattr(config, 'GEOMETRY_REQUEST_BUDGET', 1e-9)
+    gltf = gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {})
+    assert len(gltf['extras']['placeholders']) == 3
+    _wait_for_shapes_over_budget(doors)
+    assert gltf_utils.get_json_serialized_gltf_of_ifc_elements(doors, {}) == complete
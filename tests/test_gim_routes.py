@@ -64,3 +64,14 @@ def test_item_duplex_groundlevel_composed_route():
         with open(resource_path + quote(route) + '.json', 'r') as file:
             ground_truth = json.load(file)
             assert json_response == ground_truth
+
+
+def test_item_duplex_groundlevel_properties_route():
+    with app.test_client() as c:
+        route = '/bimapi/gim/collections/pim/items/duplex:7b7032cc-b822-417b-9aea-6429f95d6512'
+        response = c.get(route + '?properties=globalId,type')
+        json_response = response.get_json()
+        assert json_response['properties'] == {
+            'globalId': '7b7032cc-b822-417b-9aea-6429f95d6512',
+            'type': 'IfcBuildingStorey'
+        }
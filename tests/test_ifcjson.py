@@ -0,0 +1,54 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import ifcopenshell
+
+from api4be.ifcjson import IFC2JSON4, ifc2json4
+
+ifc_path = 'api4be/data/pim/duplex.ifc'
+model = ifcopenshell.open(ifc_path)
+options = dict(COMPACT=True, NO_INVERSE=False, EMPTY_PROPERTIES=True, NO_OWNERHISTORY=True, GEOMETRY=False)
+
+
+def test_stream_matches_spf2json():
+    expected = json.loads(json.dumps(IFC2JSON4(model, **options).spf2Json()))
+    streamed = json.loads(''.join(IFC2JSON4(model, **options).spf2JsonStream(chunkSize=1024)))
+    assert streamed['data'] == expected['data']
+
+
+def test_parallel_stream_matches_stream():
+    expected = json.loads(''.join(IFC2JSON4(model, **options).spf2JsonStream()))
+    parallel = json.loads(''.join(IFC2JSON4(model, **options).spf2JsonStream(processes=2, ifcPath=ifc_path)))
+    assert parallel['data'] == expected['data']
+
+
+def test_parallel_executor_created_once():
+    with ThreadPoolExecutor(8) as threads:
+        executors = list(threads.map(lambda _: ifc2json4._getExecutor(3), range(8)))
+    assert all(executor is executors[0] for executor in executors)
+    ifc2json4._executors.pop(3).shutdown()
+
+
+def test_bounded_object_cache_matches_stream():
+    expected = json.loads(''.join(IFC2JSON4(model, **options).spf2JsonStream()))
+    serializer = IFC2JSON4(model, OBJECT_CACHE_SIZE=16, **options)
+    serializer.collectRootObjects()
+    data = []
+    for jsonObject in serializer.iterJsonObjects():
+        assert len(serializer.objectCache) <= 16
+        data.append(jsonObject)
+    assert json.loads(json.dumps(data)) == expected['data']
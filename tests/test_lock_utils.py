@@ -0,0 +1,78 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import threading
+
+import pytest
+
+from api4be.components.utils.lock_utils import ReadWriteLock
+
+
+def test_readers_share_lock():
+    lock = ReadWriteLock()
+    both_reading = threading.Barrier(2, timeout=5)
+
+    def read():
+        with lock.read():
+            both_reading.wait()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    read()
+    reader.join()
+
+
+def test_writer_excludes_readers():
+    lock = ReadWriteLock()
+    events = []
+    writer_waiting = threading.Event()
+
+    def write():
+        writer_waiting.set()
+        with lock.write():
+            events.append('write')
+
+    def read():
+        with lock.read():
+            events.append('read')
+
+    with lock.read():
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer_waiting.wait()
+        while lock._waiting_writers == 0:
+            pass
+        # a waiting writer is preferred over new readers
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(0.2)
+        assert events == []
+    writer.join()
+    reader.join()
+    assert events == ['write', 'read']
+
+
+def test_reentrant_lock():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+    with lock.read():
+        with lock.read():
+            with pytest.raises(RuntimeError):
+                lock.acquire_write()
+    with lock.write():
+        pass
@@ -0,0 +1,123 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import gc
+import os
+import time
+
+import pytest
+
+from api4be import config, create_app
+from api4be.components.cache import cache
+from api4be.components.models.ingest_job import IngestJob
+from api4be.components.repositories.ifc_file_repository import IfcFileRepository
+from api4be.components.service.deferred_service import DeferredService
+from api4be.components.service.ingest_service import IngestService
+from api4be.components.utils import geometry_pool, geom_utils
+from api4be.ifcjson import ifc2json4
+
+
+@pytest.fixture
+def prefork_app(tmp_path, monkeypatch):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path))
+    yield create_app(prefork=True)
+    IfcFileRepository().read_only = False
+    gc.unfreeze()
+
+
+def test_prefork_app(prefork_app, tmp_path):
+    assert prefork_app.config['CACHE_TYPE'] == 'FileSystemCache'
+    assert gc.get_freeze_count() > 0
+    route = '/bimapi/bim/collections/pim/projects/duplex/ifcitems/7606d7eb-508f-40ce-a522-9b526ddc7201'
+
+    with prefork_app.test_client() as c:
+        response = c.post('/bimapi/bim/collections/pim/projects/duplex/psets', json={})
+        assert response.status_code == 405
+
+    # a forked worker serves the shared models and caches its responses for the other workers
+    pid = os.fork()
+    if pid == 0:
+        with prefork_app.test_client() as c:
+            status = c.get(route + '?format=ifcjson').status_code
+        os._exit(0 if status == 200 else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert len(os.listdir(tmp_path)) > 0
+
+    with prefork_app.test_client() as c:
+        response = c.get(route + '?format=ifcjson')
+        assert response.status_code == 200
+        assert response.get_json()['type'] == 'IfcDoor'
+
+
+
+def test_prefork_cache_cleared(tmp_path, monkeypatch):
+    # responses cached before a restart are dropped, new ones expire
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path))
+    stale_app = create_app(prefork=True)
+    with stale_app.app_context():
+        cache.set('stale', 'response')
+    assert len(os.listdir(tmp_path)) > 0
+    try:
+        app = create_app(prefork=True)
+        assert app.config['CACHE_DEFAULT_TIMEOUT'] == config.PREFORK_CACHE_TIMEOUT
+        with app.app_context():
+            assert cache.get('stale') is None
+    finally:
+        IfcFileRepository().read_only = False
+        gc.unfreeze()
+
+
+def _worker_locks():
+    return [IngestService.lock, DeferredService.lock, geometry_pool._executor_lock, geom_utils._over_budget_lock,
+            ifc2json4._executorsLock]
+
+
+def test_prefork_worker_state(prefork_app):
+    # pools, unfinished jobs and locks taken by threads of the master while forking are reset in a worker
+    route = '/bimapi/gim/collections/pim/items/duplex?type=IfcDoor'
+    job = IngestJob('pim', 'ingested', ['parse'])
+    IngestService.jobs[job.id] = job
+    master_locks = _worker_locks()
+    for lock in master_locks:
+        lock.acquire()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                locks = _worker_locks()
+                assert all(lock.acquire(blocking=False) for lock in locks)
+                for lock in locks:
+                    lock.release()
+                assert IngestService.executor is None and DeferredService.executor is None
+                assert geometry_pool._executor is None and geometry_pool._job_slots is None
+                assert job.id not in IngestService.jobs
+                # a deferred request is computed by a pool of the worker
+                with prefork_app.test_client() as c:
+                    response = c.get(route, headers={'Prefer': 'respond-async'})
+                    job_url = response.headers['Location']
+                    for _ in range(600):
+                        response = c.get(job_url)
+                        if response.status_code != 200:
+                            break
+                        time.sleep(0.1)
+                status = 0 if response.status_code == 303 else 1
+            finally:
+                os._exit(status)
+    finally:
+        for lock in master_locks:
+            lock.release()
+        IngestService.jobs.pop(job.id, None)
+    assert os.waitpid(pid, 0)[1] == 0
@@ -0,0 +1,60 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import ifcopenshell
+
+from api4be.components.models.property_index import IfcPropertyIndex
+from api4be.components.models.query_index import IfcQueryIndex
+from api4be.components.models.relationship_index import IfcRelationshipIndex
+
+model = ifcopenshell.open('api4be/data/pim/duplex.ifc')
+index = IfcRelationshipIndex(model)
+property_index = IfcPropertyIndex(model)
+query_index = IfcQueryIndex(model, index, property_index)
+
+QUERIES = [
+    ('IfcWall', None, None),
+    (None, 'Level 1', None),
+    ('IfcDoor', 'Level 1', [('Pset_DoorCommon', 'IsExternal', 'true')]),
+    (None, None, [('Pset_WallCommon', 'LoadBearing', 'false')]),
+]
+
+
+def test_query_columns_filled_concurrently():
+    # after a change of the relationship index the columns are rebuilt on first use by the reading threads
+    expected = [query_index.query(*query) for query in QUERIES]
+    assert all(expected)
+    concurrent_index = IfcQueryIndex(model, index, property_index)
+
+    def run(offset):
+        for i in range(len(QUERIES)):
+            position = (offset + i) % len(QUERIES)
+            assert concurrent_index.query(*QUERIES[position]) == expected[position]
+
+    interval = sys.getswitchinterval()
+    # threads are switched often, so the builds interleave
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            for _ in range(20):
+                concurrent_index.index_version = -1
+                concurrent_index.properties = {}
+                for future in [executor.submit(run, offset) for offset in range(8)]:
+                    future.result()
+    finally:
+        sys.setswitchinterval(interval)
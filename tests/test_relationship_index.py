@@ -0,0 +1,62 @@
+# Copyright (C) 2024-2025  Stefan Herlé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see {@literal<http://www.gnu.org/licenses/>}.
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import ifcopenshell
+
+from api4be.components.models.relationship_index import IfcRelationshipIndex
+from api4be.components.utils.spatial_tree_utils import collect_containing_geometry_elements
+
+model = ifcopenshell.open('api4be/data/pim/duplex.ifc')
+index = IfcRelationshipIndex(model)
+
+
+def test_geometry_elements_match_relationship_walk():
+    for element in model.by_type('IfcObjectDefinition'):
+        expected = [e.id() for e in collect_containing_geometry_elements(element)]
+        indexed = [e.id() for e in collect_containing_geometry_elements(element, index)]
+        assert indexed == expected
+
+
+def test_parent_of_storey():
+    storey = model.by_id('1xS3BCk291UvhgP2dvNMKI')
+    assert index.get_parent(storey).is_a('IfcBuilding')
+
+
+def test_geometry_elements_filled_concurrently():
+    # after a rebuild of the flat list the ranges are filled on first use by the reading threads
+    concurrent_index = IfcRelationshipIndex(model)
+    elements = model.by_type('IfcObjectDefinition')
+    expected = {element.id(): [e.id() for e in index.get_geometry_elements(element)] for element in elements}
+
+    def collect(offset):
+        for element in elements[offset:] + elements[:offset]:
+            assert [e.id() for e in concurrent_index.get_geometry_elements(element)] == expected[element.id()]
+
+    interval = sys.getswitchinterval()
+    # threads are switched often, so the fills interleave
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            for _ in range(20):
+                concurrent_index.geometry_elements = []
+                concurrent_index.geometry_ranges = {}
+                offsets = range(0, len(elements), len(elements) // 8)
+                for future in [executor.submit(collect, offset) for offset in offsets]:
+                    future.result()
+    finally:
+        sys.setswitchinterval(interval)
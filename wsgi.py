@@ -0,0 +1,5 @@
+from api4be import create_app
+
+# app of a pre-fork server, created once in the master and shared by the workers, e.g.
+# gunicorn --preload --workers 4 wsgi:app
+app = create_app(prefork=True)